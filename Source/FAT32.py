@@ -1,6 +1,19 @@
 from enum import Flag
+from array import array
+from collections import deque
+import codecs
+import hashlib
 import re
+import struct
+import sys
 import datetime
+from volume import Volume, ExtentFile, devicePath, volumeLabel, normName, menuPath
+import snapshot
+from search import SearchIndex
+from grep import grepFiles
+from extract import Extractor
+from analysis import analyzeFat32
+from stats import PhaseTimer
 # class for FAT32 entry status
 
 # function for converting byte to date
@@ -39,8 +52,7 @@ class Status(Flag):
     NORMAL = 0xFF
 
 def read_sector(data, start, cnt, bytes_per_sector):
-    data.seek(start * bytes_per_sector)
-    return data.read(cnt * bytes_per_sector)
+    return data.read_sector(start, cnt, bytes_per_sector)
     
 # Read FAT32 boot sector
 class BootSector:
@@ -52,7 +64,11 @@ class BootSector:
         self.fat_count = int.from_bytes(data[16:17], byteorder='little')
         self.total_sectors = int.from_bytes(data[32:36], byteorder='little')
         self.fat_size = int.from_bytes(data[36:40], byteorder='little')
+        self.ext_flags = int.from_bytes(data[40:42], byteorder='little')
+        # with mirroring disabled (bit 7) only the FAT numbered in bits 0-3 is in use
+        self.active_fat = self.ext_flags & 0x0F if (self.ext_flags & 0x80) else 0
         self.root_cluster = int.from_bytes(data[44:48], byteorder='little')
+        self.fsinfo_sector = int.from_bytes(data[48:50], byteorder='little')
         self.volume_label = name
         self.fat_type = data[54:62]
         self.boot_code = data[62:510]
@@ -66,160 +82,262 @@ class BootSector:
     def __str__(self):
         return f'{self.oem_name.decode("utf-8").strip()}'
 
+# the active FAT decoded in one pass into a compact array of 32-bit entries
+# FAT entries read at a time while chains are followed on demand (one 4 KiB page)
+FAT_PAGE_ENTRIES = 1024
+
+# the active FAT, `length` bytes at byte offset `start` of the volume
+# chains are followed a page at a time, so answering about one file reads only the pages its chain crosses;
+# load() decodes the whole table for work that touches every chain (tree walks, search, analysis)
 class FAT:
-    def __init__(self, data):
-        self.data = data
-        self.size = len(data) / 4
-        self.FAT = []
-        for i in range(0, len(data), 4):
-            self.FAT.append(int.from_bytes(data[i:i+4], byteorder='little'))
-            
+    def __init__(self, volume, start, length):
+        self.volume = volume
+        self.start = start
+        self.length = length - length % 4
+        self.size = self.length // 4
+        self.table = None
+        self.pages = {}
+
+    # the raw table as little-endian bytes
+    @property
+    def data(self):
+        return self.volume.read(self.start, self.length)
+
+    # the whole table as an array('I'), decoded on first use
+    @property
+    def FAT(self):
+        if (self.table == None):
+            self.load()
+        return self.table
+
+    def load(self):
+        if (self.table != None):
+            return
+        table = array('I')
+        table.frombytes(self.data)
+        if (sys.byteorder != 'little'):
+            table.byteswap()
+        self.table = table
+        self.pages = {}
+
+    def page(self, number):
+        page = self.pages.get(number)
+        if (page == None):
+            page = array('I')
+            page.frombytes(self.volume.read(self.start + number * FAT_PAGE_ENTRIES * 4, FAT_PAGE_ENTRIES * 4))
+            if (sys.byteorder != 'little'):
+                page.byteswap()
+            self.pages[number] = page
+        return page
+
+    # entry of `cluster` with the reserved bits cleared
+    def entry(self, cluster):
+        if (self.table != None):
+            return self.table[cluster] & 0x0FFFFFFF
+        return self.page(cluster // FAT_PAGE_ENTRIES)[cluster % FAT_PAGE_ENTRIES] & 0x0FFFFFFF
+
+    # clusters of the chain starting at `start`, without the end-of-chain marker
     def get_cluster_chain(self, start):
         chain = []
-        while True:
+        while (2 <= start < self.size and start < 0x0FFFFFF7 and len(chain) < self.size):
             chain.append(start)
-            if start >= 0x0FFFFFF8:
-                break
-            start = self.FAT[start]
+            start = self.entry(start)
         return chain
+
+    # the same chain as a list of (first cluster, cluster count) runs of consecutive clusters,
+    # optionally stopping once `limit` clusters have been collected
+    def get_cluster_extents(self, start, limit = None):
+        extents = []
+        entry = self.entry
+        count = 0
+        if (limit == None):
+            limit = self.size
+        while (2 <= start < self.size and start < 0x0FFFFFF7 and count < limit):
+            first = start
+            length = 1
+            nxt = entry(start)
+            while (nxt == start + 1 and nxt < self.size):
+                start = nxt
+                length += 1
+                nxt = entry(start)
+            extents.append((first, length))
+            count += length
+            start = nxt
+        return extents
     
+# 32-byte directory entry: name, attr, NT flags, create tenths, create time/date, access date,
+# cluster high, write time/date, cluster low, size
+ENTRY_FORMAT = struct.Struct('<11sBBBHHHHHHHI')
+
+# a directory entry decoded with one unpack; the five date and time words are kept packed
+# in one integer and only turned into date/time objects when they are read
 class Entry: 
-    def __init__(self, data):
-        self.name = data[0:11]
+    __slots__ = ('name', 'longFileName', 'attrValue', 'statusValue', 'rawTimes', 'starting_cluster', 'file_size')
+
+    def __init__(self, data, offset = 0):
+        self.setFields(ENTRY_FORMAT.unpack_from(data, offset))
+
+    # build an entry from a tuple already unpacked with ENTRY_FORMAT
+    @classmethod
+    def fromFields(cls, fields):
+        entry = cls.__new__(cls)
+        entry.setFields(fields)
+        return entry
+
+    def setFields(self, fields):
+        (self.name, self.attrValue, ntRes, createTenth, createTime, createDate, accessDate,
+         clusterHigh, writeTime, writeDate, clusterLow, self.file_size) = fields
         self.longFileName = ''
-        self.attr = Attribute(int.from_bytes(data[11:12], byteorder='little'))
-        status = int.from_bytes(data[0:1], byteorder='little')
+        status = self.name[0]
         if status != 0x00 and status != 0xE5:
             status = 0xFF
-        
-        self.status = Status(status)
-            
-        self.reserved = int.from_bytes(data[12:20], byteorder='little')
-        create_time = data[14:16]
-        create_date = data[16:18]
-
-        self.create_time = byteToTime(int.from_bytes(create_time, byteorder='little'))
-        self.create_date = byteToDate(int.from_bytes(create_date, byteorder='little'))
-             
-        last_access_date = data[18:20]
-        
-        self.last_access_date = byteToDate(int.from_bytes(last_access_date, byteorder='little'))
-        
-        last_write_time = data[22:24]
-        last_write_date = data[24:26]
-        
-        self.last_write_time = byteToTime(int.from_bytes(last_write_time, byteorder='little'))
-        
-        year = int.from_bytes(last_write_date, byteorder='little')
-        month = int.from_bytes(last_write_date, byteorder='little')
-        day = int.from_bytes(last_write_date, byteorder='little')
-        
-        self.last_write_date = byteToDate(int.from_bytes(last_write_date, byteorder='little'))
-        
-        self.starting_cluster = int.from_bytes(data[0x14:0x16][::-1] + data[0x1A:0x1C][::-1], byteorder='big')
-        self.file_size = int.from_bytes(data[28:32], byteorder='little')
-        self.extension = data[8:11]
+        self.statusValue = status
+        self.starting_cluster = (clusterHigh << 16) | clusterLow
+        self.rawTimes = createTime | (createDate << 16) | (accessDate << 32) | (writeTime << 48) | (writeDate << 64)
+
+    # the reserved bits 6-7 are masked off so stray values do not break the flag
+    @property
+    def attr(self):
+        return Attribute(self.attrValue & 0x3F)
+
+    @property
+    def status(self):
+        return Status(self.statusValue)
+
+    @property
+    def extension(self):
+        return self.name[8:11]
+
+    @property
+    def create_time(self):
+        return byteToTime(self.rawTimes & 0xFFFF)
+
+    @property
+    def create_date(self):
+        return byteToDate((self.rawTimes >> 16) & 0xFFFF)
+
+    @property
+    def last_access_date(self):
+        return byteToDate((self.rawTimes >> 32) & 0xFFFF)
+
+    @property
+    def last_write_time(self):
+        return byteToTime((self.rawTimes >> 48) & 0xFFFF)
+
+    @property
+    def last_write_date(self):
+        return byteToDate((self.rawTimes >> 64) & 0xFFFF)
 
     def __str__(self):
         return f'{self.name.decode("utf-8").strip()}'
 
-class RDET:
-    def __init__(self, pointer, offset, bytes_per_sector):
-        self.entries = []
-        self.size = 0
-        self.sector = 0
-        pointer.seek(offset)
-        # print('offset:', offset)
-        self.read_entries(pointer, bytes_per_sector)
-
-    def read_entries(self, pointer, bytes_per_sector=512):
-        nameBuffer = ''
-        self.sector = 0
-        while True:
-            data = pointer.read(bytes_per_sector)
-            self.sector += 1
-            for i in range(0, len(data), 32):
-                entry = Entry(data[i:i+32])
-                if entry.status == Status.EMPTY:
-                    self.size = len(self.entries)
-                    return
-                if entry.status == Status.DELETED:
-                    continue
-                if entry.attr == Attribute.LONG_NAME:
-                    string = data[i+1:i+11] + data[i+14:i+26] + data[i+28:i+32]
-                    for i in range(0, len(string), 2):
-                        if string[i:i+2] == b'\xff\xff':
-                            string = string[:i]
-                    nameBuffer = string.decode('utf-16-le') + nameBuffer
-                    continue
-                if nameBuffer:
-                    entry.longFileName = nameBuffer
-                    nameBuffer = ''
-                self.entries.append(entry)
-            
-
-    def find_entry(self, name):
-        for entry in self.entries:
-            # print(entry.name.decode('utf-8').strip().lower())
-            if entry.name.decode('utf-8').strip().lower() == name.lower():
-                return entry
-            if entry.longFileName.lower() == name.lower():
-                return entry
-        return None           
-                
-    def __str__(self) -> str:
-        return f'{self.name}'
-    
-def read_chain(pointer, starting_cluster, sectors_per_cluster, bytes_per_sector, fat, RDET_start):
-    data = b''
-    for cluster in fat.get_cluster_chain(starting_cluster):
-        data += read_sector(pointer, RDET_start + (cluster - 2) * sectors_per_cluster, sectors_per_cluster, bytes_per_sector)
+# read a cluster chain, stopping at file_size when given
+# runs of consecutive clusters are read with one request each into a preallocated buffer
+# direct reads bypass the volume map (see Volume.readinto)
+def read_chain(pointer, starting_cluster, sectors_per_cluster, bytes_per_sector, fat, RDET_start, file_size = None, direct = False):
+    cluster_size = sectors_per_cluster * bytes_per_sector
+    limit = None
+    if (file_size != None):
+        limit = (file_size + cluster_size - 1) // cluster_size
+    extents = fat.get_cluster_extents(starting_cluster, limit)
+    total = sum(length for first, length in extents) * cluster_size
+    if (file_size != None):
+        total = min(total, file_size)
+    # a single run is served straight from the volume without copying
+    if (len(extents) == 1 and not direct):
+        first, length = extents[0]
+        return read_sector(pointer, RDET_start + (first - 2) * sectors_per_cluster, length * sectors_per_cluster, bytes_per_sector)[:total]
+    data = bytearray(total)
+    view = memoryview(data)
+    pos = 0
+    for first, length in extents:
+        if (pos >= total):
+            break
+        size = min(length * cluster_size, total - pos)
+        read = pointer.readinto((RDET_start + (first - 2) * sectors_per_cluster) * bytes_per_sector, view[pos:pos + size], direct)
+        pos += read
+        if (read < size):
+            break
+    view.release()
+    if (pos < total):
+        del data[pos:]
     return data
 
+# checksum of an 8.3 name, stored in every long name slot that belongs to it
+def lfnChecksum(name):
+    total = 0
+    for c in name:
+        total = (((total & 1) << 7) + (total >> 1) + c) & 0xFF
+    return total
+
+# decode a whole directory buffer in one pass
+# the first and attribute bytes of every slot are sliced out at once to find the end of the directory
+# and the long name slots, long names are gathered as pieces and decoded once at their short entry
+def parseDirectory(data):
+    view = memoryview(data)
+    count = len(view) // 32
+    firsts = bytes(view[0:count * 32:32])
+    attrs = bytes(view[11:count * 32:32])
+    end = firsts.find(0)
+    if (end < 0):
+        end = count
+    entries = []
+    pieces = []
+    for i, fields in enumerate(ENTRY_FORMAT.iter_unpack(view[:end * 32])):
+        if (firsts[i] == 0xE5):
+            pieces = []
+            continue
+        if ((attrs[i] & 0x3F) == 0x0F):
+            # slots are stored last piece first
+            pos = i * 32
+            pieces.append((view[pos + 1:pos + 11], view[pos + 14:pos + 26], view[pos + 28:pos + 32], fields[3]))
+            continue
+        entry = Entry.fromFields(fields)
+        if (pieces):
+            checksum = lfnChecksum(fields[0])
+            if (all(piece[3] == checksum for piece in pieces)):
+                name = b''.join(b''.join(piece[:3]) for piece in reversed(pieces)).decode('utf-16-le', errors = 'replace')
+                cut = name.find('\x00')
+                if (cut >= 0):
+                    name = name[:cut]
+                entry.longFileName = name.rstrip('\uffff')
+            pieces = []
+        entries.append(entry)
+    view.release()
+    return entries
+
+# entries of a directory read into memory, the root directory is read through its cluster chain like any other
 class SDET:
     def __init__(self, data):
-        self.entries = []
-        self.read_entries(data)
-        
-    def read_entries(self, data):
-        nameBuffer = ''
-        self.sector = 0
-        for i in range(0, len(data), 32):
-            entry = Entry(data[i:i+32])
-            if entry.status == Status.EMPTY:
-                self.size = len(self.entries)
-                return
-            if entry.status == Status.DELETED:
-                continue
-            if entry.attr == Attribute.LONG_NAME:
-                string = data[i+1:i+11] + data[i+14:i+26] + data[i+28:i+32]
-                for i in range(0, len(string), 2):
-                    if string[i:i+2] == b'\xff\xff':
-                        string = string[:i]
-                nameBuffer = string.decode('utf-16-le') + nameBuffer
-                continue
-            if nameBuffer:
-                entry.longFileName = nameBuffer
-                nameBuffer = ''
-            self.entries.append(entry)
+        self.entries = parseDirectory(data)
+        self.size = len(self.entries)
 
     def find_entry(self, name):
+        name = normName(name)
         for entry in self.entries:
-            # print(entry.name.decode('utf-8').strip().lower())
-            if entry.name.decode('utf-8').strip().lower() == name.lower():
+            if normName(entry.name.decode('utf-8', errors = 'replace')) == name or normName(entry.longFileName) == name:
                 return entry
-            if entry.longFileName.lower() == name.lower():
-                return entry
-        return None           
-                
-    def __str__(self) -> str:
-        return f'{self.name}' 
+        return None
+
+class RDET(SDET):
+    pass
+
+# 8.3 name of a directory entry as NAME.EXT
+def shortName(entry):
+    extension = ''.join(entry.extension.decode(errors = 'replace').split('\x00')).strip()
+    name = ''.join(entry.name[0:8].decode(errors = 'replace').split('\x00')).strip()
+    if (extension != ''):
+        name = name + '.' + extension
+    return name
 
 class Node:
     def __init__(self, dir = None, entry = None, isRoot = False):
         self.isRoot = isRoot
         self.parent = None
         self.children = []
+        self.loaded = False
+        # children by normalised long and 8.3 name, built on the first lookup
+        self.index = None
         self.info = entry
         self.dir = dir
         self.name = ''
@@ -229,22 +347,92 @@ class Node:
         return self.name
         
 class FAT32:
-    def __init__(self, name):
+    # name is a drive letter, an image file or a block device; offset is the partition start in bytes
+    # with snapshotDir set, the directory tree is reloaded from a saved snapshot when the volume is unchanged
+    # workers above 1 make whole-tree walks keep that many directory reads in flight on a thread pool
+    def __init__(self, name, offset = 0, snapshotDir = None, workers = None):
         self.name = name
-        with open(f'\\\\.\\{self.name}:', 'rb') as f:
-            self.data = f.read(512)
-            self.boot_sector = BootSector(self.data, self.name + ':')
-        self.ptr = open(f'\\\\.\\{self.name}:', 'rb')
-        self.fat = FAT(read_sector(self.ptr, self.boot_sector.reserved_sectors, self.boot_sector.fat_size * self.boot_sector.fat_count, self.boot_sector.bytes_per_sector))
-        self.RDET = RDET(self.ptr, self.boot_sector.RDET_start * self.boot_sector.bytes_per_sector, self.boot_sector.bytes_per_sector)
-        self.root = Node(dir = self.name + ':', entry = None, isRoot = True)
+        self.workers = workers
+        self.label = volumeLabel(name)
+        self.timer = PhaseTimer()
+        with self.timer.phase('boot parse'):
+            self.ptr = Volume(devicePath(name), offset)
+            self.data = bytes(self.ptr.read(0, 512))
+            self.boot_sector = BootSector(self.data, self.label)
+        bs = self.boot_sector
+        # read on demand, see FAT
+        self.fat = FAT(self.ptr, (bs.reserved_sectors + bs.active_fat * bs.fat_size) * bs.bytes_per_sector, bs.fat_size * bs.bytes_per_sector)
+        # the root directory and the tree below it are read on demand
+        self.RDET = None
+        self.root = Node(dir = self.label, entry = None, isRoot = True)
         self.curNode = self.root
-        self.get_dir_tree()
+        self.pathIndex = {}
+        self.searchIndex = None
+        self.snapshotDir = snapshotDir
+        self.snapshotKey = snapshot.snapshotKey('FAT32', self.data, self.label)
+        if (snapshotDir != None):
+            with self.timer.phase('snapshot load'):
+                self.loadSnapshot()
 #       data_a = read_chain(cu, 5, boot_sector.sectors_per_cluster, boot_sector.bytes_per_sector, fat, boot_sector.RDET_start)
 #       SDET_a = SDET(data_a)
         
+    # starting clusters of the directories whose entries have been read so far
+    def loadedDirClusters(self):
+        clusters = []
+        stack = [self.root]
+        while (len(stack) > 0):
+            node = stack.pop()
+            if (not node.loaded):
+                continue
+            clusters.append(self.boot_sector.root_cluster if node.isRoot else node.info.starting_cluster)
+            for child in node.children:
+                if (child.info.attr & Attribute.DIRECTORY):
+                    stack.append(child)
+        return clusters
+
+    # cheap change signature: boot sector, FSInfo sector and the raw clusters of the given directories
+    def snapshotSignature(self, dirClusters):
+        bs = self.boot_sector
+        digest = hashlib.blake2b(digest_size = 16)
+        digest.update(self.data)
+        digest.update(read_sector(self.ptr, bs.fsinfo_sector, 1, bs.bytes_per_sector))
+        for cluster in dirClusters:
+            digest.update(cluster.to_bytes(4, byteorder='little'))
+            digest.update(read_chain(self.ptr, cluster, bs.sectors_per_cluster, bs.bytes_per_sector, self.fat, bs.RDET_start))
+        return digest.hexdigest()
+
+    # replace the tree with the saved one if none of its directories changed since it was saved
+    def loadSnapshot(self):
+        header = snapshot.loadSnapshotHeader(self.snapshotDir, self.snapshotKey)
+        if (header == None or not isinstance(header.get('dirs'), list)):
+            return False
+        root = snapshot.loadSnapshot(self.snapshotDir, self.snapshotKey, self.snapshotSignature(header['dirs']))
+        if (root == None):
+            return False
+        self.root = root
+        self.curNode = root
+        self.pathIndex = {}
+        self.searchIndex = None
+        return True
+
+    # save the part of the tree read so far
+    def saveSnapshot(self):
+        if (self.snapshotDir == None):
+            return False
+        dirs = self.loadedDirClusters()
+        return snapshot.saveSnapshot(self.snapshotDir, self.snapshotKey, self.snapshotSignature(dirs), self.root, {'dirs': dirs})
+
+    # I/O counters of the volume and wall-clock seconds per phase since it was opened (or resetStats), as a dict;
+    # 'profile' holds the cProfile report of the timed phases when CENT_EXPLORER_PROFILE is set
+    def getStats(self):
+        return {'fileSystem': 'FAT32', 'io': self.ptr.stats.asDict(), 'phases': dict(self.timer.times), 'profile': self.timer.profileReport()}
+
+    def resetStats(self):
+        self.ptr.stats.reset()
+        self.timer.reset()
+
     def getVolumeInfo(self):
-        print('Volume name: ', self.name + ':')
+        print('Volume name: ', self.label)
         print('OEM_Name: ', self.boot_sector.oem_name.decode())
         print('Bytes per sector: ', self.boot_sector.bytes_per_sector)
         print('Sectors per cluster: ', self.boot_sector.sectors_per_cluster)
@@ -259,21 +447,31 @@ class FAT32:
         offset = reserved_sectors + (size_of_fat * num_fat_copies) + ((cluster_index - 2) * sectors_per_cluster)
         return offset
     
-    def vis(self, start_cluster, dir, parRoot = None):
+    # raw entries of a directory node, the root directory is read once and kept in self.RDET
+    def dirEntries(self, node, direct = False):
+        bs = self.boot_sector
+        if (node.isRoot):
+            if (self.RDET == None):
+                self.RDET = RDET(read_chain(self.ptr, bs.root_cluster, bs.sectors_per_cluster, bs.bytes_per_sector, self.fat, bs.RDET_start, direct = direct))
+            return self.RDET.entries
+        return SDET(read_chain(self.ptr, node.info.starting_cluster, bs.sectors_per_cluster, bs.bytes_per_sector, self.fat, bs.RDET_start, direct = direct)).entries
+
+    # load the direct children of a directory node (the root when parRoot is None)
+    # from curEntry when the entries were already read
+    def vis(self, start_cluster, dir, parRoot = None, curEntry = None):
         if (parRoot == None):
             parRoot = self.root
-        curEntry = []
-        if (parRoot == self.root):
-            curEntry = self.RDET.entries
-        else:
-            tmp = read_chain(self.ptr, start_cluster, self.boot_sector.sectors_per_cluster, self.boot_sector.bytes_per_sector, self.fat, self.boot_sector.RDET_start)
-            curEntry = SDET(tmp).entries
+        if (curEntry == None):
+            curEntry = self.dirEntries(parRoot)
+        parRoot.loaded = True
         for i in curEntry:
-            if (i.starting_cluster == start_cluster):
+            # empty files have cluster 0, which is also how the root is passed in
+            if (start_cluster != 0 and i.starting_cluster == start_cluster):
                 continue 
             if (i.name.strip() == b'.' or i.name.strip() == b'..'):
                 continue
-            if ((not (i.attr & Attribute.DIRECTORY)) and (not (i.attr & Attribute.ARCHIVE))):
+            # the volume label, files need not have the archive bit set
+            if (i.attr & Attribute.VOLUME_ID):
                 continue
             if ((i.attr & Attribute.HIDDEN)):
                 continue
@@ -282,48 +480,114 @@ class FAT32:
             curNode = Node(entry = i)
             curNode.parent = parRoot
             parRoot.children.append(curNode)
-            tmpDir = dir
-            if (i.longFileName != ''):        
-                i.longFileName.replace('\x00', '')
+            if (i.longFileName != ''):
+                # the long name already carries the extension
                 i.longFileName = ''.join(i.longFileName.split('\x00'))
-                extension = curNode.info.extension.decode().strip()
-                extension.replace('\x00', '')
-                extension = ''.join(extension.split('\x00'))
-                if (extension != ''):
-                    extension = '.' + extension
-                extension = extension.lower()         
-                curNode.setName(i.longFileName.strip(extension) + extension)
-                tmpDir = dir + '\\' + i.longFileName + extension
+                curName = i.longFileName.strip()
             else:
-                extension = curNode.info.extension.decode().strip()
-                extension.replace('\x00', '')
-                extension = ''.join(extension.split('\x00'))
-                curName = i.name.decode().strip(extension).strip()
-                curName.replace('\x00', '')
-                curName = ''.join(curName.split('\x00'))
-                if (extension != ''):
-                    extension = '.' + extension
-                curNode.setName(curName + extension)
-                tmpDir = dir + '\\' + curName + extension
-            curNode.dir = tmpDir
-            if (i.attr & Attribute.DIRECTORY):
-                self.vis(i.starting_cluster, tmpDir, curNode)
-    
-    def get_dir_tree(self, start_cluster, curRoot):
-        if (not (curRoot.info.attr & Attribute.DIRECTORY)):
-            return
-        if (curRoot.info.starting_cluster == start_cluster):
-            return curRoot
-        for i in curRoot.children:
-            self.get_dir_tree(start_cluster, i)
+                curName = shortName(i)
+            curNode.setName(curName)
+            curNode.dir = dir + '\\' + curName
+
+    # children of a directory node, read from disk the first time they are needed
+    def loadDir(self, node):
+        if (not node.loaded):
+            with self.timer.phase('tree build'):
+                if (node.isRoot):
+                    self.vis(0, node.dir, node)
+                elif (node.info.attr & Attribute.DIRECTORY):
+                    self.vis(node.info.starting_cluster, node.dir, node)
+        return node.children
+
+    # extent map of a file: (file offset, volume offset, length) in bytes, cut to the file size
+    def dataExtents(self, entry):
+        bs = self.boot_sector
+        clusterSize = bs.sectors_per_cluster * bs.bytes_per_sector
+        extents = []
+        fileOffset = 0
+        for first, length in self.fat.get_cluster_extents(entry.starting_cluster, (entry.file_size + clusterSize - 1) // clusterSize):
+            size = min(length * clusterSize, entry.file_size - fileOffset)
+            extents.append((fileOffset, (bs.RDET_start + (first - 2) * bs.sectors_per_cluster) * bs.bytes_per_sector, size))
+            fileOffset += size
+        return extents
+
+    # file-like object streaming the content of a file node
+    def open_node(self, node):
+        if (node == None or node.isRoot or (node.info.attr & Attribute.DIRECTORY)):
+            raise IsADirectoryError(node.dir if node != None else None)
+        return ExtentFile(self.ptr, self.dataExtents(node.info), node.info.file_size, node.name)
+
+    # children of a directory node, NotADirectoryError for files
+    def list_node(self, node):
+        if (not node.isRoot and not (node.info.attr & Attribute.DIRECTORY)):
+            raise NotADirectoryError(node.dir)
+        return self.loadDir(node)
+
+    # name, kind, size and times of a node as a dict (times are None for the root, which has no entry)
+    def stat_node(self, node):
+        if (node.isRoot):
+            return {'name': '', 'isDir': True, 'size': 0, 'created': None, 'modified': None, 'accessed': None}
+        entry = node.info
+        return {
+            'name': node.name,
+            'isDir': bool(entry.attr & Attribute.DIRECTORY),
+            'size': entry.file_size,
+            'created': datetime.datetime.combine(entry.create_date, entry.create_time),
+            'modified': datetime.datetime.combine(entry.last_write_date, entry.last_write_time),
+            'accessed': datetime.datetime.combine(entry.last_access_date, datetime.time()),
+        }
+
+    # file-like object over the file at `path` (same form as followDir), with read, readinto, seek and iteration
+    def open_file(self, path):
+        node = self.getNode(path)
+        if (node == None):
+            raise FileNotFoundError(path)
+        return self.open_node(node)
+
+    # node at `path`, None when it does not exist; unlike followDir it leaves the working directory alone
+    def getNode(self, path):
+        return self.resolve(path.replace('\\', '/').split('/'))
+
+    # children of a directory keyed by normalised name, long and 8.3 names both point to the child
+    def childIndex(self, node):
+        if (node.index == None):
+            index = {}
+            for child in self.loadDir(node):
+                index.setdefault(normName(child.name), child)
+                index.setdefault(normName(shortName(child.info)), child)
+            node.index = index
+        return node.index
+
+    # walk the path components from dirList[index] with one dictionary lookup per level
+    # paths resolved from the root are remembered in a full-path index
+    def resolve(self, dirList, curNode = None, index = 1):
+        key = None
+        if (curNode == None):
+            curNode = self.root
+            key = '/'.join(normName(name) for name in dirList[index:] if name != '')
+            if (key in self.pathIndex):
+                return self.pathIndex[key]
+        for name in dirList[index:]:
+            if (name == ''):
+                continue
+            if (not curNode.isRoot and not (curNode.info.attr & Attribute.DIRECTORY)):
+                return None
+            curNode = self.childIndex(curNode).get(normName(name))
+            if (curNode == None):
+                return None
+        if (key != None):
+            self.pathIndex[key] = curNode
+        return curNode
 
     def printFile(self, txtNode):        
-        rawData = read_chain(self.ptr, txtNode.info.starting_cluster, self.boot_sector.sectors_per_cluster, self.boot_sector.bytes_per_sector, self.fat, self.boot_sector.RDET_start)
-        textSize = txtNode.info.file_size
-        fileContent = rawData[:textSize]
         fileName = txtNode.name
         if (fileName.lower().endswith('.txt')): 
-            print(fileContent.decode('utf-8', errors = 'replace'))
+            # stream the text so large files are never held in memory at once
+            decoder = codecs.getincrementaldecoder('utf-8')(errors = 'replace')
+            with self.open_node(txtNode) as f:
+                for chunk in f:
+                    print(decoder.decode(chunk), end = '')
+            print(decoder.decode(b'', final = True))
         elif (fileName.lower().endswith('.docx')):
             print('Please use MS Word to open this file!')
         elif (fileName.lower().endswith('.pdf')):
@@ -349,17 +613,102 @@ class FAT32:
         else:
             print('Please use an appropriate program to open this file!')
     
+    # (path, offset) of every match of `pattern` in the content of the files of the volume (see grepFiles)
+    def grep(self, pattern, regex = False, ignoreCase = False, workers = 4):
+        files = [(path, self.open_node(node)) for path, size, modified, node in self.search(kind = 'file')]
+        return grepFiles(files, pattern, regex, ignoreCase, workers)
+
+    # recreate the file or folder at `path` on the host as dest/<its name>, the volume root as dest itself,
+    # with modified and access times kept; returns counts, bytes copied and throughput (see Extractor)
+    def extract(self, path, dest, workers = 4):
+        node = self.getNode(path)
+        if (node == None):
+            raise FileNotFoundError(path)
+        return Extractor(self, workers).run(node, dest)
+
+    # free and bad cluster counts, the largest free run, the FSInfo free count checked against the FAT, and
+    # extent counts of every file with a histogram (see analyzeFat32); the whole tree is read first
+    # perFile adds 'fileExtents', the extent count of each non-empty file in tree order
+    def analyze(self, perFile = False):
+        with self.timer.phase('analysis'):
+            files = [(path, node.info.starting_cluster, size) for path, name, size, modified, isFolder, node in self.searchRecords() if not isFolder]
+            return analyzeFat32(self, files, perFile)
+
+    # (path, name, size, modified time, isFolder, node) of every entry in tree order, the whole tree is read first
+    def searchRecords(self):
+        self.loadFat()
+        self.load_tree(self.root)
+        records = []
+        stack = [(self.root, '')]
+        while (len(stack) > 0):
+            node, path = stack.pop()
+            if (not node.isRoot):
+                entry = node.info
+                records.append((path, node.name, entry.file_size, datetime.datetime.combine(entry.last_write_date, entry.last_write_time), entry.attr & Attribute.DIRECTORY, node))
+            for child in reversed(node.children):
+                stack.append((child, path + '/' + child.name))
+        return records
+
+    # find entries anywhere on the volume by name pattern, size and modified time (see SearchIndex.query)
+    # the index is built from the whole tree on the first search and answers every later one
+    def search(self, pattern = None, regex = False, minSize = None, maxSize = None, after = None, before = None, kind = None):
+        if (self.searchIndex == None):
+            self.searchIndex = SearchIndex(self.searchRecords())
+        return self.searchIndex.query(pattern, regex, minSize, maxSize, after, before, kind)
+
+    # read the whole directory tree up front
     def get_dir_tree(self):
-        self.root = Node(dir = self.name + ':', entry = None, isRoot = True)
-        self.vis(0, f'\\\\.\\{self.name}:')
+        self.root = Node(dir = self.label, entry = None, isRoot = True)
         self.curNode = self.root
+        self.pathIndex = {}
+        self.searchIndex = None
+        self.loadFat()
+        self.load_tree(self.root)
+
+    # decode the whole FAT ahead of work that follows every chain
+    def loadFat(self):
+        with self.timer.phase('FAT load'):
+            self.fat.load()
+
+    def load_tree(self, curNode):
+        with self.timer.phase('tree build'):
+            if (self.workers != None and self.workers > 1):
+                self.load_tree_parallel(curNode, self.workers)
+                return
+            for child in self.loadDir(curNode):
+                if (child.info.attr & Attribute.DIRECTORY):
+                    self.load_tree(child)
+
+    # load every directory below curNode with up to `workers` directory reads in flight on a thread pool
+    # entries are turned into nodes on this thread, each directory's children in on-disk order,
+    # so the tree is the same as the one the serial walk builds
+    def load_tree_parallel(self, curNode, workers):
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        pending = deque([curNode])
+        running = {}
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            while (len(pending) > 0 or len(running) > 0):
+                while (len(pending) > 0 and len(running) < workers):
+                    node = pending.popleft()
+                    if (node.loaded):
+                        pending.extend(child for child in node.children if child.info.attr & Attribute.DIRECTORY)
+                        continue
+                    running[pool.submit(self.dirEntries, node, True)] = node
+                if (len(running) == 0):
+                    continue
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if (not node.loaded):
+                        self.vis(0 if node.isRoot else node.info.starting_cluster, node.dir, node, future.result())
+                    pending.extend(child for child in node.children if child.info.attr & Attribute.DIRECTORY)
         
     def draw_dir_tree(self, curNode, depth = 0):
         if (curNode.isRoot):
-            print(self.name + ':')
+            print(self.label)
         elif (depth == 0):
             print(curNode.info.name.decode())
-        for child in curNode.children:
+        for child in self.loadDir(curNode):
             print('├─', end = '' )
             for i in range(depth):
                 print('──', end = '')
@@ -371,7 +720,7 @@ class FAT32:
     def getDir(self):
         allDir = []
         allDir.append(self.curNode.parent)
-        for child in self.curNode.children:
+        for child in self.loadDir(self.curNode):
             if (child == self.curNode):
                 continue
             allDir.append(child)
@@ -401,7 +750,7 @@ class FAT32:
         for child in allDir:
             if (child == self.curNode.parent or child == None):
                 continue
-            if (child.info.attr & Attribute.ARCHIVE):
+            if (not (child.info.attr & Attribute.DIRECTORY)):
                 i = i + 1
                 # print(str(i) + '.   archive  \t', end = '')
                 # print(child)
@@ -443,7 +792,7 @@ class FAT32:
                 continue
             if (child == self.curNode):
                 continue
-            if (child.info.attr & Attribute.ARCHIVE):
+            if (not (child.info.attr & Attribute.DIRECTORY)):
                 i = i + 1
                 print(str(i) + ':\t', end = '')
                 print(child)
@@ -459,31 +808,18 @@ class FAT32:
         self.printFile(tmpMap[index])
 
     def dfs(self, dirList, curNode = None, index = 1):
-        if (curNode == None):
-            curNode = self.root
         if (index >= len(dirList)):
             return False
-        curObjName = dirList[index].lower().strip()
-        for obj in curNode.children:
-            # print('type: ', type(curObjName), type(obj.name.lower().strip()))
-            # if (str(obj.name.lower().strip(r'\x00')) == str(curObjName)):
-            if (cmpStr(obj.name.lower().strip(), curObjName.lower().strip())):
-                if (obj.info.attr == Attribute.ARCHIVE):
-                    if (index == len(dirList) - 1):
-                        return obj
-                    else:
-                        return False
-                elif (obj.info.attr == Attribute.DIRECTORY):
-                    if (index == len(dirList) - 1):
-                        # print('is curnode', curNode.dir, ' ', curNode.name, ' ', curNode.isRoot)
-                        self.curNode = obj
-                        return True
-                    return self.dfs(dirList, obj, index + 1)
-        return False
+        obj = self.resolve(dirList, curNode, index)
+        if (obj == None or obj.isRoot):
+            return False
+        if (obj.info.attr & Attribute.DIRECTORY):
+            self.curNode = obj
+            return True
+        return obj
     
     def followDir(self, dir):
-        dir = dir.replace('\\', '/')
-        dirList = dir.split('/')
+        dirList = menuPath(dir, self.label)
         val = self.dfs(dirList)
         return val
 
@@ -494,11 +830,11 @@ class FAT32:
         else:
             self.printFile(val)
     
+    # dir is /-rooted or starts with the volume name, see menuPath
     def gotoDir(self, dir):
-        dir = dir.replace('\\', '/')
-        dirList = dir.split('/')
+        dirList = menuPath(dir, self.label)
         if (len(dirList) == 1):
-            if (dirList[0] == self.name + ':'):
+            if (dirList[0] == ''):
                 self.curNode = self.root
                 print('Current working directory: ', self.curNode.dir.strip('\\\\.\\'))
                 return
@@ -512,16 +848,7 @@ class FAT32:
             print('Current working directory: ', self.curNode.dir.strip('\\\\.\\'))
     
     def drawTree(self):
+        # the whole subtree is printed, so read it ahead with the parallel walker when enabled
+        if (self.workers != None and self.workers > 1):
+            self.load_tree(self.curNode)
         self.draw_dir_tree(curNode = self.curNode)
-
-def cmpStr(str_a, str_b):
-    str_a.replace('\x00', '')
-    str_a = '' . join(str_a.split('\x00'))
-    str_b.replace('\x00', '')
-    str_b = '' . join(str_b.split('\x00'))
-    if (len(str_a) != len(str_b)):
-        return False
-    for i in range(0, len(str_a)):
-        if (str_a[i] != str_b[i]):
-            return False
-    return True
\ No newline at end of file
@@ -1,6 +1,14 @@
 from enum import Flag
+import codecs
+import hashlib
 import re
 import datetime
+from volume import Volume, ExtentFile, devicePath, volumeLabel, normName, menuPath
+import snapshot
+from search import SearchIndex
+from grep import grepFiles
+from extract import Extractor
+from stats import PhaseTimer
 
 # function to convert integer to time(UTC)
 def convertToTime(val): 
@@ -15,17 +23,265 @@ def convertToTime(val):
 
     return createTime
 
+FILETIME_EPOCH = datetime.datetime(1601, 1, 1, tzinfo = datetime.timezone.utc)
+
+# a FILETIME (100 ns ticks since 1601) as an aware UTC datetime, None for values out of range
+def fileTimeToUtc(value):
+    try:
+        return FILETIME_EPOCH + datetime.timedelta(microseconds = value // 10)
+    except OverflowError:
+        return None
+
+# the MFT is read in pieces of this size during the scan
+MFT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# undo the update sequence of an MFT record: the last two bytes of every 512-byte block
+# were replaced by the sequence number, the original bytes are kept in the update sequence array
+def applyFixup(record):
+    usaOffset = int.from_bytes(record[4:6], byteorder='little')
+    usaCount = int.from_bytes(record[6:8], byteorder='little')
+    if (usaCount == 0 or usaOffset + usaCount * 2 > len(record)):
+        return None
+    record = bytearray(record)
+    usn = record[usaOffset:usaOffset + 2]
+    for i in range(1, usaCount):
+        end = i * 512
+        if (end > len(record)):
+            break
+        if (record[end - 2:end] != usn):
+            # torn write, the record cannot be trusted
+            return None
+        record[end - 2:end] = record[usaOffset + i * 2:usaOffset + i * 2 + 2]
+    return record
+
+# decode a run list starting at `offset` into (starting cluster, cluster count) pairs
+# run offsets are signed and relative to the previous run; sparse runs have no offset and give None
+def decodeDataRuns(data, offset = 0):
+    runs = []
+    lcn = 0
+    while (offset < len(data)):
+        header = data[offset]
+        if (header == 0):
+            break
+        lengthSize = header & 0x0F
+        offsetSize = header >> 4
+        offset += 1
+        length = int.from_bytes(data[offset:offset + lengthSize], byteorder='little')
+        offset += lengthSize
+        if (offsetSize == 0):
+            runs.append((None, length))
+        else:
+            lcn += int.from_bytes(data[offset:offset + offsetSize], byteorder='little', signed = True)
+            runs.append((lcn, length))
+        offset += offsetSize
+    return runs
+
 class Attribute(Flag):
     STANDARD_INFORMATION = 16
     FILE_NAME = 48
     DATA = 128
 
+# attribute types of directory indexes; their entries are $FILE_NAME keys sorted by collationKey
+INDEX_ROOT = 0x90
+INDEX_ALLOCATION = 0xA0
+DIRECTORY_INDEX = '$I30'
+
+# the attribute of type `attrType` and name `name` of a fixed-up MFT record, None if it has none
+def findAttribute(record, attrType, name = ''):
+    attrOffset = int.from_bytes(record[20:22], byteorder='little')
+    while (attrOffset + 16 <= len(record)):
+        currentType = int.from_bytes(record[attrOffset:attrOffset + 4], byteorder='little')
+        if (currentType == 0xFFFFFFFF or currentType == 0x0):
+            break
+        attrLength = int.from_bytes(record[attrOffset + 4:attrOffset + 8], byteorder='little')
+        if (attrLength == 0):
+            break
+        if (currentType == attrType):
+            nameLength = record[attrOffset + 9]
+            nameOffset = attrOffset + int.from_bytes(record[attrOffset + 10:attrOffset + 12], byteorder='little')
+            if (bytes(record[nameOffset:nameOffset + nameLength * 2]).decode('utf-16le', errors = 'replace') == name):
+                return record[attrOffset:attrOffset + attrLength]
+        attrOffset += attrLength
+    return None
+
+# upper-case the name code unit by code unit, as NTFS orders the names of an index (close to the $UpCase table)
+def collationKey(name):
+    return [ord(c.upper()) if len(c.upper()) == 1 else ord(c) for c in name]
+
+# entries of the index node whose header starts at `start`: (record number, name, subnode VCN or None),
+# the last one with name None; the key of an entry is the $FILE_NAME of the file it points to
+def indexNodeEntries(data, start):
+    entriesOffset = int.from_bytes(data[start:start + 4], byteorder='little')
+    end = min(len(data), start + int.from_bytes(data[start + 4:start + 8], byteorder='little'))
+    offset = start + entriesOffset
+    entries = []
+    while (offset + 16 <= end):
+        length = int.from_bytes(data[offset + 8:offset + 10], byteorder='little')
+        flags = int.from_bytes(data[offset + 12:offset + 14], byteorder='little')
+        subnode = None
+        if (flags & 0x01):
+            subnode = int.from_bytes(data[offset + length - 8:offset + length], byteorder='little')
+        if (flags & 0x02 or length == 0):
+            entries.append((None, None, subnode))
+            break
+        key = offset + 16
+        nameLength = data[key + 64]
+        name = bytes(data[key + 66:key + 66 + nameLength * 2]).decode('utf-16le', errors = 'replace')
+        entries.append((int.from_bytes(data[offset:offset + 6], byteorder='little'), name, subnode))
+        offset += length
+    return entries
+
+# parse one MFT record into the arguments of its Entry:
+# (parent record, name, created, accessed, modified, isFolder, size, record, content offset, run list, alt name)
+# None for records that do not belong in the tree
+def parseRecord(data, index):
+    # check signature
+    if (data[0:4] != b'FILE'):
+        return None
+
+    fileFlag = int.from_bytes(data[0x16:0x18], byteorder='little')
+    if not (fileFlag & 0x01):
+        return None
+    isFolder = 0
+    if (fileFlag & 0x02):
+        isFolder = 1
+    elif ((fileFlag & 0x04) or (fileFlag & 0x08)):
+        return None
+
+    data = applyFixup(data)
+    if (data == None):
+        return None
+    
+    # get starting byte of attribute from header
+    attrOffset = 20
+    attrOffset = int.from_bytes(data[attrOffset:attrOffset + 2], byteorder='little')
+
+    fileSize = 0
+    fileName = None
+    altName = None
+    names = []
+    
+    flags = None
+    contentOffset = None
+    dataRuns = None
+    while True:
+        ## Attribute header
+        # get attribute type
+        attrType = int.from_bytes(data[attrOffset:attrOffset + 4], byteorder='little')
+        # print('attributeType', int(attrType), ' ', Attribute.FILE_NAME.value, ' ', attrType == Attribute.FILE_NAME.value)
+
+        # break if end of attribute
+        if (attrType == 0xFFFFFFFF or attrType == 0x0):
+            break
+        # get attribute length
+        attrLength = int.from_bytes(data[attrOffset + 4:attrOffset + 8], byteorder='little')
+        if (attrLength == 0):
+            break
+
+        # get attribute type (resident/non-resident)
+        attrResident = int.from_bytes(data[attrOffset + 8:attrOffset + 9], byteorder='little')
+        isResident = True
+        if (attrResident == 1): # non-resident
+            isResident = False
+        if (attrResident > 1):
+            break
+        # get content's size of the attribute
+        attrContentSize = int.from_bytes(data[attrOffset + 16:attrOffset + 20], byteorder='little')
+        # get attribute's content's offset 
+        attrContentOffset = int.from_bytes(data[attrOffset + 20:attrOffset + 21], byteorder='little')
+
+        ## Attribute content
+        # attribute of type $FILE_NAME
+        if (attrType == Attribute.FILE_NAME.value):
+            # get file name
+            nameLength = int.from_bytes(data[attrOffset + attrContentOffset + 64:attrOffset + attrContentOffset + 65], byteorder='little')
+            # fileName = int.from_bytes(data[attrOffset + attrContentOffset + 66:attrOffset + attrContentOffset + 66 + nameLength * 2], byteorder='little')
+            fileName = data[attrOffset + attrContentOffset + 66:attrOffset + attrContentOffset + 66 + nameLength * 2]
+            fileName = bytes(fileName).decode('utf-16le')
+            names.append((data[attrOffset + attrContentOffset + 65], fileName))
+            if (fileName.startswith('$')):
+                break
+            # get parent directory
+            parDir = int.from_bytes(data[attrOffset + attrContentOffset + 0:attrOffset + attrContentOffset + 6], byteorder='little')
+            parDir = hex(parDir)
+            # whatever this is
+            parDir2 = int.from_bytes(data[attrOffset + attrContentOffset + 6:attrOffset + attrContentOffset + 8], byteorder='little')
+            parDir2 = hex(parDir2)
+            # file times, kept as FILETIME values (see Entry)
+            # get file create time
+            createTime = int.from_bytes(data[attrOffset + attrContentOffset + 8:attrOffset + attrContentOffset + 16], byteorder='little')
+            # get file last modified time 
+            modifiedTime = int.from_bytes(data[attrOffset + attrContentOffset + 16:attrOffset + attrContentOffset + 24], byteorder='little')
+            # get file last accessed time 
+            accessedTime = int.from_bytes(data[attrOffset + attrContentOffset + 32:attrOffset + attrContentOffset + 40], byteorder='little')
+
+        # attribute of type $DATA, only the unnamed stream is the file's content (named ones such as
+        # Zone.Identifier are alternate data streams)
+        elif (attrType == Attribute.DATA.value and data[attrOffset + 9] == 0):
+            # in case resident attribute
+            if (isResident):
+                fileSize = attrContentSize
+                contentOffset = attrOffset + attrContentOffset
+            # in case non-resident attribute, keep the run list to read the content later
+            else:
+                dataRunOffset = int.from_bytes(data[attrOffset + 32:attrOffset + 34], byteorder='little')
+                fileSize = int.from_bytes(data[attrOffset + 48:attrOffset + 55], byteorder='little')
+                dataRuns = bytes(data[attrOffset + dataRunOffset:attrOffset + attrLength])
+        elif (attrType == Attribute.STANDARD_INFORMATION.value):
+            # get flags
+            flags = int.from_bytes(data[attrOffset + attrContentOffset + 0x20:attrOffset + attrContentOffset + 0x20 + 4], byteorder='little')                   
+
+        # add offset to read next attribute
+        attrOffset += attrLength
+    
+    
+    if (fileName == None):
+        return None
+    # prefer the long name, the DOS (8.3) one becomes an alias
+    for nameSpace, name in names:
+        if (nameSpace != 2):
+            fileName = name
+        else:
+            altName = name
+    if (altName == fileName):
+        altName = None
+    if (isFolder and fileName.strip() != '.'):
+        if (flags != None):
+            if (flags & 0x02):
+                return None
+            if (flags & 0x04):
+                return None
+    if (fileName.startswith('$')):
+        return None
+    return (int(parDir, 16), fileName, createTime, accessedTime, modifiedTime, isFolder, fileSize, index, contentOffset, dataRuns, altName)
+
+# parse `size` bytes of the MFT at volume offset `start`; `index` is the number of the first record there
+def parseMftSlice(ptr, start, size, index, recordSize):
+    chunk = ptr.read(start, size)
+    records = []
+    for recordOffset in range(0, len(chunk) - recordSize + 1, recordSize):
+        fields = parseRecord(chunk[recordOffset:recordOffset + recordSize], index)
+        if (fields != None):
+            records.append(fields)
+        index += 1
+    return records
+
+# volume opened once by each process of the MFT scan pool
+mftWorkerVolume = None
+
+def initMftWorker(path, offset):
+    global mftWorkerVolume
+    mftWorkerVolume = Volume(path, offset)
+
+def parseMftSliceInWorker(start, size, index, recordSize):
+    return parseMftSlice(mftWorkerVolume, start, size, index, recordSize)
+
 #read volume basic infomation        
 class BPB:
     def __init__(self, ptr, name):
         self.name = name
         self.ptr = ptr
-        self.data = self.ptr.read(100)
+        self.data = bytes(self.ptr.read(0, 100))
         
         self.byte_per_sector = int.from_bytes(self.data[0x0b:0x0d], byteorder='little')
         self.sector_per_cluster = int.from_bytes(self.data[0x0d:0x0e], byteorder='little')
@@ -33,203 +289,567 @@ class BPB:
         self.number_of_sector = int.from_bytes(self.data[0x28:0x30], byteorder='little')
         self.MFT_start_sector = self.sector_per_cluster * int.from_bytes(self.data[0x30:0x38], byteorder='little')
         self.MFT_reserve_start_sector = self.sector_per_cluster * int.from_bytes(self.data[0x38:0x40], byteorder='little')
+        # clusters per MFT record, a negative value n means 2^-n bytes
+        recordClusters = int.from_bytes(self.data[0x40:0x41], byteorder='little', signed = True)
+        if (recordClusters < 0):
+            self.MFT_record_size = 1 << -recordClusters
+        elif (recordClusters > 0):
+            self.MFT_record_size = recordClusters * self.sector_per_cluster * self.byte_per_sector
+        else:
+            self.MFT_record_size = 1024
 
+# file content is not kept in the entry, only where to find it:
+# the MFT record and offset of a resident $DATA, or the raw run list of a non-resident one
 class Entry:
-    def __init__(self, parDirectory, name = None, timeCreated = None, timeAccessed = None, timeModified = None, isFolder = False, fileContent = None, fileSize = 0):
+    # the times are FILETIME values; timeCreated/timeAccessed/timeModified give them as the menu shows them,
+    # created/accessed/modified as aware UTC datetimes for everything else
+    def __init__(self, parDirectory, name = None, fileCreated = 0, fileAccessed = 0, fileModified = 0, isFolder = False, fileSize = 0, record = None, contentOffset = None, dataRuns = None, altName = None):
         self.isFolder = isFolder
         self.name = name
-        self.timeCreated = timeCreated
-        self.timeAccessed = timeAccessed
-        self.timeModified = timeModified
+        # DOS 8.3 alias of the name, if the record has one
+        self.altName = altName
+        self.fileCreated = fileCreated
+        self.fileAccessed = fileAccessed
+        self.fileModified = fileModified
         self.parDir = parDirectory
-        self.fileContent = fileContent
         self.fileSize = fileSize
+        self.record = record
+        self.contentOffset = contentOffset
+        self.dataRuns = dataRuns
+
+    @property
+    def timeCreated(self):
+        return convertToTime(self.fileCreated)
+
+    @property
+    def timeAccessed(self):
+        return convertToTime(self.fileAccessed)
+
+    @property
+    def timeModified(self):
+        return convertToTime(self.fileModified)
+
+    @property
+    def created(self):
+        return fileTimeToUtc(self.fileCreated)
+
+    @property
+    def accessed(self):
+        return fileTimeToUtc(self.fileAccessed)
+
+    @property
+    def modified(self):
+        return fileTimeToUtc(self.fileModified)
 
 #nodes of the directory tree
 class Node:
+    # False for directories whose children are still to be read from their index (see NTFS.loadDir)
+    loaded = True
+
     def __init__(self, entry = None, parent = None, address = None):
         self.entry = entry
         self.parent = parent
         self.children = []
         self.address = address
+        # children by normalised name, built on the first lookup
+        self.index = None
     
     def __str__(self):
         return self.entry.name
 
 #main class
 class NTFS:
-    def __init__(self, name):
+    # name is a drive letter, an image file or a block device; offset is the partition start in bytes
+    # with snapshotDir set, the parsed MFT is reloaded from a saved snapshot when the volume is unchanged
+    # processes above 1 split the MFT scan across that many processes, otherwise it runs in this one
+    # with scan False the MFT is not scanned: paths are resolved through the $I30 directory indexes from the
+    # root record, reading only the records and index blocks on the way, and directories are listed on first use
+    # (a volume whose root has no index is scanned anyway)
+    def __init__(self, name, offset = 0, snapshotDir = None, processes = None, scan = True):
         self.name = name
+        self.processes = processes
+        self.label = volumeLabel(name)
         self.root = None
         self.curNode = None
         self.map = {}
-        self.ptr = open(f'\\\\.\\{self.name}:', 'rb')
-        with open(f'\\\\.\\{self.name}:', 'rb') as f:
-            self.BPB = BPB(self.ptr, self.name + ':')
-        self.readEntry()
+        self.pathIndex = {}
+        self.searchIndex = None
+        self.MFT_extents = []
+        self.timer = PhaseTimer()
+        with self.timer.phase('boot parse'):
+            self.ptr = Volume(devicePath(name), offset)
+            self.BPB = BPB(self.ptr, self.label)
+        self.snapshotDir = snapshotDir
+        self.snapshotKey = snapshot.snapshotKey('NTFS', self.ptr.read(0, 512), self.label)
+        if (not scan):
+            self.MFT_extents = self.mftExtents()
+            self.root = self.indexedNode(5, None)
+            if (self.root != None and self.directoryIndex(5) != None):
+                # the root is its own parent, as after a scan
+                self.root.parent = self.root
+                self.curNode = self.root
+                return
+            # no usable root index, scan as usual
+            self.map = {}
+            self.root = None
+        loaded = False
+        if (snapshotDir != None):
+            with self.timer.phase('snapshot load'):
+                loaded = self.loadSnapshot()
+        if (not loaded):
+            self.readEntry()
+            self.saveSnapshot()
     
+    # I/O counters of the volume and wall-clock seconds per phase since it was opened (or resetStats), as a dict;
+    # 'profile' holds the cProfile report of the timed phases when CENT_EXPLORER_PROFILE is set
+    def getStats(self):
+        return {'fileSystem': 'NTFS', 'io': self.ptr.stats.asDict(), 'phases': dict(self.timer.times), 'profile': self.timer.profileReport()}
+
+    def resetStats(self):
+        self.ptr.stats.reset()
+        self.timer.reset()
+
     #get basic infomation of the volume
     def getVolumeInfo(self):
-        print('Volume name: ', self.name + ':')
+        print('Volume name: ', self.label)
         print('Sector size: ', self.BPB.byte_per_sector)
         print('Sectors per cluster: ', self.BPB.sector_per_cluster)
         print('Sectors per track: ', self.BPB.sector_per_track)
         print('Number of sector: ', self.BPB.number_of_sector)
         print('MFT start sector: ', self.BPB.MFT_start_sector)
 
-    #convert cluster to sector list
-    def clusterToSectorList(self, clusterList):
-        sectorList = [] 
-        for cluster in clusterList:
-            sectorList.append(cluster * self.BPB.sector_per_cluster)
-        return sectorList
-    
-    def readSectorChain(self, sectorList):
-        data = ''
-        for sectorIndex in sectorList:
-            self.ptr.seek(sectorIndex * self.BPB.byte_per_sector)
-            sectorData = self.ptr.read(self.BPB.byte_per_sector)
-            sectorText = sectorData.decode('utf-8', errors = 'replace')
-            data += sectorText
-        return data
+    # extent map of a non-resident file: (file offset, volume offset or None for sparse, length) in bytes,
+    # in file order and cut to the file size
+    def dataExtents(self, entry):
+        return self.runExtents(decodeDataRuns(entry.dataRuns), entry.fileSize)
 
+    def runExtents(self, runs, size):
+        clusterSize = self.BPB.sector_per_cluster * self.BPB.byte_per_sector
+        extents = []
+        fileOffset = 0
+        for lcn, length in runs:
+            if (fileOffset >= size):
+                break
+            length = min(length * clusterSize, size - fileOffset)
+            extents.append((fileOffset, None if lcn == None else lcn * clusterSize, length))
+            fileOffset += length
+        return extents
 
-    def readEntry(self):
-        self.ptr.seek(self.BPB.MFT_start_sector * self.BPB.byte_per_sector)
-        for i in range(0, self.BPB.number_of_sector, 2):
-            data = self.ptr.read(1024) # 1024 bytes
+    # (run list, real size) of the unnamed non-resident $DATA of an MFT record, None if it has none
+    def recordDataRuns(self, record):
+        if (record == None or record[0:4] != b'FILE'):
+            return None
+        attrOffset = int.from_bytes(record[20:22], byteorder='little')
+        while (attrOffset + 8 <= len(record)):
+            attrType = int.from_bytes(record[attrOffset:attrOffset + 4], byteorder='little')
+            if (attrType == 0xFFFFFFFF or attrType == 0x0):
+                break
+            attrLength = int.from_bytes(record[attrOffset + 4:attrOffset + 8], byteorder='little')
+            if (attrLength == 0):
+                break
+            if (attrType == Attribute.DATA.value and record[attrOffset + 8] == 1 and record[attrOffset + 9] == 0):
+                attr = record[attrOffset:attrOffset + attrLength]
+                dataRunOffset = int.from_bytes(attr[32:34], byteorder='little')
+                realSize = int.from_bytes(attr[48:56], byteorder='little')
+                return decodeDataRuns(attr, dataRunOffset), realSize
+            attrOffset += attrLength
+        return None
 
-            # check signature
-            if (data[0:4] != b'FILE'):
-                continue
+    # byte ranges (offset, length) the MFT occupies on the volume, in record order,
+    # taken from the $DATA run list of record 0 ($MFT) and cut to the MFT's real size
+    def mftExtents(self):
+        recordSize = self.BPB.MFT_record_size
+        mftOffset = self.BPB.MFT_start_sector * self.BPB.byte_per_sector
+        runs = self.recordDataRuns(applyFixup(self.ptr.read(mftOffset, recordSize)))
+        if (runs != None):
+            clusterSize = self.BPB.sector_per_cluster * self.BPB.byte_per_sector
+            extents = []
+            remaining = runs[1]
+            for lcn, length in runs[0]:
+                if (remaining <= 0):
+                    break
+                size = min(length * clusterSize, remaining)
+                # a sparse run inside the MFT holds no records, keep the numbering by passing None
+                extents.append((None if lcn == None else lcn * clusterSize, size))
+                remaining -= size
+            if (len(extents) > 0):
+                return extents
+        # no usable $MFT record: scan from the MFT start to the end of the volume as before
+        return [(mftOffset, self.BPB.number_of_sector * self.BPB.byte_per_sector - mftOffset)]
 
-            fileFlag = int.from_bytes(data[0x16:0x18], byteorder='little')
-            if not (fileFlag & 0x01):
-                continue
-            isFolder = 0
-            if (fileFlag & 0x02):
-                isFolder = 1
-            elif ((fileFlag & 0x04) or (fileFlag & 0x08)):
-                continue
-            
-            # get starting byte of attribute from header
-            attrOffset = 20
-            attrOffset = int.from_bytes(data[attrOffset:attrOffset + 2], byteorder='little')
+    # current LSN from the restart pages of $LogFile (record 2), None when it cannot be read
+    def logFileLsn(self):
+        offset = self.recordOffset(2)
+        if (offset == None):
+            return None
+        runs = self.recordDataRuns(applyFixup(self.ptr.read(offset, self.BPB.MFT_record_size)))
+        if (runs == None or len(runs[0]) == 0 or runs[0][0][0] == None):
+            return None
+        logStart = runs[0][0][0] * self.BPB.sector_per_cluster * self.BPB.byte_per_sector
+        lsn = None
+        pageOffset = 0
+        # two copies of the restart page, the second one a system page further in
+        for i in range(2):
+            page = self.ptr.read(logStart + pageOffset, 4096)
+            if (len(page) < 0x20 or page[0:4] != b'RSTR'):
+                break
+            restartArea = int.from_bytes(page[0x18:0x1A], byteorder='little')
+            current = int.from_bytes(page[restartArea:restartArea + 8], byteorder='little')
+            if (lsn == None or current > lsn):
+                lsn = current
+            pageOffset = int.from_bytes(page[0x10:0x14], byteorder='little')
+            if (pageOffset == 0):
+                break
+        return lsn
 
-            fileSize = 0
-            
-            flags = None
-            fileContent = ''
-            while True:
-                ## Attribute header
-                # get attribute type
-                attrType = int.from_bytes(data[attrOffset:attrOffset + 4], byteorder='little')
-                # print('attributeType', int(attrType), ' ', Attribute.FILE_NAME.value, ' ', attrType == Attribute.FILE_NAME.value)
-
-                # break if end of attribute
-                if (attrType == 0xFFFFFFFF or attrType == 0x0):
-                    break
-                # get attribute length
-                attrLength = int.from_bytes(data[attrOffset + 4:attrOffset + 8], byteorder='little')
-
-                # get attribute type (resident/non-resident)
-                attrResident = int.from_bytes(data[attrOffset + 8:attrOffset + 9], byteorder='little')
-                isResident = True
-                if (attrResident == 1): # non-resident
-                    isResident = False
-                if (attrResident > 1):
+    # cheap change signature: the $LogFile LSN with the $MFT record when there is a log, else a hash of the MFT
+    def snapshotSignature(self):
+        digest = hashlib.blake2b(digest_size = 16)
+        lsn = self.logFileLsn()
+        if (lsn and self.recordOffset(0) != None):
+            digest.update(b'lsn' + lsn.to_bytes(8, byteorder='little'))
+            digest.update(self.ptr.read(self.recordOffset(0), self.BPB.MFT_record_size))
+            return digest.hexdigest()
+        for start, length in self.MFT_extents:
+            if (start == None):
+                continue
+            pos = 0
+            while (pos < length):
+                chunk = self.ptr.read(start + pos, min(MFT_CHUNK_SIZE, length - pos))
+                if (len(chunk) == 0):
                     break
-                # get content's size of the attribute
-                attrContentSize = int.from_bytes(data[attrOffset + 16:attrOffset + 20], byteorder='little')
-                # get attribute's content's offset 
-                attrContentOffset = int.from_bytes(data[attrOffset + 20:attrOffset + 21], byteorder='little')
-
-                ## Attribute content
-                # attribute of type $FILE_NAME
-                if (attrType == Attribute.FILE_NAME.value):
-                    # get file name
-                    nameLength = int.from_bytes(data[attrOffset + attrContentOffset + 64:attrOffset + attrContentOffset + 65], byteorder='little')
-                    # fileName = int.from_bytes(data[attrOffset + attrContentOffset + 66:attrOffset + attrContentOffset + 66 + nameLength * 2], byteorder='little')
-                    fileName = data[attrOffset + attrContentOffset + 66:attrOffset + attrContentOffset + 66 + nameLength * 2]
-                    fileName = fileName.decode('utf-16le')
-                    if (fileName.startswith('$')):
+                digest.update(chunk)
+                pos += len(chunk)
+        return digest.hexdigest()
+
+    # take the map from a saved snapshot when the volume did not change
+    def loadSnapshot(self):
+        self.MFT_extents = self.mftExtents()
+        payload = snapshot.loadSnapshot(self.snapshotDir, self.snapshotKey, self.snapshotSignature())
+        if (payload == None):
+            return False
+        self.map = payload['map']
+        self.root = payload['root']
+        self.curNode = self.root
+        self.pathIndex = {}
+        self.searchIndex = None
+        return True
+
+    def saveSnapshot(self):
+        if (self.snapshotDir == None):
+            return False
+        return snapshot.saveSnapshot(self.snapshotDir, self.snapshotKey, self.snapshotSignature(), {'map': self.map, 'root': self.root})
+
+    # volume byte offset of MFT record `index`
+    def recordOffset(self, index):
+        recordSize = self.BPB.MFT_record_size
+        for start, length in self.MFT_extents:
+            count = length // recordSize
+            if (index < count):
+                if (start == None):
+                    return None
+                return start + index * recordSize
+            index -= count
+        return None
+
+    # MFT record `index` with its update sequence undone, None when it cannot be read
+    def fixedRecord(self, index):
+        offset = self.recordOffset(index)
+        if (offset == None):
+            return None
+        return applyFixup(self.ptr.read(offset, self.BPB.MFT_record_size))
+
+    # node of MFT record `index` found in the index of `parent`, None for records left out of the tree;
+    # nodes are kept in the map so that a record met again gives the same node
+    def indexedNode(self, index, parent):
+        if (index in self.map):
+            return self.map[index]
+        offset = self.recordOffset(index)
+        if (offset == None):
+            return None
+        fields = parseRecord(self.ptr.read(offset, self.BPB.MFT_record_size), index)
+        if (fields == None):
+            return None
+        node = Node(entry = Entry(*fields), parent = parent)
+        if (node.entry.isFolder):
+            node.loaded = False
+        self.map[index] = node
+        return node
+
+    # (entries of $INDEX_ROOT, $INDEX_ALLOCATION as a file or None, index block size, bytes per VCN) of the
+    # $I30 index of directory record `index`, None when the record has no such index
+    def directoryIndex(self, index):
+        record = self.fixedRecord(index)
+        if (record == None):
+            return None
+        root = findAttribute(record, INDEX_ROOT, DIRECTORY_INDEX)
+        if (root == None):
+            return None
+        content = root[int.from_bytes(root[20:22], byteorder='little'):]
+        blockSize = int.from_bytes(content[8:12], byteorder='little')
+        clusterSize = self.BPB.sector_per_cluster * self.BPB.byte_per_sector
+        allocation = None
+        attr = findAttribute(record, INDEX_ALLOCATION, DIRECTORY_INDEX)
+        if (attr != None and attr[8] == 1):
+            runOffset = int.from_bytes(attr[32:34], byteorder='little')
+            size = int.from_bytes(attr[48:56], byteorder='little')
+            allocation = ExtentFile(self.ptr, self.runExtents(decodeDataRuns(attr, runOffset), size), size)
+        return indexNodeEntries(content, 16), allocation, blockSize, clusterSize if blockSize >= clusterSize else 512
+
+    # entries of the INDX block at `vcn` of a directory index, empty if it is unreadable
+    def indexBlockEntries(self, directoryIndex, vcn):
+        entries, allocation, blockSize, vcnSize = directoryIndex
+        if (allocation == None):
+            return []
+        allocation.seek(vcn * vcnSize)
+        block = allocation.read(blockSize)
+        if (block[0:4] != b'INDX'):
+            return []
+        block = applyFixup(block)
+        if (block == None):
+            return []
+        return indexNodeEntries(block, 0x18)
+
+    # record number of `name` in directory record `index`, going down its B-tree: in each node the first
+    # entry not below the name either is the name or leads to the subnode holding it
+    def findInIndex(self, index, name):
+        with self.timer.phase('index walk'):
+            directoryIndex = self.directoryIndex(index)
+            if (directoryIndex == None):
+                return None
+            target = collationKey(name)
+            entries = directoryIndex[0]
+            # a damaged index could loop, no real tree is this deep
+            for depth in range(64):
+                subnode = None
+                for number, entryName, entrySubnode in entries:
+                    if (entryName == None):
+                        subnode = entrySubnode
                         break
-                    # get parent directory
-                    parDir = int.from_bytes(data[attrOffset + attrContentOffset + 0:attrOffset + attrContentOffset + 6], byteorder='little')
-                    parDir = hex(parDir)
-                    # whatever this is
-                    parDir2 = int.from_bytes(data[attrOffset + attrContentOffset + 6:attrOffset + attrContentOffset + 8], byteorder='little')
-                    parDir2 = hex(parDir2)
-                    # get file create time
-                    createTime = int.from_bytes(data[attrOffset + attrContentOffset + 8:attrOffset + attrContentOffset + 16], byteorder='little')
-                    createTime = convertToTime(createTime)
-                    # get file last modified time 
-                    modifiedTime = int.from_bytes(data[attrOffset + attrContentOffset + 16:attrOffset + attrContentOffset + 24], byteorder='little')
-                    modifiedTime = convertToTime(modifiedTime)
-                    # get file last accessed time 
-                    accessedTime = int.from_bytes(data[attrOffset + attrContentOffset + 32:attrOffset + attrContentOffset + 40], byteorder='little')
-                    accessedTime = convertToTime(accessedTime)
-
-                # attribute of type $DATA
-                elif (attrType == Attribute.DATA.value):
-                    # in case resident attribute
-                    if (isResident):
-                        fileSize = attrContentSize
-                        fileContent = data[attrOffset + attrContentOffset:attrOffset + attrContentOffset + fileSize]
-                        fileContent = fileContent.decode('utf-8', errors = 'replace')
-                        filePermission = data[attrOffset + attrContentOffset + 0x20:attrOffset + attrContentOffset + 0x2d]
-                    # in case non-resident attribute
-                    else:
-                        dataRunOffset = int.from_bytes(data[attrOffset + 32:attrOffset + 34], byteorder='little')
-                        fileSize = int.from_bytes(data[attrOffset + 48:attrOffset + 55], byteorder='little')
-                        if fileName.lower().endswith('.txt'):
-                            numberOfCluster = int.from_bytes(data[attrOffset + dataRunOffset + 1:attrOffset + dataRunOffset + 2], byteorder='little')
-                            startClusterIndex = int.from_bytes(data[attrOffset + dataRunOffset + 2:attrOffset + dataRunOffset + 4], byteorder='little')
-                            clusterList = []
-                            for cluster in range(startClusterIndex, startClusterIndex + numberOfCluster):
-                                clusterList.append(cluster)
-                            sectorList = self.clusterToSectorList(clusterList)
-                            # read data based on sector list to get file data
-                            fileContent = self.readSectorChain(sectorList)
-                elif (attrType == Attribute.STANDARD_INFORMATION.value):
-                    # get flags
-                    flags = int.from_bytes(data[attrOffset + attrContentOffset + 0x20:attrOffset + attrContentOffset + 0x20 + 4], byteorder='little')                   
-
-                # add offset to read next attribute
-                attrOffset += attrLength
-            
-            
-            if (isFolder and fileName.strip() != '.'):
-                if (flags != None):
-                    if (flags & 0x02):
-                        continue
-                    if (flags & 0x04):
-                        continue
-            curEntry = None
-            if (fileName.startswith('$')):
+                    key = collationKey(entryName)
+                    if (key == target):
+                        return number
+                    if (target < key):
+                        subnode = entrySubnode
+                        break
+                if (subnode == None):
+                    return None
+                entries = self.indexBlockEntries(directoryIndex, subnode)
+            return None
+
+    # record numbers of every entry of the index of directory record `index`, in record order
+    def indexChildren(self, index):
+        directoryIndex = self.directoryIndex(index)
+        if (directoryIndex == None):
+            return []
+        numbers = set()
+        visited = set()
+        pending = [directoryIndex[0]]
+        while (len(pending) > 0):
+            for number, name, subnode in pending.pop():
+                if (name != None):
+                    numbers.add(number)
+                if (subnode != None and subnode not in visited):
+                    visited.add(subnode)
+                    pending.append(self.indexBlockEntries(directoryIndex, subnode))
+        return sorted(numbers)
+
+    # children of a directory node, read from its index the first time when the MFT was not scanned
+    def loadDir(self, node):
+        if (node.loaded):
+            return node.children
+        with self.timer.phase('index walk'):
+            children = []
+            for number in self.indexChildren(node.entry.record):
+                # the root lists itself, as it does after a scan
+                child = node if number == node.entry.record else self.indexedNode(number, node)
+                if (child != None):
+                    children.append(child)
+            node.children = children
+            node.index = None
+            node.loaded = True
+        return node.children
+
+    # child `name` of a directory node whose children are not loaded, looked up in its index
+    def indexChild(self, node, name):
+        number = self.findInIndex(node.entry.record, name)
+        if (number == None or number == node.entry.record):
+            return None
+        return self.indexedNode(number, node)
+
+    # content of a resident $DATA, which lives in the MFT record itself
+    def residentContent(self, entry):
+        offset = self.recordOffset(entry.record)
+        if (offset != None):
+            record = applyFixup(self.ptr.read(offset, self.BPB.MFT_record_size))
+            if (record != None):
+                return bytes(record[entry.contentOffset:entry.contentOffset + entry.fileSize])
+        return b''
+
+    # file-like object streaming the content of a file node
+    def open_node(self, node):
+        entry = node.entry
+        if (entry.isFolder):
+            raise IsADirectoryError(entry.name)
+        if (entry.contentOffset != None):
+            return ExtentFile(self.ptr, [], entry.fileSize, entry.name, data = self.residentContent(entry))
+        if (entry.dataRuns != None):
+            return ExtentFile(self.ptr, self.dataExtents(entry), entry.fileSize, entry.name)
+        return ExtentFile(self.ptr, [], 0, entry.name)
+
+    # children of a directory node, NotADirectoryError for files
+    def list_node(self, node):
+        if (not node.entry.isFolder):
+            raise NotADirectoryError(node.entry.name)
+        # the root is its own parent
+        return [child for child in self.loadDir(node) if child != node]
+
+    # name, kind, size and times of a node as a dict, the times in UTC
+    def stat_node(self, node):
+        entry = node.entry
+        return {
+            'name': '' if node == self.root else entry.name,
+            'isDir': bool(entry.isFolder),
+            'size': entry.fileSize,
+            'created': entry.created,
+            'modified': entry.modified,
+            'accessed': entry.accessed,
+        }
+
+    # file-like object over the file at `path` (same form as followDir), with read, readinto, seek and iteration
+    def open_file(self, path):
+        node = self.getNode(path)
+        if (node == None):
+            raise FileNotFoundError(path)
+        return self.open_node(node)
+
+    # node at `path`, None when it does not exist; unlike followDir it leaves the working directory alone
+    def getNode(self, path):
+        return self.resolve(path.replace('\\', '/').split('/'))
+
+    # children of a directory keyed by normalised name, DOS aliases included
+    def childIndex(self, node):
+        if (node.index == None):
+            index = {}
+            for child in self.loadDir(node):
+                if (child == node):
+                    continue
+                index.setdefault(normName(child.entry.name), child)
+                if (child.entry.altName != None):
+                    index.setdefault(normName(child.entry.altName), child)
+            node.index = index
+        return node.index
+
+    # walk the path components from dirList[index] with one dictionary lookup per level
+    # paths resolved from the root are remembered in a full-path index
+    def resolve(self, dirList, curNode = None, index = 1):
+        key = None
+        if (curNode == None):
+            curNode = self.root
+            key = '/'.join(normName(name) for name in dirList[index:] if name != '')
+            if (key in self.pathIndex):
+                return self.pathIndex[key]
+        for name in dirList[index:]:
+            if (name == ''):
                 continue
-            curEntry = Entry(int(parDir, 16), fileName, createTime, accessedTime, modifiedTime, isFolder, fileContent, fileSize)
-            
-            # Read .txt file
-            # if (fileName.lower().endswith('.txt')): 
-            #     print(fileContent.decode('utf-8'))
-
-            self.map[i//2] = Node(entry = curEntry)
-
-        for key, val in self.map.items():
-            if (val.entry.parDir in self.map):
-                val.parent = self.map[val.entry.parDir]
-                self.map[val.entry.parDir].children.append(val)
-            if (val.entry.name.strip() == '.'):
-                self.root = val
-                self.curNode = self.root
+            if (not curNode.entry.isFolder):
+                return None
+            if (curNode.loaded):
+                curNode = self.childIndex(curNode).get(normName(name))
+            else:
+                curNode = self.indexChild(curNode, name)
+            if (curNode == None):
+                return None
+        if (key != None):
+            self.pathIndex[key] = curNode
+        return curNode
+
+    # (volume offset, size, first record number) of the pieces the MFT is scanned in
+    def mftSlices(self):
+        recordSize = self.BPB.MFT_record_size
+        slices = []
+        index = 0
+        for start, length in self.MFT_extents:
+            if (start == None):
+                index += length // recordSize
+                continue
+            # read the MFT several MB at a time and parse the records out of the buffer
+            pos = 0
+            while (pos < length):
+                size = min(MFT_CHUNK_SIZE, length - pos)
+                slices.append((start + pos, size, index))
+                index += size // recordSize
+                pos += size
+        return slices
+
+    def readEntry(self):
+        recordSize = self.BPB.MFT_record_size
+        with self.timer.phase('MFT scan'):
+            self.MFT_extents = self.mftExtents()
+            slices = self.mftSlices()
+            if (self.processes != None and self.processes > 1 and len(slices) > 1):
+                from concurrent.futures import ProcessPoolExecutor
+                # every process opens the volume itself and sends back plain tuples, merged here in record order
+                # (their reads are not in this volume's I/O counters)
+                with ProcessPoolExecutor(max_workers = self.processes, initializer = initMftWorker, initargs = (self.ptr.path, self.ptr.offset)) as pool:
+                    starts, sizes, indexes = zip(*slices)
+                    results = list(pool.map(parseMftSliceInWorker, starts, sizes, indexes, [recordSize] * len(slices)))
+            else:
+                results = (parseMftSlice(self.ptr, start, size, index, recordSize) for start, size, index in slices)
+            for records in results:
+                for fields in records:
+                    self.map[fields[7]] = Node(entry = Entry(*fields))
+
+        with self.timer.phase('link pass'):
+            for key, val in self.map.items():
+                if (val.entry.parDir in self.map):
+                    val.parent = self.map[val.entry.parDir]
+                    self.map[val.entry.parDir].children.append(val)
+                if (val.entry.name.strip() == '.'):
+                    self.root = val
+                    self.curNode = self.root
+
+    # (path, offset) of every match of `pattern` in the content of the files of the volume (see grepFiles)
+    def grep(self, pattern, regex = False, ignoreCase = False, workers = 4):
+        files = [(path, self.open_node(node)) for path, size, modified, node in self.search(kind = 'file')]
+        return grepFiles(files, pattern, regex, ignoreCase, workers)
+
+    # recreate the file or folder at `path` on the host as dest/<its name>, the volume root as dest itself,
+    # with modified and access times kept; returns counts, bytes copied and throughput (see Extractor)
+    def extract(self, path, dest, workers = 4):
+        node = self.getNode(path)
+        if (node == None):
+            raise FileNotFoundError(path)
+        return Extractor(self, workers).run(node, dest)
+
+    # (path, name, size, modified time, isFolder, node) of every entry in tree order
+    def searchRecords(self):
+        records = []
+        stack = [(self.root, '')]
+        while (len(stack) > 0):
+            node, path = stack.pop()
+            if (node != self.root):
+                entry = node.entry
+                records.append((path, entry.name, entry.fileSize, entry.timeModified, entry.isFolder, node))
+            for child in reversed(self.loadDir(node)):
+                # the root is its own parent
+                if (child != node):
+                    stack.append((child, path + '/' + child.entry.name))
+        return records
+
+    # find entries anywhere on the volume by name pattern, size and modified time (see SearchIndex.query)
+    # the index is built on the first search and answers every later one
+    def search(self, pattern = None, regex = False, minSize = None, maxSize = None, after = None, before = None, kind = None):
+        if (self.searchIndex == None):
+            self.searchIndex = SearchIndex(self.searchRecords())
+        return self.searchIndex.query(pattern, regex, minSize, maxSize, after, before, kind)
 
     #supportive functions in building directory tree
     def drawDirTree(self, curNode = None, depth = 0):
         if (curNode == None):
-            print(self.name + ':')
+            print(self.label)
             curNode = self.root
-        for child in curNode.children:
+        for child in self.loadDir(curNode):
             if (child == curNode):
                 continue
             print('├─', end = '' )
@@ -242,7 +862,7 @@ class NTFS:
     def getDir(self):
         allDir = []
         allDir.append(self.curNode.parent)
-        for child in self.curNode.children:
+        for child in self.loadDir(self.curNode):
             if (child == self.curNode):
                 continue
             allDir.append(child)
@@ -306,9 +926,13 @@ class NTFS:
     def printFile(self, txtNode):
         # Read .txt file
         fileName = txtNode.entry.name
-        fileContent = txtNode.entry.fileContent
         if (fileName.lower().endswith('.txt')): 
-            print(fileContent)
+            # stream the text so large files are never held in memory at once
+            decoder = codecs.getincrementaldecoder('utf-8')(errors = 'replace')
+            with self.open_node(txtNode) as f:
+                for chunk in f:
+                    print(decoder.decode(chunk), end = '')
+            print(decoder.decode(b'', final = True))
         elif (fileName.lower().endswith('.docx')):
             print('Please use MS Word to open this file!')
         elif (fileName.lower().endswith('.pdf')):
@@ -358,29 +982,18 @@ class NTFS:
         self.printFile(tmpMap[index])
 
     def dfs(self, dirList, curNode = None, index = 1):
-        if (curNode == None):
-            curNode = self.root
         if (index >= len(dirList)):
             return False
-        curObjName = dirList[index].lower()
-        for obj in curNode.children:
-            if (obj.entry.name.lower().strip() == curObjName):
-                if not (obj.entry.isFolder):
-                    if (index == len(dirList) - 1):
-                        return obj
-                    else:
-                        return False
-                elif (obj.entry.isFolder):
-                    if (index == len(dirList) - 1):
-                        # print('is curnode', curNode.dir, ' ', curNode.name, ' ', curNode.isRoot)
-                        self.curNode = obj
-                        return True
-                    return self.dfs(dirList, obj, index + 1)
-        return False
+        obj = self.resolve(dirList, curNode, index)
+        if (obj == None or obj == self.root):
+            return False
+        if (obj.entry.isFolder):
+            self.curNode = obj
+            return True
+        return obj
     
     def followDir(self, dir):
-        dir = dir.replace('\\', '/')
-        dirList = dir.split('/')
+        dirList = menuPath(dir, self.label)
         val = self.dfs(dirList)
         return val
 
@@ -392,13 +1005,13 @@ class NTFS:
             print('found')
             self.printFile(val)
     
+    # dir is /-rooted or starts with the volume name, see menuPath
     def gotoDir(self, dir):
-        dir = dir.replace('\\', '/')
-        dirList = dir.split('/')
+        dirList = menuPath(dir, self.label)
         if (len(dirList) == 1):
-            if (dirList[0] == self.name + ':'):
+            if (dirList[0] == ''):
                 self.curNode = self.root
-                print('Current working directory: ', self.name + ':')
+                print('Current working directory: ', self.label)
                 return
             else:
                 print('Invalid directory!')
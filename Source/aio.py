@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from FAT32 import FAT32
+from NTFS import NTFS
+from volume import Volume, devicePath, detectFileSystem
+
+# asyncio front end of a FAT32 or NTFS volume
+# blocking work runs on `executor` (the loop's default one when None), with at most `concurrency`
+# calls of this volume in flight, so a slow device only holds up its own callers; tree lookups and
+# directory loads are serialised by a lock, file contents are read in parallel
+class AsyncVolume:
+    def __init__(self, disk, concurrency = 4, executor = None):
+        self.disk = disk
+        self.executor = executor
+        self.limit = asyncio.Semaphore(concurrency)
+        self.treeLock = threading.Lock()
+
+    # mount `name` (a drive letter, an image file or a block device) without blocking the loop
+    # the file system is detected from the boot sector; other keyword arguments go to FAT32 or NTFS
+    @classmethod
+    async def open(cls, name, offset = 0, concurrency = 4, executor = None, **options):
+        def mount():
+            volume = Volume(devicePath(name), offset)
+            try:
+                fileSystem = detectFileSystem(volume.read(0, 512))
+            finally:
+                volume.close()
+            if (fileSystem == 'FAT32'):
+                return FAT32(name, offset, **options)
+            if (fileSystem == 'NTFS'):
+                return NTFS(name, offset, **options)
+            raise ValueError(f'{name}: unsupported file system')
+        disk = await asyncio.get_running_loop().run_in_executor(executor, mount)
+        return cls(disk, concurrency, executor)
+
+    async def run(self, function, *args):
+        async with self.limit:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    # paths are taken from the root of the volume, with / or \ between names
+    def node(self, path):
+        node = self.disk.getNode('/' + path.replace('\\', '/').strip('/'))
+        if (node == None):
+            raise FileNotFoundError(path)
+        return node
+
+    def statSync(self, path):
+        with self.treeLock:
+            return self.disk.stat_node(self.node(path))
+
+    def listSync(self, path):
+        with self.treeLock:
+            return [self.disk.stat_node(child) for child in self.disk.list_node(self.node(path))]
+
+    def readSync(self, path, offset, size):
+        with self.treeLock:
+            file = self.disk.open_node(self.node(path))
+        with file:
+            # os.preadv lets reads of other files run at the same time
+            file.direct = True
+            file.seek(offset)
+            return file.read(size)
+
+    # name, kind, size and times of the entry at `path` (see stat_node)
+    async def stat(self, path):
+        return await self.run(self.statSync, path)
+
+    # stat of every entry in the directory at `path`
+    async def list_dir(self, path = '/'):
+        return await self.run(self.listSync, path)
+
+    # `size` bytes (all when negative) of the file at `path` from byte `offset`
+    async def read(self, path, offset = 0, size = -1):
+        return await self.run(self.readSync, path, offset, size)
+
+    # (directory path, stats of its subdirectories, stats of its files) for every directory below `path`,
+    # top-down like os.walk
+    async def walk(self, path = '/'):
+        pending = ['/' + path.replace('\\', '/').strip('/')]
+        while (len(pending) > 0):
+            current = pending.pop()
+            entries = await self.list_dir(current)
+            dirs = [entry for entry in entries if entry['isDir']]
+            files = [entry for entry in entries if not entry['isDir']]
+            yield current, dirs, files
+            for entry in reversed(dirs):
+                pending.append(current.rstrip('/') + '/' + entry['name'])
+
+    async def close(self):
+        await self.run(self.disk.ptr.close)
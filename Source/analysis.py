@@ -0,0 +1,188 @@
+# FAT32 entries are 28 bits, the top four bits of each are reserved; values from this one up are bad or end a chain
+BAD_CLUSTER = 0x0FFFFFF7
+FSINFO_LEAD_SIGNATURE = 0x41615252
+FSINFO_STRUCT_SIGNATURE = 0x61417272
+FSINFO_UNKNOWN = 0xFFFFFFFF
+LOW_NIBBLE = bytes(value & 0x0F for value in range(256))
+# files listed in the report as the most fragmented
+TOP_FRAGMENTED = 10
+
+# every pass below works on whole byte strings (slices, translate, count, find, big-integer OR, memcmp),
+# so the cost per cluster is paid in C and no Python code runs once per cluster
+
+# the FAT entries of clusters 2..count+1 as little-endian bytes with the reserved bits cleared
+def maskedEntries(fatData, count):
+    data = bytearray(fatData[8:8 + 4 * count])
+    high = data[3::4]
+    low = high.translate(LOW_NIBBLE)
+    if (low != high):
+        data[3::4] = low
+    return bytes(data)
+
+# one byte per entry, zero exactly for free clusters: the four bytes of each entry OR-ed together
+def usageBytes(entries):
+    count = len(entries) // 4
+    combined = 0
+    for i in range(4):
+        combined |= int.from_bytes(entries[i::4], byteorder='little')
+    return combined.to_bytes(count, byteorder='little')
+
+# number of 4-byte aligned occurrences of `pattern` in `data`
+def countAligned(data, pattern):
+    count = 0
+    position = data.find(pattern)
+    while (position >= 0):
+        if (position % 4 == 0):
+            count += 1
+            position = data.find(pattern, position + 4)
+        else:
+            position = data.find(pattern, position + 1)
+    return count
+
+# (start, length) of the longest run of zero bytes, found with doubling then halving searches for
+# runs of a given length; (None, 0) when there is none
+def longestZeroRun(data):
+    if (data.find(b'\x00') < 0):
+        return None, 0
+    low = 1
+    while (low * 2 <= len(data) and data.find(bytes(low * 2)) >= 0):
+        low *= 2
+    high = min(low * 2, len(data) + 1)
+    # a run of `low` zeros exists, none of `high`
+    while (high - low > 1):
+        middle = (low + high) // 2
+        if (data.find(bytes(middle)) >= 0):
+            low = middle
+        else:
+            high = middle
+    return data.find(bytes(low)), low
+
+# the FAT entries of clusters 2..count+1 if every cluster pointed to the next one: 3, 4, 5, ... as
+# little-endian 32-bit values, built one byte lane at a time from repeated patterns
+def contiguousEntries(count):
+    total = count + 3
+    data = bytearray(4 * total)
+    for lane in range(4):
+        # consecutive values sharing the byte of this lane
+        width = 1 << (8 * lane)
+        # runs longer than the sequence are cut to it, so a small FAT gets small patterns
+        pattern = b''.join(bytes([value]) * min(width, total) for value in range(min(256, -(-total // width))))
+        data[lane::4] = (pattern * -(-total // len(pattern)))[:total]
+    return bytes(data[12:])
+
+# counts extents of cluster chains by comparing the FAT with the entries a fully contiguous chain would have:
+# the matching stretch from a cluster is one extent, found with a few memcmp calls
+class ExtentCounter:
+    def __init__(self, entries):
+        self.count = len(entries) // 4
+        self.entries = entries
+        self.contiguous = contiguousEntries(self.count)
+
+    # whether the entries at indexes first..last-1 each point to the next cluster
+    def matches(self, first, last):
+        return self.entries.startswith(self.contiguous[4 * first:4 * last], 4 * first)
+
+    # index (cluster - 2) of the last cluster of the extent starting at index `first`
+    def extentEnd(self, first, limit):
+        # the whole remaining file at once, the usual answer
+        if (self.matches(first, limit - 1)):
+            return limit - 1
+        step = 1
+        low = first
+        high = first
+        while True:
+            high = min(low + step, limit - 1)
+            if (not self.matches(low, high)):
+                break
+            low = high
+            step *= 2
+        # the first entry not pointing to the next cluster is in [low, high)
+        while (high - low > 1):
+            middle = (low + high) // 2
+            if (self.matches(low, middle)):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    # extents of the chain starting at cluster `start` that hold `clusters` clusters (the file size)
+    def extents(self, start, clusters):
+        extents = 0
+        index = start - 2
+        while (clusters > 0 and 0 <= index < self.count):
+            end = self.extentEnd(index, min(self.count, index + clusters))
+            extents += 1
+            clusters -= end - index + 1
+            nxt = int.from_bytes(self.entries[4 * end:4 * end + 4], byteorder='little')
+            if (nxt >= BAD_CLUSTER):
+                break
+            index = nxt - 2
+        return extents
+
+# histogram bucket of an extent count: 1, 2, 3-4, 5-8, 9-16, ...
+def extentBucket(extents):
+    if (extents <= 2):
+        return str(extents)
+    high = 1 << (extents - 1).bit_length()
+    return f'{high // 2 + 1}-{high}'
+
+# free count and next free cluster hint of the FSInfo sector, None fields when it is not valid
+def readFsInfo(sector):
+    valid = int.from_bytes(sector[0:4], byteorder='little') == FSINFO_LEAD_SIGNATURE and int.from_bytes(sector[484:488], byteorder='little') == FSINFO_STRUCT_SIGNATURE
+    if (not valid):
+        return {'valid': False, 'freeClusters': None, 'nextFree': None}
+    free = int.from_bytes(sector[488:492], byteorder='little')
+    nextFree = int.from_bytes(sector[492:496], byteorder='little')
+    return {'valid': True, 'freeClusters': None if free == FSINFO_UNKNOWN else free, 'nextFree': None if nextFree == FSINFO_UNKNOWN else nextFree}
+
+# free space and fragmentation of a FAT32 volume from its FAT, see FAT32.analyze
+# with perFile set the report also lists the extent count of every file, in the order of `files`
+def analyzeFat32(disk, files, perFile = False):
+    bs = disk.boot_sector
+    clusterSize = bs.sectors_per_cluster * bs.bytes_per_sector
+    clusters = min((bs.total_sectors - bs.RDET_start) // bs.sectors_per_cluster, disk.fat.size - 2)
+    entries = maskedEntries(disk.fat.data, clusters)
+    usage = usageBytes(entries)
+    free = usage.count(0)
+    bad = countAligned(entries, BAD_CLUSTER.to_bytes(4, byteorder='little'))
+    runStart, runLength = longestZeroRun(usage)
+
+    fsInfo = readFsInfo(bytes(disk.ptr.read(bs.fsinfo_sector * bs.bytes_per_sector, 512)))
+    fsInfo['matches'] = fsInfo['freeClusters'] == free if fsInfo['freeClusters'] != None else None
+
+    counter = ExtentCounter(entries)
+    histogram = {}
+    fragmented = []
+    fileExtents = []
+    totalExtents = 0
+    for path, startCluster, size in files:
+        if (size == 0 or startCluster < 2):
+            continue
+        extents = counter.extents(startCluster, (size + clusterSize - 1) // clusterSize)
+        totalExtents += extents
+        if (perFile):
+            fileExtents.append({'path': path, 'extents': extents})
+        bucket = extentBucket(extents)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+        if (extents > 1):
+            fragmented.append((extents, path))
+    fragmented.sort(key = lambda item: (-item[0], item[1]))
+    fileCount = sum(histogram.values())
+    report = {
+        'clusterSize': clusterSize,
+        'clusters': clusters,
+        'freeClusters': free,
+        'badClusters': bad,
+        'usedClusters': clusters - free - bad,
+        'freeBytes': free * clusterSize,
+        'largestFreeRun': {'cluster': None if runStart == None else runStart + 2, 'clusters': runLength, 'bytes': runLength * clusterSize},
+        'fsInfo': fsInfo,
+        'files': fileCount,
+        'fragmentedFiles': len(fragmented),
+        'extentsPerFile': totalExtents / fileCount if fileCount > 0 else 0,
+        'extentHistogram': dict(sorted(histogram.items(), key = lambda item: int(item[0].split('-')[0]))),
+        'mostFragmented': [{'path': path, 'extents': extents} for extents, path in fragmented[:TOP_FRAGMENTED]],
+    }
+    if (perFile):
+        report['fileExtents'] = fileExtents
+    return report
@@ -0,0 +1,193 @@
+# benchmark FAT32 and NTFS on generated images and print the results as JSON
+# python benchmark.py [--files N] [--depth D] [--fanout F] [--fragment K] [--repeat R] [--output FILE] [--baseline FILE]
+# with --baseline, metrics that got worse by more than --tolerance are listed and the exit status is 1
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from FAT32 import FAT32, Attribute
+from NTFS import NTFS
+from imagegen import generateTree, buildFat32, buildNtfs
+
+RESULT_SCHEMA = 1
+
+def isFolder(disk, node):
+    if (isinstance(disk, FAT32)):
+        return node.isRoot or bool(node.info.attr & Attribute.DIRECTORY)
+    return bool(node.entry.isFolder)
+
+# (path, node) of every entry below the root in tree order, the whole tree is read first on FAT32
+def walkTree(disk):
+    if (isinstance(disk, FAT32)):
+        disk.loadFat()
+        disk.load_tree(disk.root)
+    entries = []
+    stack = [(disk.root, '')]
+    while (len(stack) > 0):
+        node, path = stack.pop()
+        if (node != disk.root):
+            entries.append((path, node))
+        for child in reversed(node.children):
+            # the NTFS root is its own parent
+            if (child != node):
+                stack.append((child, path + '/' + (child.name if isinstance(disk, FAT32) else child.entry.name)))
+    return entries
+
+def closeDisk(disk):
+    disk.ptr.close()
+
+# best wall-clock time of `repeat` calls of `function`, and the value of the last call
+def bestOf(repeat, function):
+    best = None
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return best, value
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def benchmarkVolume(cls, path, repeat, lookups, seed):
+    results = {}
+    mount = lambda: cls(path)
+    results['mount_s'], disk = bestOf(repeat, mount)
+    closeDisk(disk)
+
+    def walk():
+        disk = mount()
+        start = time.perf_counter()
+        entries = walkTree(disk)
+        return time.perf_counter() - start, disk, entries
+    walks = [walk() for _ in range(repeat)]
+    results['walk_s'] = min(w[0] for w in walks)
+    for w in walks[:-1]:
+        closeDisk(w[1])
+    disk, entries = walks[-1][1], walks[-1][2]
+    results['entries'] = len(entries)
+
+    # first lookup of each path: without the memo of earlier lookups and with the child indexes of the
+    # directories on the way dropped, so every sample builds them again (the directories stay read)
+    sample = random.Random(seed).sample(entries, min(lookups, len(entries)))
+    nodes = dict(entries)
+    latencies = []
+    for path, node in sample:
+        disk.pathIndex = {}
+        disk.root.index = None
+        parts = path.split('/')
+        for depth in range(2, len(parts)):
+            nodes['/'.join(parts[:depth])].index = None
+        start = time.perf_counter()
+        found = disk.getNode(path)
+        latencies.append(time.perf_counter() - start)
+        if (found != node):
+            raise RuntimeError(f'lookup of {path} returned the wrong node')
+    results['lookup_mean_us'] = sum(latencies) / len(latencies) * 1e6 if latencies else 0
+    results['lookup_p95_us'] = percentile(latencies, 0.95) * 1e6 if latencies else 0
+
+    # the listing command on every directory, output discarded
+    folders = [disk.root] + [node for path, node in entries if isFolder(disk, node)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for node in folders:
+            disk.curNode = node
+            disk.listDir()
+    disk.curNode = disk.root
+    results['list_dir_mean_ms'] = (time.perf_counter() - start) / len(folders) * 1e3
+
+    # every file read front to back in tree order
+    def readAll():
+        total = 0
+        for path, node in entries:
+            if (not isFolder(disk, node)):
+                with disk.open_node(node) as f:
+                    for chunk in f:
+                        total += len(chunk)
+        return total
+    elapsed, total = bestOf(repeat, readAll)
+    results['read_bytes'] = total
+    results['read_mb_s'] = total / elapsed / 1e6 if elapsed > 0 else 0
+    closeDisk(disk)
+    return results
+
+# metrics present in both runs that are worse than the baseline by more than `tolerance` (a fraction)
+# throughput metrics (*_mb_s) are better when higher, times better when lower
+def regressions(current, baseline, tolerance):
+    found = []
+    for fileSystem, metrics in current['results'].items():
+        old = baseline.get('results', {}).get(fileSystem, {})
+        for name, value in metrics.items():
+            if (name not in old or not isinstance(value, (int, float)) or name in ('entries', 'read_bytes', 'image_bytes', 'build_s')):
+                continue
+            before = old[name]
+            if (before <= 0):
+                continue
+            if (name.endswith('_mb_s')):
+                change = (before - value) / before
+            elif (name.endswith('_s') or name.endswith('_ms') or name.endswith('_us')):
+                change = (value - before) / before
+            else:
+                continue
+            if (change > tolerance):
+                found.append({'fileSystem': fileSystem, 'metric': name, 'baseline': before, 'current': value, 'change': change})
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark the FAT32 and NTFS readers on generated images.')
+    parser.add_argument('--files', type = int, default = 5000)
+    parser.add_argument('--depth', type = int, default = 3)
+    parser.add_argument('--fanout', type = int, default = 3)
+    parser.add_argument('--fragment', type = int, default = 0)
+    parser.add_argument('--short-names', action = 'store_true')
+    parser.add_argument('--max-file-size', type = int, default = 3000)
+    parser.add_argument('--big-file', type = int, default = 16 * 1024 * 1024)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--lookups', type = int, default = 1000)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--workdir', help = 'keep the images in this directory instead of a temporary one')
+    parser.add_argument('--output', help = 'write the JSON results to this file as well')
+    parser.add_argument('--baseline', help = 'JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.25)
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key not in ('workdir', 'output', 'baseline')}
+    report = {
+        'schema': RESULT_SCHEMA,
+        'time': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok = True)
+        tree = generateTree(args.files, args.depth, args.fanout, not args.short_names, args.max_file_size, args.big_file, args.seed)
+        for name, cls, build in (('FAT32', FAT32, buildFat32), ('NTFS', NTFS, buildNtfs)):
+            path = os.path.join(workdir, name.lower() + '.img')
+            start = time.perf_counter()
+            size = build(path, tree, fragment = args.fragment, seed = args.seed)
+            metrics = {'image_bytes': size, 'build_s': time.perf_counter() - start}
+            metrics.update(benchmarkVolume(cls, path, args.repeat, args.lookups, args.seed))
+            report['results'][name] = metrics
+    status = 0
+    if (args.baseline != None):
+        with open(args.baseline) as f:
+            report['regressions'] = regressions(report, json.load(f), args.tolerance)
+        status = 1 if report['regressions'] else 0
+    text = json.dumps(report, indent = 2)
+    if (args.output != None):
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    sys.exit(status)
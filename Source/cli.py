@@ -0,0 +1,172 @@
+# one-shot commands for scripts: python main.py <command> --image <image|/dev|drive> [--offset N] [--format json|ndjson]
+#   info          boot sector summary (or the partitions of a full-disk image), one boot sector read
+#   ls [PATH]     entries of a directory
+#   stat PATH     one entry
+#   tree [PATH]   every entry below a directory, top-down
+#   cat PATH      raw content of a file on stdout
+#   extract PATH DEST  copy a file or folder to DEST on the host, timestamps kept; prints counts and throughput
+#   analyze [--all]  free space and file fragmentation of a FAT32 volume, --all adds the extent count of every file
+# times are ISO 8601: NTFS ones in UTC with their offset, FAT32 ones as stored, in the volume's local time
+# with --daemon SOCKET the questions go to a running daemon.py, which keeps the volume mounted between calls
+# the file system modules are only imported once a command needs the tree
+import argparse
+import errno
+import json
+import os
+import sys
+from volume import Volume, devicePath, detectFileSystem, partitionOffsets
+
+COMMANDS = ('info', 'ls', 'cat', 'tree', 'stat', 'extract', 'analyze')
+
+# boot sector fields worth showing, read straight from the sector so that `info` needs nothing else
+def bootInfo(boot, fileSystem):
+    info = {
+        'fileSystem': fileSystem,
+        'bytesPerSector': int.from_bytes(boot[11:13], byteorder='little'),
+        'sectorsPerCluster': boot[13],
+    }
+    if (fileSystem == 'FAT32'):
+        info['reservedSectors'] = int.from_bytes(boot[14:16], byteorder='little')
+        info['fatCount'] = boot[16]
+        info['totalSectors'] = int.from_bytes(boot[32:36], byteorder='little')
+        info['fatSize'] = int.from_bytes(boot[36:40], byteorder='little')
+        info['rootCluster'] = int.from_bytes(boot[44:48], byteorder='little')
+        info['serial'] = '%08X' % int.from_bytes(boot[67:71], byteorder='little')
+        info['label'] = bytes(boot[71:82]).decode('ascii', errors = 'replace').strip()
+    else:
+        info['totalSectors'] = int.from_bytes(boot[0x28:0x30], byteorder='little')
+        info['mftCluster'] = int.from_bytes(boot[0x30:0x38], byteorder='little')
+        info['mftMirrorCluster'] = int.from_bytes(boot[0x38:0x40], byteorder='little')
+        info['serial'] = '%016X' % int.from_bytes(boot[0x48:0x50], byteorder='little')
+    info['sizeBytes'] = info['totalSectors'] * info['bytesPerSector']
+    return info
+
+def jsonValue(value):
+    if (hasattr(value, 'isoformat')):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def output(items, form, single = False):
+    if (form == 'ndjson'):
+        for item in ([items] if single else items):
+            sys.stdout.write(json.dumps(item, default = jsonValue, ensure_ascii = False) + '\n')
+    else:
+        sys.stdout.write(json.dumps(items, default = jsonValue, ensure_ascii = False, indent = 2) + '\n')
+
+def mount(args, fileSystem):
+    if (fileSystem == 'FAT32'):
+        from FAT32 import FAT32
+        # FAT32 reads directories on demand, so only the ones on the way to the answer are loaded
+        return FAT32(args.image, args.offset)
+    from NTFS import NTFS
+    if (args.command != 'tree'):
+        # one path: follow the directory indexes from the root instead of scanning the MFT
+        return NTFS(args.image, args.offset, scan = False)
+    from snapshot import defaultSnapshotDir
+    # the MFT scan is the expensive part, reuse the saved one while the volume is unchanged
+    return NTFS(args.image, args.offset, snapshotDir = None if args.no_snapshot else defaultSnapshotDir())
+
+def entryPath(parent, name):
+    return parent.rstrip('/') + '/' + name
+
+def findNode(disk, path):
+    node = disk.getNode('/' + path.replace('\\', '/').strip('/'))
+    if (node == None):
+        raise FileNotFoundError(errno.ENOENT, 'No such file or directory', path)
+    return node
+
+def run(args):
+    if (args.daemon != None and args.command not in ('info', 'extract', 'analyze')):
+        from daemon import DaemonClient, RemoteDisk
+        with DaemonClient(args.daemon) as client:
+            return answer(args, RemoteDisk(client, args.image, args.offset))
+    volume = Volume(devicePath(args.image), args.offset)
+    try:
+        boot = bytes(volume.read(0, 512))
+    finally:
+        volume.close()
+    fileSystem = detectFileSystem(boot)
+    if (args.command == 'info'):
+        if (fileSystem == None):
+            partitions = partitionOffsets(devicePath(args.image)) if args.offset == 0 else []
+            output({'fileSystem': None, 'partitions': [{'offset': offset, 'size': size, 'type': partType} for offset, size, partType in partitions]}, args.format, True)
+            return 0 if partitions else 1
+        output(bootInfo(boot, fileSystem), args.format, True)
+        return 0
+    if (fileSystem == None):
+        raise ValueError('no FAT32 or NTFS file system at this offset (see the partitions listed by info)')
+    if (args.command == 'analyze'):
+        if (fileSystem != 'FAT32'):
+            raise ValueError('only FAT32 volumes can be analyzed')
+        output(mount(args, fileSystem).analyze(args.all), args.format, True)
+        return 0
+
+    return answer(args, mount(args, fileSystem))
+
+# ls, stat, tree, cat or extract on a mounted volume
+def answer(args, disk):
+    path = '/' + args.path.replace('\\', '/').strip('/')
+    if (args.command == 'extract'):
+        output(disk.extract(path, args.dest, args.workers), args.format, True)
+        return 0
+    node = findNode(disk, path)
+    if (args.command == 'stat'):
+        output(dict(disk.stat_node(node), path = path), args.format, True)
+    elif (args.command == 'ls'):
+        output([dict(disk.stat_node(child), path = entryPath(path, disk.stat_node(child)['name'])) for child in disk.list_node(node)], args.format)
+    elif (args.command == 'tree'):
+        entries = []
+        stack = [(path, node)]
+        while (len(stack) > 0):
+            current, directory = stack.pop()
+            children = [(disk.stat_node(child), child) for child in disk.list_node(directory)]
+            for stat, child in children:
+                stat['path'] = entryPath(current, stat['name'])
+                if (args.format == 'ndjson'):
+                    output(stat, 'ndjson', True)
+                else:
+                    entries.append(stat)
+            for stat, child in reversed(children):
+                if (stat['isDir']):
+                    stack.append((stat['path'], child))
+        if (args.format != 'ndjson'):
+            output(entries, args.format)
+    elif (args.command == 'cat'):
+        if (disk.stat_node(node)['isDir']):
+            raise IsADirectoryError(errno.EISDIR, 'Is a directory', path)
+        with disk.open_node(node) as f:
+            for chunk in f:
+                sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = 'main.py', description = 'Inspect a FAT32 or NTFS volume without the interactive menu.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    for command in COMMANDS:
+        sub = commands.add_parser(command)
+        sub.add_argument('--image', required = True, help = 'image file, block device or drive letter')
+        sub.add_argument('--offset', type = lambda value: int(value, 0), default = 0, help = 'partition start in bytes')
+        sub.add_argument('--format', choices = ['json', 'ndjson'], default = 'json')
+        sub.add_argument('--no-snapshot', action = 'store_true', help = 'always scan the NTFS MFT')
+        sub.add_argument('--daemon', metavar = 'SOCKET', help = 'ask the daemon listening on this socket')
+        if (command in ('cat', 'stat')):
+            sub.add_argument('path')
+        elif (command == 'extract'):
+            sub.add_argument('path')
+            sub.add_argument('dest')
+            sub.add_argument('--workers', type = int, default = 4, help = 'files written at the same time')
+        elif (command == 'analyze'):
+            sub.add_argument('--all', action = 'store_true', help = 'list the extent count of every file')
+        elif (command in ('ls', 'tree')):
+            sub.add_argument('path', nargs = '?', default = '/')
+    args = parser.parse_args(argv)
+    try:
+        return run(args)
+    except BrokenPipeError:
+        # the reader (head, grep -m ...) stopped early, which is not an error for a one-shot command
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError) as error:
+        sys.stderr.write(f'{args.command}: {error}\n')
+        return 1
@@ -0,0 +1,395 @@
+# keep FAT32 and NTFS volumes mounted and answer questions about them over a Unix domain socket
+# python daemon.py --socket PATH [--no-preload]
+#
+# every message, both ways, is one frame: header length and body length as big-endian 32-bit integers,
+# a compact JSON header, then the body bytes (only file contents travel in a body)
+#   request  {"op": ..., "image": ..., "offset": ..., other arguments}
+#   reply    {"ok": true, "result": ...} or {"ok": false, "error": message, "type": exception name}
+# ops: ping, mount, volumes, unmount, stat, list, read (from "start", "size" bytes), search, shutdown
+# a volume is mounted by the first request naming it and stays mounted until unmount or shutdown
+# clients are served on their own threads; a connection may send any number of requests, one at a time
+import argparse
+import datetime
+import errno
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from stat import S_ISSOCK
+from cli import jsonValue
+from volume import Volume, devicePath, detectFileSystem
+
+FRAME = struct.Struct('>II')
+# requests are small, a larger one is a confused or hostile client (replies carry whole listings)
+MAX_REQUEST_SIZE = 1024 * 1024
+MAX_READ_SIZE = 64 * 1024 * 1024
+
+# the other end broke the framing or hung up mid-frame
+class ProtocolError(OSError):
+    pass
+
+def receiveExactly(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while (received < size):
+        count = sock.recv_into(view[received:])
+        if (count == 0):
+            if (received == 0):
+                return None
+            raise ProtocolError('connection closed inside a frame')
+        received += count
+    return bytes(data)
+
+# (header dict, body bytes) of the next frame, None when the peer closed the connection between frames
+def receiveFrame(sock, maxHeader = None, maxBody = None):
+    sizes = receiveExactly(sock, FRAME.size)
+    if (sizes == None):
+        return None
+    headerSize, bodySize = FRAME.unpack(sizes)
+    if ((maxHeader != None and headerSize > maxHeader) or (maxBody != None and bodySize > maxBody)):
+        raise ProtocolError('frame too large')
+    header = receiveExactly(sock, headerSize) or b''
+    body = receiveExactly(sock, bodySize) or b''
+    if (len(header) != headerSize or len(body) != bodySize):
+        raise ProtocolError('connection closed inside a frame')
+    return json.loads(header), body
+
+def sendFrame(sock, header, body = b''):
+    data = json.dumps(header, default = jsonValue, ensure_ascii = False, separators = (',', ':')).encode('utf-8')
+    sock.sendall(FRAME.pack(len(data), len(body)) + data)
+    if (len(body) > 0):
+        sock.sendall(body)
+
+def normPath(path):
+    return '/' + str(path).replace('\\', '/').strip('/')
+
+# a mounted volume and the lock that serialises its tree: lookups, directory loads and the search index
+# requests in progress are counted, close waits for them so that no read is left on a closed descriptor
+class Mounted:
+    def __init__(self, disk, fileSystem):
+        self.disk = disk
+        self.fileSystem = fileSystem
+        self.treeLock = threading.Lock()
+        self.users = 0
+        self.closed = False
+        self.idle = threading.Condition()
+
+    # enter and leave around every request on the volume, acquire is False once the volume is closing
+    def acquire(self):
+        with self.idle:
+            if (self.closed):
+                return False
+            self.users += 1
+            return True
+
+    def release(self):
+        with self.idle:
+            self.users -= 1
+            self.idle.notify_all()
+
+    def node(self, path):
+        node = self.disk.getNode(normPath(path))
+        if (node == None):
+            raise FileNotFoundError(errno.ENOENT, 'No such file or directory', path)
+        return node
+
+    def stat(self, path):
+        with self.treeLock:
+            return dict(self.disk.stat_node(self.node(path)), path = normPath(path))
+
+    def list(self, path):
+        base = normPath(path).rstrip('/')
+        with self.treeLock:
+            stats = [self.disk.stat_node(child) for child in self.disk.list_node(self.node(path))]
+        for stat in stats:
+            stat['path'] = base + '/' + stat['name']
+        return stats
+
+    def read(self, path, offset, size):
+        with self.treeLock:
+            file = self.disk.open_node(self.node(path))
+        with file:
+            # os.preadv lets other clients read at the same time
+            file.direct = True
+            file.seek(offset)
+            return file.read(size)
+
+    def search(self, pattern, regex, minSize, maxSize, after, before, kind):
+        with self.treeLock:
+            results = self.disk.search(pattern, regex, minSize, maxSize, after, before, kind)
+            # times as stat reports them (the index holds the ones the menu shows)
+            return [{'path': path, 'size': size, 'modified': self.disk.stat_node(node)['modified']} for path, size, modified, node in results]
+
+    def close(self):
+        with self.idle:
+            self.closed = True
+            self.idle.wait_for(lambda: self.users == 0)
+        with self.treeLock:
+            # keep the directories read while mounted for the next mount (NTFS saves right after its scan)
+            if (self.fileSystem == 'FAT32'):
+                self.disk.saveSnapshot()
+            self.disk.ptr.close()
+
+# the file system modules are imported here so that clients importing this module stay quick to start
+def mountVolume(name, offset, preload):
+    from snapshot import defaultSnapshotDir
+    volume = Volume(devicePath(name), offset)
+    try:
+        fileSystem = detectFileSystem(volume.read(0, 512))
+    finally:
+        volume.close()
+    if (fileSystem == 'FAT32'):
+        from FAT32 import FAT32
+        disk = FAT32(name, offset, snapshotDir = defaultSnapshotDir())
+        if (preload):
+            # pay for the whole tree once so that no later lookup waits for a directory read
+            disk.loadFat()
+            disk.load_tree(disk.root)
+    elif (fileSystem == 'NTFS'):
+        from NTFS import NTFS
+        disk = NTFS(name, offset, snapshotDir = defaultSnapshotDir())
+    else:
+        raise ValueError(f'{name}: unsupported file system')
+    return Mounted(disk, fileSystem)
+
+# remove a socket left at `path` (by an earlier run), refusing to touch anything that is not a socket
+def removeSocket(path, strict = False):
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if (not S_ISSOCK(mode)):
+        if (strict):
+            raise FileExistsError(errno.EEXIST, 'File exists and is not a socket', path)
+        return
+    os.unlink(path)
+
+def isoDate(value):
+    if (value == None):
+        return None
+    return datetime.date.fromisoformat(value)
+
+class ExplorerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath, preload = True):
+        self.socketPath = socketPath
+        self.preload = preload
+        self.volumes = {}
+        # held while a volume is being mounted, requests for other mounted volumes go on meanwhile
+        self.mountLock = threading.Lock()
+        removeSocket(socketPath, True)
+        # only the owner may connect
+        mask = os.umask(0o077)
+        try:
+            super().__init__(socketPath, ExplorerHandler)
+        finally:
+            os.umask(mask)
+
+    def volumeKey(self, request):
+        if ('image' not in request):
+            raise ValueError('missing "image"')
+        name = request['image']
+        if (os.path.exists(name)):
+            name = os.path.realpath(name)
+        return name, int(request.get('offset', 0))
+
+    def mounted(self, request):
+        key = self.volumeKey(request)
+        mounted = self.volumes.get(key)
+        if (mounted != None):
+            return mounted
+        with self.mountLock:
+            if (key not in self.volumes):
+                self.volumes[key] = mountVolume(key[0], key[1], self.preload)
+            return self.volumes[key]
+
+    # result and body of one request
+    def answer(self, request):
+        op = request.get('op')
+        if (op == 'ping'):
+            return 'pong', b''
+        if (op == 'volumes'):
+            return [{'image': name, 'offset': offset, 'fileSystem': mounted.fileSystem} for (name, offset), mounted in list(self.volumes.items())], b''
+        if (op == 'unmount'):
+            with self.mountLock:
+                mounted = self.volumes.pop(self.volumeKey(request), None)
+            if (mounted != None):
+                mounted.close()
+            return mounted != None, b''
+        if (op == 'shutdown'):
+            threading.Thread(target = self.shutdown).start()
+            return True, b''
+        mounted = self.mounted(request)
+        while (not mounted.acquire()):
+            # unmounted meanwhile, mount it again
+            mounted = self.mounted(request)
+        try:
+            return self.answerVolume(op, request, mounted)
+        finally:
+            mounted.release()
+
+    def answerVolume(self, op, request, mounted):
+        if (op == 'mount'):
+            return {'fileSystem': mounted.fileSystem}, b''
+        if (op == 'stat'):
+            return mounted.stat(request.get('path', '/')), b''
+        if (op == 'list'):
+            return mounted.list(request.get('path', '/')), b''
+        if (op == 'read'):
+            size = int(request.get('size', -1))
+            if (size < 0 or size > MAX_READ_SIZE):
+                size = MAX_READ_SIZE
+            data = mounted.read(request['path'], int(request.get('start', 0)), size)
+            return {'size': len(data)}, data
+        if (op == 'search'):
+            return mounted.search(request.get('pattern'), bool(request.get('regex', False)), request.get('minSize'), request.get('maxSize'),
+                                  isoDate(request.get('after')), isoDate(request.get('before')), request.get('kind')), b''
+        raise ValueError(f'unknown op {op!r}')
+
+    def server_close(self):
+        super().server_close()
+        with self.mountLock:
+            volumes = list(self.volumes.values())
+            self.volumes = {}
+        for mounted in volumes:
+            mounted.close()
+        removeSocket(self.socketPath)
+
+class ExplorerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                frame = receiveFrame(self.request, MAX_REQUEST_SIZE, 0)
+            except (ProtocolError, ValueError, OSError):
+                return
+            if (frame == None):
+                return
+            request, body = frame
+            try:
+                result, body = self.server.answer(request)
+                reply = {'ok': True, 'result': result}
+            except Exception as error:
+                reply = {'ok': False, 'error': str(error), 'type': type(error).__name__}
+                body = b''
+            try:
+                sendFrame(self.request, reply, body)
+            except OSError:
+                return
+
+# a request the daemon answered with an error, `kind` being the name of the exception it raised
+class DaemonError(OSError):
+    def __init__(self, message, kind):
+        super().__init__(message)
+        self.kind = kind
+
+# one connection to the daemon, requests are sent one at a time (use one client per thread)
+class DaemonClient:
+    def __init__(self, socketPath):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socketPath)
+
+    # result and body of one request, a failed request raises DaemonError (FileNotFoundError for missing paths)
+    def call(self, op, **arguments):
+        sendFrame(self.sock, dict(arguments, op = op))
+        frame = receiveFrame(self.sock)
+        if (frame == None):
+            raise ProtocolError('daemon closed the connection')
+        reply, body = frame
+        if (not reply['ok']):
+            if (reply['type'] == 'FileNotFoundError'):
+                raise FileNotFoundError(reply['error'])
+            raise DaemonError(reply['error'], reply['type'])
+        return reply['result'], body
+
+    def stat(self, image, path, offset = 0):
+        return self.call('stat', image = image, offset = offset, path = path)[0]
+
+    def list(self, image, path = '/', offset = 0):
+        return self.call('list', image = image, offset = offset, path = path)[0]
+
+    def read(self, image, path, start = 0, size = -1, offset = 0):
+        return self.call('read', image = image, offset = offset, path = path, start = start, size = size)[1]
+
+    def search(self, image, pattern = None, offset = 0, **filters):
+        return self.call('search', image = image, offset = offset, pattern = pattern, **filters)[0]
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# a volume served by the daemon with the getNode/list_node/stat_node/open_node calls of FAT32 and NTFS,
+# nodes being the stat dicts the daemon returns
+class RemoteDisk:
+    def __init__(self, client, image, offset = 0):
+        self.client = client
+        # the daemon resolves image paths from its own working directory
+        self.image = os.path.abspath(image) if os.path.exists(image) else image
+        self.offset = offset
+
+    # a missing path raises FileNotFoundError with the daemon's message, which also covers a missing image
+    def getNode(self, path):
+        return self.client.stat(self.image, path, self.offset)
+
+    def list_node(self, node):
+        return self.client.list(self.image, node['path'], self.offset)
+
+    def stat_node(self, node):
+        return {key: value for key, value in node.items() if key != 'path'}
+
+    def open_node(self, node):
+        return RemoteFile(self, node['path'], node['size'])
+
+# content of a file on a RemoteDisk, fetched a piece at a time while iterating
+class RemoteFile:
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, disk, path, size):
+        self.disk = disk
+        self.path = path
+        self.size = size
+
+    def __iter__(self):
+        position = 0
+        while (position < self.size):
+            data = self.disk.client.read(self.disk.image, self.path, position, min(self.CHUNK_SIZE, self.size - position), self.disk.offset)
+            if (len(data) == 0):
+                return
+            position += len(data)
+            yield data
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Serve FAT32 and NTFS volumes over a Unix domain socket.')
+    parser.add_argument('--socket', required = True, help = 'path of the socket to listen on')
+    parser.add_argument('--no-preload', action = 'store_true', help = 'read FAT32 directories on demand instead of at mount')
+    args = parser.parse_args()
+    try:
+        server = ExplorerServer(args.socket, not args.no_preload)
+    except OSError as error:
+        sys.stderr.write(f'daemon: {error}\n')
+        sys.exit(1)
+    print('listening on', args.socket, file = sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,160 @@
+import errno
+import os
+import threading
+import time
+
+# buffer of the copy used when the kernel cannot copy between the volume and the target itself
+EXTRACT_BUFFER_SIZE = 8 * 1024 * 1024
+# errors meaning "this kind of copy is not possible here", after which the next method is tried
+UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP, errno.ESPIPE}
+
+# names that cannot be created inside the destination as they are
+def unsafeName(name):
+    return name in ('', '.', '..') or '/' in name or '\0' in name or (os.sep != '/' and os.sep in name)
+
+# write `data` at `position` of the file open as `fd`, os.pwrite is missing on Windows
+def writeAt(fd, data, position):
+    if (hasattr(os, 'pwrite')):
+        return os.pwrite(fd, data, position)
+    os.lseek(fd, position, os.SEEK_SET)
+    return os.write(fd, data)
+
+# copy a subtree of a FAT32 or NTFS volume to the host, see FAT32.extract and NTFS.extract
+# the tree is walked and directories created on the calling thread, file contents are copied by
+# `workers` threads; each extent goes through os.copy_file_range, then os.sendfile, then buffered
+# reads of EXTRACT_BUFFER_SIZE, a method failing as unsupported is not tried again
+class Extractor:
+    def __init__(self, disk, workers = 4):
+        self.disk = disk
+        self.workers = workers
+        self.methods = [name for name in ('copy_file_range', 'sendfile') if hasattr(os, name)] + ['buffered']
+        self.lock = threading.Lock()
+        self.files = 0
+        self.directories = 0
+        self.bytes = 0
+        self.skipped = []
+        self.byMethod = {}
+
+    def count(self, method, size):
+        with self.lock:
+            self.bytes += size
+            self.byMethod[method] = self.byMethod.get(method, 0) + size
+
+    def unsupported(self, method):
+        with self.lock:
+            if (method in self.methods and len(self.methods) > 1):
+                self.methods.remove(method)
+
+    # copy `length` bytes at `source` (an absolute offset in `volume`) to `target` at `position`
+    def copyExtent(self, volume, source, fd, position, length):
+        while (length > 0):
+            method = self.methods[0]
+            try:
+                if (method == 'copy_file_range'):
+                    done = os.copy_file_range(volume.file.fileno(), fd, length, source, position)
+                elif (method == 'sendfile'):
+                    os.lseek(fd, position, os.SEEK_SET)
+                    done = os.sendfile(fd, volume.file.fileno(), source, length)
+                else:
+                    buffer = bytearray(min(length, EXTRACT_BUFFER_SIZE))
+                    done = volume.readinto(source - volume.offset, buffer, True)
+                    done = writeAt(fd, memoryview(buffer)[:done], position)
+            except OSError as error:
+                if (method != 'buffered' and error.errno in UNSUPPORTED):
+                    self.unsupported(method)
+                    continue
+                raise
+            if (done == 0):
+                # past the end of the image, the rest stays zero
+                return
+            self.count(method, done)
+            source += done
+            position += done
+            length -= done
+
+    def copyFile(self, file, target, times):
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            with file:
+                if (file.data != None):
+                    os.write(fd, file.data)
+                    self.count('memory', len(file.data))
+                else:
+                    volume = file.volume
+                    for fileOffset, volumeOffset, length in file.extents:
+                        if (volumeOffset == None):
+                            # hole, left to ftruncate
+                            continue
+                        if (volume.size != None):
+                            length = max(0, min(length, volume.size - volumeOffset))
+                        self.copyExtent(volume, volume.offset + volumeOffset, fd, fileOffset, length)
+            # holes and the tail of a short image read as zeros
+            os.ftruncate(fd, file.size)
+        finally:
+            os.close(fd)
+        self.setTimes(target, times)
+        with self.lock:
+            self.files += 1
+
+    def setTimes(self, target, times):
+        accessed, modified = times
+        if (modified == None):
+            return
+        if (accessed == None):
+            accessed = modified
+        os.utime(target, (accessed.timestamp(), modified.timestamp()))
+
+    # recreate `node` as dest/<its name> (the root: its content straight into dest), return a report
+    def run(self, node, dest):
+        start = time.perf_counter()
+        os.makedirs(dest, exist_ok = True)
+        stat = self.disk.stat_node(node)
+        if (stat['name'] != ''):
+            if (unsafeName(stat['name'])):
+                raise ValueError(f'cannot extract an entry named {stat["name"]!r}')
+            dest = os.path.join(dest, stat['name'])
+        pool = None
+        if (self.workers != None and self.workers > 1):
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(max_workers = self.workers)
+        pending = []
+        # directory times are set once everything inside is written, deepest first
+        directories = []
+        try:
+            stack = [(node, stat, dest)]
+            while (len(stack) > 0):
+                current, stat, target = stack.pop()
+                times = (stat['accessed'], stat['modified'])
+                if (not stat['isDir']):
+                    file = self.disk.open_node(current)
+                    if (pool != None):
+                        pending.append(pool.submit(self.copyFile, file, target, times))
+                    else:
+                        self.copyFile(file, target, times)
+                    continue
+                os.makedirs(target, exist_ok = True)
+                directories.append((target, times))
+                self.directories += 1
+                for child in self.disk.list_node(current):
+                    childStat = self.disk.stat_node(child)
+                    if (unsafeName(childStat['name'])):
+                        self.skipped.append(childStat['name'])
+                        continue
+                    stack.append((child, childStat, os.path.join(target, childStat['name'])))
+            for future in pending:
+                future.result()
+        finally:
+            if (pool != None):
+                pool.shutdown()
+        for target, times in reversed(directories):
+            self.setTimes(target, times)
+        elapsed = time.perf_counter() - start
+        return {
+            'files': self.files,
+            'directories': self.directories,
+            'bytes': self.bytes,
+            'seconds': elapsed,
+            'mbPerSecond': self.bytes / elapsed / 1e6 if elapsed > 0 else 0,
+            'methods': dict(self.byMethod),
+            'skipped': list(self.skipped),
+        }
@@ -0,0 +1,116 @@
+import re
+from collections import deque
+from itertools import islice
+from volume import ExtentFile
+
+# piece of a file searched at a time
+GREP_CHUNK_SIZE = 4 * 1024 * 1024
+# a regular expression match crossing a chunk boundary is found as long as it is no longer than this
+GREP_OVERLAP = 4096
+
+# position on the volume of the first byte of a file, -1 for files kept in memory or empty
+def physicalStart(file):
+    for fileOffset, volumeOffset, length in file.extents:
+        if (volumeOffset != None):
+            return volumeOffset
+    return -1
+
+# offsets of the matches of a compiled bytes pattern in a file, read `chunkSize` bytes at a time
+def grepFile(file, pattern, overlap, chunkSize = GREP_CHUNK_SIZE):
+    return grepChunks(iter(lambda: file.read(chunkSize), None), pattern, overlap, chunkSize)
+
+# offsets of the matches in the file whose consecutive `chunkSize` pieces `chunks` yields, the first
+# shorter one (possibly empty) being the last; nothing after it is taken from `chunks`
+# the last `overlap` bytes of each piece are searched again with the next one, matches starting in them
+# are left for that next search so each one is reported once
+def grepChunks(chunks, pattern, overlap, chunkSize):
+    hits = []
+    carry = b''
+    # file offset of the start of the buffer, and where in the buffer the next match may start
+    base = 0
+    skip = 0
+    while True:
+        chunk = next(chunks)
+        last = len(chunk) < chunkSize
+        buffer = carry + chunk if len(carry) > 0 else chunk
+        limit = len(buffer) if last else max(0, len(buffer) - overlap)
+        for match in pattern.finditer(buffer, skip):
+            if (match.start() >= limit):
+                break
+            hits.append(base + match.start())
+            skip = max(match.end(), match.start() + 1)
+        if (last):
+            return hits
+        carry = buffer[limit:]
+        base += limit
+        skip = max(0, skip - limit)
+
+# bytes of `file` at `offset`, read through a copy of it so that several threads can read one file
+def readPiece(file, offset, size):
+    piece = ExtentFile(file.volume, file.extents, file.size, file.name, file.data, direct = True)
+    piece.seek(offset)
+    return piece.read(size)
+
+# the pieces of every file in order, read `workers` batches ahead on a thread pool; a batch holds whole
+# chunks, several files' worth when they are small, so the pool is not paid for once per small file
+def prefetchChunks(files, chunkSize, workers):
+    from concurrent.futures import ThreadPoolExecutor
+    batches = []
+    batch = []
+    batchSize = 0
+    for path, file in files:
+        # the chunks grepChunks takes: full ones, then a shorter (maybe empty) last one
+        for offset in range(0, file.size + 1, chunkSize):
+            size = min(chunkSize, file.size - offset)
+            batch.append((file, offset, size))
+            batchSize += size
+            if (batchSize >= chunkSize):
+                batches.append(batch)
+                batch = []
+                batchSize = 0
+    if (len(batch) > 0):
+        batches.append(batch)
+
+    def read(batch):
+        return [readPiece(file, offset, size) for file, offset, size in batch]
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(read, batch))
+            if (len(pending) > workers):
+                yield from pending.popleft().result()
+        while (len(pending) > 0):
+            yield from pending.popleft().result()
+
+# search the content of `files`, (path, ExtentFile) pairs, for a byte string (or a regular expression with regex set)
+# files are read in the order of their first cluster so the volume is read close to sequentially; returns
+# (path, offset) of every match in that order
+# re holds the GIL while it matches, so matching stays on the calling thread and `workers` threads only read
+# ahead of it with os.preadv, which overlaps the device with the matching but does not spread the matching
+def grepFiles(files, pattern, regex = False, ignoreCase = False, workers = 4):
+    if (isinstance(pattern, str)):
+        pattern = pattern.encode('utf-8')
+    if (len(pattern) == 0):
+        raise ValueError('empty pattern')
+    flags = re.IGNORECASE if ignoreCase else 0
+    if (regex):
+        compiled = re.compile(pattern, flags)
+        overlap = GREP_OVERLAP
+    else:
+        compiled = re.compile(re.escape(pattern), flags)
+        overlap = len(pattern) - 1
+    files = sorted(files, key = lambda item: physicalStart(item[1]))
+    hits = []
+    if (workers == None or workers <= 1):
+        for path, file in files:
+            with file:
+                hits.extend((path, offset) for offset in grepFile(file, compiled, overlap))
+        return hits
+    chunks = prefetchChunks(files, GREP_CHUNK_SIZE, workers)
+    for path, file in files:
+        # exactly this file's chunks, see prefetchChunks
+        count = file.size // GREP_CHUNK_SIZE + 1
+        hits.extend((path, offset) for offset in grepChunks(islice(chunks, count), compiled, overlap, GREP_CHUNK_SIZE))
+        file.close()
+    return hits
@@ -0,0 +1,564 @@
+# build FAT32 and NTFS images in pure Python, for benchmarks and for trying the explorer without a real drive
+# python imagegen.py fat32|ntfs <output> [--files N] [--depth D] [--fanout F] [--fragment K] [--short-names]
+import argparse
+import datetime
+import random
+import struct
+
+DEFAULT_TIME = datetime.datetime(2023, 4, 1, 12, 30, 10)
+
+# a tree is a dict: name -> bytes for a file, name -> dict for a directory
+# `files` files are spread over a directory tree `depth` levels deep with `fanout` subdirectories each;
+# with longNames the names need long file name entries on FAT32, otherwise they are plain 8.3 names
+def generateTree(files = 100, depth = 2, fanout = 2, longNames = True, maxFileSize = 3000, bigFileSize = 0, seed = 0):
+    rng = random.Random(seed)
+    tree = {}
+    dirs = [tree]
+    level = [tree]
+    count = 0
+    for d in range(depth):
+        nextLevel = []
+        for parent in level:
+            for i in range(fanout):
+                sub = {}
+                count += 1
+                parent[('Folder %d with a long name' % count) if longNames else ('D%07d' % count)] = sub
+                nextLevel.append(sub)
+        dirs.extend(nextLevel)
+        level = nextLevel
+    # file contents are slices of one block of text so that building large trees stays fast
+    text = bytes(65 + i % 26 for i in range(maxFileSize + 26))
+    for i in range(files):
+        size = rng.randint(0, maxFileSize)
+        name = ('Document %d with a long name.txt' % i) if longNames else ('F%07d.TXT' % i)
+        dirs[i % len(dirs)][name] = text[i % 26:i % 26 + size]
+    if (bigFileSize > 0):
+        tree['big.bin' if longNames else 'BIG.BIN'] = rng.randbytes(bigFileSize)
+    tree['readme.txt' if longNames else 'README.TXT'] = b'Hello world\nsecond line\n'
+    return tree
+
+#---------------------------------------------------------------- FAT32
+
+def fatDate(when):
+    return ((when.year - 1980) << 9) | (when.month << 5) | when.day
+
+def fatTime(when):
+    return (when.hour << 11) | (when.minute << 5) | (when.second // 2)
+
+# 8.3 name for `name` not yet in `used`, and whether long name entries are needed
+def fatShortName(name, used):
+    base, dot, ext = name.rpartition('.')
+    if (not dot):
+        base, ext = name, ''
+    if (base != '' and name == name.upper() and len(base) <= 8 and len(ext) <= 3 and ' ' not in name and '.' not in base):
+        shortName = base.ljust(8) + ext.ljust(3)
+        if (shortName not in used):
+            used.add(shortName)
+            return shortName.encode('ascii'), False
+    clean = ''.join(c for c in base.upper() if c.isalnum())[:6] or 'FILE'
+    cleanExt = ''.join(c for c in ext.upper() if c.isalnum())[:3]
+    i = 1
+    while True:
+        if (i < 5):
+            shortName = (clean + '~' + str(i))[:8].ljust(8) + cleanExt.ljust(3)
+        else:
+            # Windows switches to a hashed form after a few collisions
+            shortName = ('%02X%04X~1' % (i >> 16 & 0xFF, i & 0xFFFF)) + cleanExt.ljust(3)
+        if (shortName not in used):
+            used.add(shortName)
+            return shortName.encode('ascii'), True
+        i += 1
+
+def lfnChecksum(shortName):
+    total = 0
+    for c in shortName:
+        total = (((total & 1) << 7) + (total >> 1) + c) & 0xFF
+    return total
+
+# long file name slots for `name`, last piece first as they are stored
+def lfnEntries(name, shortName):
+    units = name.encode('utf-16-le')
+    chars = [units[i:i + 2] for i in range(0, len(units), 2)]
+    chars.append(b'\x00\x00')
+    while (len(chars) % 13):
+        chars.append(b'\xff\xff')
+    count = len(chars) // 13
+    checksum = lfnChecksum(shortName)
+    entries = []
+    for seq in range(count, 0, -1):
+        part = chars[(seq - 1) * 13:seq * 13]
+        entry = bytearray(32)
+        entry[0] = seq | (0x40 if seq == count else 0)
+        entry[1:11] = b''.join(part[0:5])
+        entry[11] = 0x0F
+        entry[13] = checksum
+        entry[14:26] = b''.join(part[5:11])
+        entry[28:32] = b''.join(part[11:13])
+        entries.append(bytes(entry))
+    return entries
+
+def fatDirEntry(shortName, attr, cluster, size, when):
+    entry = bytearray(32)
+    entry[0:11] = shortName
+    entry[11] = attr
+    struct.pack_into('<HHHHHHHI', entry, 14, fatTime(when), fatDate(when), fatDate(when), cluster >> 16, fatTime(when), fatDate(when), cluster & 0xFFFF, size)
+    return bytes(entry)
+
+# write a FAT32 image of `tree` to `path` and return its size in bytes
+# fragment > 0 cuts every file and directory into up to that many pieces spread over the volume with free holes between
+def buildFat32(path, tree, sectorsPerCluster = 1, fragment = 0, extraClusters = 64, seed = 0, when = DEFAULT_TIME):
+    bps = 512
+    clusterSize = bps * sectorsPerCluster
+    rng = random.Random(seed)
+
+    # lay out directories and files, every item gets a list of clusters
+    items = []
+    def plan(node, isRoot):
+        slots = sum(1 + len(name) // 13 + 1 for name in node) + (0 if isRoot else 2) + 1
+        item = {'node': node, 'clusters': [], 'count': max(1, -(-slots * 32 // clusterSize)), 'children': {}}
+        items.append(item)
+        for name, value in node.items():
+            if (isinstance(value, dict)):
+                item['children'][name] = plan(value, False)
+            else:
+                child = {'data': value, 'clusters': [], 'count': -(-len(value) // clusterSize)}
+                items.append(child)
+                item['children'][name] = child
+        return item
+    rootPlan = plan(tree, True)
+
+    nextFree = 2
+    # the root directory always starts at cluster 2
+    for _ in range(rootPlan['count']):
+        rootPlan['clusters'].append(nextFree)
+        nextFree += 1
+    if (fragment):
+        pieces = []
+        for item in items[1:]:
+            count = item['count']
+            parts = min(count, fragment)
+            for p in range(parts):
+                pieces.append((item, count * (p + 1) // parts - count * p // parts, p))
+        # pieces of one item stay in order but are spread across the disk
+        for item, count, p in sorted(pieces, key = lambda piece: (piece[2], rng.random())):
+            for _ in range(count):
+                item['clusters'].append(nextFree)
+                nextFree += 1
+                if (rng.random() < 0.2):
+                    nextFree += 1
+    else:
+        for item in items[1:]:
+            for _ in range(item['count']):
+                item['clusters'].append(nextFree)
+                nextFree += 1
+    clusterCount = nextFree - 2 + extraClusters
+    fatEntries = clusterCount + 2
+    fatSize = -(-fatEntries * 4 // bps)
+    reserved = 32
+    fatCount = 2
+    dataStart = reserved + fatCount * fatSize
+    totalSectors = dataStart + clusterCount * sectorsPerCluster
+
+    fat = [0] * fatEntries
+    fat[0] = 0x0FFFFFF8
+    fat[1] = 0x0FFFFFFF
+    for item in items:
+        clusters = item['clusters']
+        for a, b in zip(clusters, clusters[1:]):
+            fat[a] = b
+        if (clusters):
+            fat[clusters[-1]] = 0x0FFFFFFF
+
+    img = bytearray(totalSectors * bps)
+    def writeChain(clusters, blob):
+        for i, cluster in enumerate(clusters):
+            chunk = blob[i * clusterSize:(i + 1) * clusterSize]
+            offset = (dataStart + (cluster - 2) * sectorsPerCluster) * bps
+            img[offset:offset + len(chunk)] = chunk
+
+    def emitDir(item, selfCluster, parentCluster, isRoot):
+        entries = []
+        used = set()
+        if (not isRoot):
+            entries.append(fatDirEntry(b'.          ', 0x10, selfCluster, 0, when))
+            entries.append(fatDirEntry(b'..         ', 0x10, parentCluster, 0, when))
+        for name, child in item['children'].items():
+            shortName, needLfn = fatShortName(name, used)
+            if (needLfn):
+                entries.extend(lfnEntries(name, shortName))
+            isDir = 'node' in child
+            first = child['clusters'][0] if child['clusters'] else 0
+            entries.append(fatDirEntry(shortName, 0x10 if isDir else 0x20, first, 0 if isDir else len(child['data']), when))
+        writeChain(item['clusters'], b''.join(entries))
+        for name, child in item['children'].items():
+            if ('node' in child):
+                emitDir(child, child['clusters'][0], 0 if isRoot else selfCluster, False)
+            else:
+                writeChain(child['clusters'], child['data'])
+    emitDir(rootPlan, rootPlan['clusters'][0], 0, True)
+
+    boot = bytearray(512)
+    boot[0:3] = b'\xEB\x58\x90'
+    boot[3:11] = b'MSWIN4.1'
+    struct.pack_into('<HBHBHHBHHHII', boot, 11, bps, sectorsPerCluster, reserved, fatCount, 0, 0, 0xF8, 0, 63, 255, 0, totalSectors)
+    struct.pack_into('<IHHIHH', boot, 36, fatSize, 0, 0, rootPlan['clusters'][0], 1, 6)
+    boot[64] = 0x80
+    boot[66] = 0x29
+    struct.pack_into('<I', boot, 67, 0x1234ABCD ^ seed)
+    boot[71:82] = b'NO NAME    '
+    boot[82:90] = b'FAT32   '
+    boot[510:512] = b'\x55\xAA'
+    img[0:512] = boot
+    img[6 * bps:7 * bps] = boot
+    fsInfo = bytearray(512)
+    struct.pack_into('<I', fsInfo, 0, 0x41615252)
+    struct.pack_into('<III', fsInfo, 484, 0x61417272, sum(1 for value in fat[2:] if value == 0), nextFree)
+    struct.pack_into('<I', fsInfo, 508, 0xAA550000)
+    img[bps:2 * bps] = fsInfo
+    fatBytes = struct.pack(f'<{fatEntries}I', *fat)
+    for k in range(fatCount):
+        offset = (reserved + k * fatSize) * bps
+        img[offset:offset + len(fatBytes)] = fatBytes
+    with open(path, 'wb') as f:
+        f.write(img)
+    return len(img)
+
+#---------------------------------------------------------------- NTFS
+
+def filetime(when):
+    return int((when - datetime.datetime(1970, 1, 1)).total_seconds() + 11_644_473_600) * 10_000_000
+
+def residentAttribute(attrType, content, name = ''):
+    encodedName = name.encode('utf-16-le')
+    nameOffset = 0x18
+    contentOffset = (nameOffset + len(encodedName) + 7) & ~7
+    length = (contentOffset + len(content) + 7) & ~7
+    attr = bytearray(length)
+    struct.pack_into('<IIBBHHH', attr, 0, attrType, length, 0, len(encodedName) // 2, nameOffset, 0, 0)
+    struct.pack_into('<IH', attr, 0x10, len(content), contentOffset)
+    attr[nameOffset:nameOffset + len(encodedName)] = encodedName
+    attr[contentOffset:contentOffset + len(content)] = content
+    return bytes(attr)
+
+# run list of (starting cluster or None for a sparse run, cluster count) pairs
+def encodeRuns(runs):
+    data = bytearray()
+    previous = 0
+    for lcn, length in runs:
+        lengthBytes = length.to_bytes((length.bit_length() + 8) // 8, 'little')
+        if (lcn == None):
+            data.append(len(lengthBytes))
+            data += lengthBytes
+            continue
+        delta = lcn - previous
+        size = 1
+        while not (-(1 << (8 * size - 1)) <= delta < (1 << (8 * size - 1))):
+            size += 1
+        data.append((size << 4) | len(lengthBytes))
+        data += lengthBytes + delta.to_bytes(size, 'little', signed = True)
+        previous = lcn
+    data.append(0)
+    return bytes(data)
+
+def nonResidentAttribute(attrType, runs, realSize, clusterSize, name = ''):
+    encodedName = name.encode('utf-16-le')
+    runList = encodeRuns(runs)
+    nameOffset = 0x40
+    runOffset = (nameOffset + len(encodedName) + 7) & ~7
+    length = (runOffset + len(runList) + 7) & ~7
+    clusters = sum(count for lcn, count in runs)
+    attr = bytearray(length)
+    struct.pack_into('<IIBBHHH', attr, 0, attrType, length, 1, len(encodedName) // 2, nameOffset, 0, 0)
+    struct.pack_into('<QQHH', attr, 0x10, 0, max(clusters - 1, 0), runOffset, 0)
+    struct.pack_into('<QQQ', attr, 0x28, clusters * clusterSize, realSize, realSize)
+    attr[nameOffset:nameOffset + len(encodedName)] = encodedName
+    attr[runOffset:runOffset + len(runList)] = runList
+    return bytes(attr)
+
+def standardInformation(when, flags = 0):
+    t = filetime(when)
+    return struct.pack('<QQQQI', t, t, t, t, flags) + bytes(0x30 - 36)
+
+def fileNameAttribute(parent, parentSeq, name, when, size = 0, isDir = False, namespace = 1):
+    t = filetime(when)
+    encodedName = name.encode('utf-16-le')
+    body = struct.pack('<QQQQQQQII', parent | (parentSeq << 48), t, t, t, t, size, size, 0x10000000 if isDir else 0x20, 0)
+    return body + bytes([len(encodedName) // 2, namespace]) + encodedName
+
+# an MFT record holding `attrs`, with the update sequence applied as on disk
+def mftRecord(index, attrs, flags, seq = 1, recordSize = 1024, sectorSize = 512):
+    record = bytearray(recordSize)
+    sectors = recordSize // sectorSize
+    usaOffset = 0x30
+    attrOffset = (usaOffset + 2 * (sectors + 1) + 7) & ~7
+    record[0:4] = b'FILE'
+    struct.pack_into('<HHQHHHHIIQHHI', record, 4, usaOffset, sectors + 1, 0, seq, 1, attrOffset, flags, 0, recordSize, 0, 0, 0, index)
+    offset = attrOffset
+    for attr in attrs:
+        record[offset:offset + len(attr)] = attr
+        offset += len(attr)
+    record[offset:offset + 4] = b'\xff\xff\xff\xff'
+    offset += 8
+    if (offset > recordSize):
+        raise ValueError('MFT record %d overflows' % index)
+    struct.pack_into('<I', record, 0x18, offset)
+    applyUpdateSequence(record, usaOffset, (index % 0xFFFE) + 1, sectorSize)
+    return bytes(record)
+
+# move the last two bytes of every sector into the update sequence array and stamp `usn` in their place
+def applyUpdateSequence(block, usaOffset, usn, sectorSize = 512):
+    struct.pack_into('<H', block, usaOffset, usn)
+    for s in range(len(block) // sectorSize):
+        end = (s + 1) * sectorSize - 2
+        block[usaOffset + 2 + 2 * s:usaOffset + 4 + 2 * s] = block[end:end + 2]
+        struct.pack_into('<H', block, end, usn)
+
+INDEX_BLOCK_SIZE = 4096
+# bytes of index entries kept in a directory's MFT record before the index moves to INDX blocks
+INDEX_ROOT_LIMIT = 384
+# where the entries start in an INDX block: after its header and update sequence array, 8-byte aligned
+INDEX_BLOCK_ENTRIES = 0x40
+
+# upper-case the name code unit by code unit, the order of the names in an $I30 index
+def collationKey(name):
+    return [ord(c.upper()) if len(c.upper()) == 1 else ord(c) for c in name]
+
+# one index entry: file reference, sizes, flags, the $FILE_NAME key and, for entries with a subnode, its VCN
+def indexEntry(reference, key, subnode = None):
+    flags = 0
+    length = 0x10 + ((len(key) + 7) & ~7)
+    if (subnode != None):
+        flags |= 0x01
+        length += 8
+    entry = bytearray(length)
+    struct.pack_into('<QHHH', entry, 0, reference, length, len(key), flags)
+    entry[0x10:0x10 + len(key)] = key
+    if (subnode != None):
+        struct.pack_into('<Q', entry, length - 8, subnode)
+    return bytes(entry)
+
+def lastIndexEntry(subnode = None):
+    entry = bytearray(0x18 if subnode != None else 0x10)
+    struct.pack_into('<QHHH', entry, 0, 0, len(entry), 0, 0x02 | (0x01 if subnode != None else 0))
+    if (subnode != None):
+        struct.pack_into('<Q', entry, 0x10, subnode)
+    return bytes(entry)
+
+# index node header and entries: where the entries start relative to the header (`headerSize`, the gap left
+# for the update sequence array of INDX blocks), their total and allocated size
+def indexNode(entries, headerSize, allocated):
+    body = b''.join(entries)
+    isLarge = any(entry[0x0C] & 0x01 for entry in entries)
+    header = struct.pack('<IIIB3x', headerSize, headerSize + len(body), max(allocated, headerSize + len(body)), 1 if isLarge else 0)
+    return header + bytes(headerSize - len(header)) + body
+
+# B-tree of a directory's (reference, $FILE_NAME key) pairs, in collation order
+# returns the $INDEX_ROOT content and the INDX blocks (empty when everything fits in the root);
+# blocks are numbered from 0 and addressed by VCN = number * vcnsPerBlock
+def buildIndex(items, vcnsPerBlock):
+    blocks = []
+    # (reference, key, subnode VCN) of the level being packed, and the subnode after its last entry
+    level = [(reference, key, None) for reference, key in items]
+    last = None
+    room = INDEX_BLOCK_SIZE - INDEX_BLOCK_ENTRIES
+    while (sum(len(indexEntry(*item)) for item in level) + len(lastIndexEntry(last)) > INDEX_ROOT_LIMIT):
+        # fill blocks in order, the entry that no longer fits moves up a level and points at the full block
+        upper = []
+        current = []
+        used = 0
+        for item in level:
+            size = len(indexEntry(*item))
+            if (len(current) > 0 and used + size + 0x18 > room):
+                blocks.append((current, item[2]))
+                upper.append((item[0], item[1], (len(blocks) - 1) * vcnsPerBlock))
+                current = []
+                used = 0
+                continue
+            current.append(item)
+            used += size
+        blocks.append((current, last))
+        last = (len(blocks) - 1) * vcnsPerBlock
+        level = upper
+    entries = [indexEntry(*item) for item in level] + [lastIndexEntry(last)]
+    root = struct.pack('<IIIB3x', 0x30, 1, INDEX_BLOCK_SIZE, vcnsPerBlock) + indexNode(entries, 0x10, 0)
+    indx = []
+    for number, (items, after) in enumerate(blocks):
+        block = bytearray(INDEX_BLOCK_SIZE)
+        block[0:4] = b'INDX'
+        struct.pack_into('<HHQQ', block, 4, 0x28, INDEX_BLOCK_SIZE // 512 + 1, 0, number * vcnsPerBlock)
+        node = indexNode([indexEntry(*item) for item in items] + [lastIndexEntry(after)], INDEX_BLOCK_ENTRIES - 0x18, INDEX_BLOCK_SIZE - 0x18)
+        block[0x18:0x18 + len(node)] = node
+        applyUpdateSequence(block, 0x28, number % 0xFFFE + 1)
+        indx.append(bytes(block))
+    return root, indx
+
+SYSTEM_FILES = ['$MFT', '$MFTMirr', '$LogFile', '$Volume', '$AttrDef', '.', '$Bitmap', '$Boot', '$BadClus', '$Secure', '$UpCase', '$Extend']
+FIRST_USER_RECORD = 24
+
+# write an NTFS image of `tree` to `path` and return its size in bytes
+# directories carry an $I30 index of their children; files up to residentLimit bytes are kept inside their
+# MFT record; fragment > 0 cuts the others into up to that many runs placed in shuffled order; with sparse,
+# an all-zero middle run is left unallocated; streams (name -> bytes) are added to every file as resident
+# named $DATA attributes after the unnamed one, as Windows adds a Zone.Identifier stream to downloads
+def buildNtfs(path, tree, sectorsPerCluster = 8, fragment = 0, residentLimit = 600, extraClusters = 64, seed = 0, when = DEFAULT_TIME, sparse = False, streams = None):
+    bps = 512
+    clusterSize = bps * sectorsPerCluster
+    recordSize = 1024
+    rng = random.Random(seed)
+
+    records = []
+    def walk(node, parent):
+        for name, value in node.items():
+            record = {'index': FIRST_USER_RECORD + len(records), 'name': name, 'parent': parent, 'isDir': isinstance(value, dict), 'data': None, 'runs': None}
+            records.append(record)
+            if (isinstance(value, dict)):
+                walk(value, record['index'])
+            else:
+                record['data'] = value
+    walk(tree, 5)
+    recordCount = FIRST_USER_RECORD + len(records)
+    mftClusters = -(-recordCount * recordSize // clusterSize)
+    mftStart = 4
+    nextFree = mftStart + mftClusters
+    for record in records:
+        data = record['data']
+        if (data == None or len(data) <= residentLimit):
+            continue
+        count = -(-len(data) // clusterSize)
+        runs = []
+        parts = min(count, fragment) if fragment else 1
+        for p in range(parts):
+            a = count * p // parts
+            b = count * (p + 1) // parts
+            if (sparse and p == 1 and parts > 2 and not any(data[a * clusterSize:b * clusterSize])):
+                runs.append((None, b - a))
+                continue
+            runs.append((nextFree, b - a))
+            nextFree += b - a
+        record['runs'] = runs
+    if (fragment):
+        # place the runs in random order with small gaps, so consecutive runs of a file are far apart
+        allRuns = [(record, i) for record in records if record['runs'] for i in range(len(record['runs'])) if record['runs'][i][0] != None]
+        rng.shuffle(allRuns)
+        position = mftStart + mftClusters + 1
+        for record, i in allRuns:
+            lcn, length = record['runs'][i]
+            record['runs'][i] = (position, length)
+            position += length + rng.randint(1, 3)
+        nextFree = position
+    # every directory gets an $I30 index of its children, spilling into INDX blocks placed after the data
+    children = {5: [(index, index or 1, name, 0, name in ('.', '$Extend')) for index, name in enumerate(SYSTEM_FILES)]}
+    for record in records:
+        children.setdefault(record['parent'], []).append((record['index'], 1, record['name'], len(record['data'] or b''), record['isDir']))
+        if (record['isDir']):
+            children.setdefault(record['index'], [])
+    vcnsPerBlock = max(1, INDEX_BLOCK_SIZE // clusterSize)
+    indexes = {}
+    for parent, items in children.items():
+        items = sorted(items, key = lambda item: collationKey(item[2]))
+        root, blocks = buildIndex([(index | (seq << 48), fileNameAttribute(parent, 5 if index < FIRST_USER_RECORD else 1, name, when, size, isDir)) for index, seq, name, size, isDir in items], vcnsPerBlock)
+        runs = []
+        if (len(blocks) > 0):
+            runs = [(nextFree, len(blocks) * vcnsPerBlock)]
+            nextFree += len(blocks) * vcnsPerBlock
+        indexes[parent] = (root, blocks, runs)
+    totalSectors = (nextFree + extraClusters) * sectorsPerCluster
+    img = bytearray(totalSectors * bps)
+
+    def indexAttributes(index):
+        root, blocks, runs = indexes[index]
+        attrs = [residentAttribute(0x90, root, '$I30')]
+        if (len(blocks) > 0):
+            attrs.append(nonResidentAttribute(0xA0, runs, len(blocks) * INDEX_BLOCK_SIZE, clusterSize, '$I30'))
+            bitmap = bytearray((len(blocks) + 63) // 64 * 8)
+            for number in range(len(blocks)):
+                bitmap[number // 8] |= 1 << (number % 8)
+            attrs.append(residentAttribute(0xB0, bytes(bitmap), '$I30'))
+            start = runs[0][0] * clusterSize
+            img[start:start + len(blocks) * INDEX_BLOCK_SIZE] = b''.join(blocks)
+        return attrs
+
+    def put(index, blob):
+        offset = mftStart * clusterSize + index * recordSize
+        img[offset:offset + recordSize] = blob
+
+    for index in range(FIRST_USER_RECORD):
+        if (index >= len(SYSTEM_FILES)):
+            put(index, mftRecord(index, [], 0))
+            continue
+        name = SYSTEM_FILES[index]
+        isDir = name in ('.', '$Extend')
+        attrs = [residentAttribute(0x10, standardInformation(when, 0 if name == '.' else 0x06)), residentAttribute(0x30, fileNameAttribute(5, 5, name, when, isDir = isDir))]
+        if (index == 0):
+            attrs.append(nonResidentAttribute(0x80, [(mftStart, mftClusters)], recordCount * recordSize, clusterSize))
+        if (index == 5):
+            attrs += indexAttributes(5)
+        put(index, mftRecord(index, attrs, 1 | (2 if isDir else 0), seq = index or 1))
+    for record in records:
+        data = record['data']
+        attrs = [residentAttribute(0x10, standardInformation(when)), residentAttribute(0x30, fileNameAttribute(record['parent'], 1, record['name'], when, len(data or b''), record['isDir']))]
+        if (record['isDir']):
+            attrs += indexAttributes(record['index'])
+        else:
+            if (record['runs'] == None):
+                attrs.append(residentAttribute(0x80, data))
+            else:
+                attrs.append(nonResidentAttribute(0x80, record['runs'], len(data), clusterSize))
+                vcn = 0
+                for lcn, length in record['runs']:
+                    if (lcn != None):
+                        chunk = data[vcn * clusterSize:(vcn + length) * clusterSize]
+                        img[lcn * clusterSize:lcn * clusterSize + len(chunk)] = chunk
+                    vcn += length
+            for name, content in sorted((streams or {}).items()):
+                attrs.append(residentAttribute(0x80, content, name))
+        put(record['index'], mftRecord(record['index'], attrs, 1 | (2 if record['isDir'] else 0)))
+
+    boot = bytearray(512)
+    boot[0:3] = b'\xEB\x52\x90'
+    boot[3:11] = b'NTFS    '
+    struct.pack_into('<HB', boot, 0x0B, bps, sectorsPerCluster)
+    boot[0x15] = 0xF8
+    struct.pack_into('<HH', boot, 0x18, 63, 255)
+    struct.pack_into('<QQQ', boot, 0x28, totalSectors - 1, mftStart, mftStart + mftClusters)
+    # 2^10 = 1024 bytes per MFT record
+    boot[0x40] = 0xF6
+    boot[0x44] = 0x01
+    struct.pack_into('<Q', boot, 0x48, 0xDEADBEEF00 + seed)
+    boot[510:512] = b'\x55\xAA'
+    img[0:512] = boot
+    with open(path, 'wb') as f:
+        f.write(img)
+    return len(img)
+
+# put a partition image behind an MBR, as on a full-disk image
+def wrapMbr(path, partitionPath, startSector = 2048, partType = 0x0C):
+    with open(partitionPath, 'rb') as f:
+        partition = f.read()
+    mbr = bytearray(512)
+    struct.pack_into('<BBBBBBBBII', mbr, 446, 0, 0, 0, 0, partType, 0, 0, 0, startSector, len(partition) // 512)
+    mbr[510:512] = b'\x55\xAA'
+    with open(path, 'wb') as f:
+        f.write(mbr)
+        f.write(bytes(startSector * 512 - 512))
+        f.write(partition)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Build a FAT32 or NTFS image from a generated directory tree.')
+    parser.add_argument('fileSystem', choices = ['fat32', 'ntfs'])
+    parser.add_argument('output')
+    parser.add_argument('--files', type = int, default = 1000)
+    parser.add_argument('--depth', type = int, default = 2)
+    parser.add_argument('--fanout', type = int, default = 3)
+    parser.add_argument('--fragment', type = int, default = 0, help = 'cut files into up to this many pieces')
+    parser.add_argument('--short-names', action = 'store_true', help = 'use 8.3 names only')
+    parser.add_argument('--max-file-size', type = int, default = 3000)
+    parser.add_argument('--big-file', type = int, default = 0, help = 'size of an extra big.bin file')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+    tree = generateTree(args.files, args.depth, args.fanout, not args.short_names, args.max_file_size, args.big_file, args.seed)
+    if (args.fileSystem == 'fat32'):
+        size = buildFat32(args.output, tree, fragment = args.fragment, seed = args.seed)
+    else:
+        size = buildNtfs(args.output, tree, fragment = args.fragment, seed = args.seed)
+    print(args.output, size, 'bytes')
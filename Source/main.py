@@ -1,9 +1,10 @@
-from NTFS import NTFS
-from FAT32 import FAT32
+import datetime
 import os
-import psutil
+import re
+import sys
 
 def check_filesystem_type(drive_letter):
+    import psutil
     partitions = psutil.disk_partitions(all=True)
     for partition in partitions:
         if partition.device.startswith(drive_letter):
@@ -37,15 +38,20 @@ def helpQuery(query, disk, diskType):
         print('6. List all files and folders in current working directory')
         print('7. Print the tree of working directory')
         print('8. Exit program')
+        print('9. Search files and folders on the volume')
+        print('10. Search the content of files on the volume')
+        print('11. Show I/O and timing statistics')
+        print('12. Extract a file or folder to this computer')
+        print('13. Analyse free space and fragmentation (FAT32)')
         print('Type the number that corresponds to the command!')
     elif (query == 2):
-        print('Input directory: ', end = '')
+        print('Input directory (/Folder/... or the volume name followed by the path): ', end = '')
         dir = input()
         disk.printFileFromDir(dir)
     elif (query == 3):
         disk.readFile()
     elif (query == 4):
-        print('Input directory: ', end = '')
+        print('Input directory (/Folder/... or the volume name followed by the path): ', end = '')
         dir = input()
         disk.gotoDir(dir)
     elif (query == 5):
@@ -56,28 +62,192 @@ def helpQuery(query, disk, diskType):
         disk.drawTree()
     elif (query == 8):
         return False
+    elif (query == 9):
+        searchQuery(disk)
+    elif (query == 10):
+        grepQuery(disk)
+    elif (query == 11):
+        printStats(disk.getStats())
+    elif (query == 12):
+        extractQuery(disk)
+    elif (query == 13):
+        if (not isF32):
+            print('Only available on FAT32 volumes!')
+        else:
+            printAnalysis(disk.analyze())
         
 
+# read an optional value, empty input gives None
+def askOptional(prompt, convert):
+    print(prompt, end = '')
+    value = input().strip()
+    if (value == ''):
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        print('Invalid value, ignored!')
+        return None
+
+def searchQuery(disk):
+    print('Name pattern (glob such as *.txt, re:<expression> for a regular expression, empty for any): ', end = '')
+    pattern = input().strip()
+    regex = pattern.startswith('re:')
+    if (regex):
+        pattern = pattern[3:]
+    minSize = askOptional('Minimum size in bytes (empty for none): ', int)
+    maxSize = askOptional('Maximum size in bytes (empty for none): ', int)
+    after = askOptional('Modified on or after YYYY-MM-DD (empty for none): ', datetime.date.fromisoformat)
+    before = askOptional('Modified before YYYY-MM-DD (empty for none): ', datetime.date.fromisoformat)
+    try:
+        results = disk.search(pattern, regex, minSize, maxSize, after, before)
+    except re.error:
+        print('Invalid regular expression!')
+        return
+    print(f'{"Modified":<20} | {"Size(B)":<12} | {"Path"}')
+    print('-' * 70)
+    for path, size, modified, node in results:
+        print(f'{str(modified):<20} | {str(size):<12} | {path}')
+    print(len(results), 'match(es)')
+
+def grepQuery(disk):
+    print('Text to find (re:<expression> for a regular expression): ', end = '')
+    pattern = input()
+    regex = pattern.startswith('re:')
+    if (regex):
+        pattern = pattern[3:]
+    if (pattern == ''):
+        print('Empty pattern!')
+        return
+    try:
+        results = disk.grep(pattern, regex)
+    except re.error:
+        print('Invalid regular expression!')
+        return
+    print(f'{"Offset":<12} | {"Path"}')
+    print('-' * 70)
+    for path, offset in results:
+        print(f'{str(offset):<12} | {path}')
+    print(len(results), 'match(es)')
+
+def extractQuery(disk):
+    print('File or folder to extract (/ for the whole volume): ', end = '')
+    path = input().strip()
+    print('Destination folder: ', end = '')
+    dest = input().strip()
+    if (dest == ''):
+        print('Empty destination!')
+        return
+    try:
+        report = disk.extract(path, dest)
+    except FileNotFoundError:
+        print('Invalid directory!')
+        return
+    except (OSError, ValueError) as error:
+        print('Extraction failed:', error)
+        return
+    print('Files: ', report['files'])
+    print('Folders: ', report['directories'])
+    print('Bytes: ', report['bytes'])
+    print(f'Time: {report["seconds"]:.3f} s ({report["mbPerSecond"]:.1f} MB/s)')
+    if (len(report['skipped']) > 0):
+        print('Skipped (names not valid here): ', ', '.join(report['skipped']))
+
+def printAnalysis(report):
+    print('Cluster size: ', report['clusterSize'])
+    print('Clusters: ', report['clusters'])
+    print('Free clusters: ', report['freeClusters'], f'({report["freeBytes"]} bytes)')
+    print('Bad clusters: ', report['badClusters'])
+    run = report['largestFreeRun']
+    print('Largest free run: ', run['clusters'], 'clusters from cluster', run['cluster'])
+    fsInfo = report['fsInfo']
+    if (not fsInfo['valid']):
+        print('FSInfo: invalid signature')
+    elif (fsInfo['freeClusters'] == None):
+        print('FSInfo: free count not set')
+    else:
+        print('FSInfo free count: ', fsInfo['freeClusters'], '(matches the FAT)' if fsInfo['matches'] else '(does NOT match the FAT)')
+    print('Files: ', report['files'])
+    print('Fragmented files: ', report['fragmentedFiles'])
+    print(f'Extents per file: {report["extentsPerFile"]:.2f}')
+    print(f'{"Extents":<12} | {"Files"}')
+    print('-' * 30)
+    for bucket, count in report['extentHistogram'].items():
+        print(f'{bucket:<12} | {count}')
+    for item in report['mostFragmented']:
+        print(f'{str(item["extents"]):<12} | {item["path"]}')
+
+def printStats(stats):
+    io = stats['io']
+    print('File system: ', stats['fileSystem'])
+    print('Read calls: ', io['reads'])
+    print('Bytes read: ', io['bytesRead'])
+    print('Seeks: ', io['seeks'])
+    print('Cache hits: ', io['cacheHits'])
+    print('Cache misses: ', io['cacheMisses'])
+    for name, seconds in stats['phases'].items():
+        print(f'{name + ":":<16} {seconds * 1000:.3f} ms')
+    if (stats['profile'] != None):
+        print(stats['profile'])
+
+# pick the volume inside an image file or block device, asking for a partition on full-disk images
+def chooseImageVolume(path, offset):
+    if (offset == 0):
+        partitions = partitionOffsets(path)
+        if (len(partitions) > 0):
+            print("Partitions:")
+            for i in range(len(partitions)):
+                print(f"{i + 1}/", 'offset', partitions[i][0], 'size', partitions[i][1])
+            print("Choose partition: ", end = "")
+            part = int(input())
+            if (part <= 0 or part > len(partitions)):
+                print("Invalid partition!")
+                exit()
+            offset = partitions[part - 1][0]
+    volume = Volume(path, offset)
+    fileSystem = detectFileSystem(volume.read(0, 512))
+    volume.close()
+    return offset, fileSystem
+
 if __name__ == "__main__":
-    volume = [chr(x) for x in range(65, 91) if os.path.exists(chr(x) + ":")]
-    print("Available volumes:")
-    for i in range(len(volume)):
-        print(f"{i + 1}/", volume[i] + ':')
-    print("Choose volume: ", end = "")
-    vol = int(input())
-    if (vol <= 0 or vol > len(volume)):
-        print("Invalid volume!")
-        exit()
-    vol = vol - 1
-    driveLetter = volume[vol]
-    print('driveLetter: ', driveLetter)
-    fileSystem = check_filesystem_type(driveLetter)
+    # python main.py <ls|cat|tree|stat|info|extract|analyze> --image ... runs one command and exits (see cli.py)
+    if (len(sys.argv) > 1 and sys.argv[1] in ('info', 'ls', 'cat', 'tree', 'stat', 'extract', 'analyze')):
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
+    from NTFS import NTFS
+    from FAT32 import FAT32
+    from volume import Volume, detectFileSystem, partitionOffsets
+    from snapshot import defaultSnapshotDir
+    offset = 0
+    if (len(sys.argv) > 1):
+        # python main.py <image file or /dev node> [partition offset in bytes]
+        driveLetter = sys.argv[1]
+        if (len(sys.argv) > 2):
+            offset = int(sys.argv[2], 0)
+        offset, fileSystem = chooseImageVolume(driveLetter, offset)
+    else:
+        volume = [chr(x) for x in range(65, 91) if os.path.exists(chr(x) + ":")]
+        print("Available volumes:")
+        for i in range(len(volume)):
+            print(f"{i + 1}/", volume[i] + ':')
+        print("Choose volume: ", end = "")
+        vol = int(input())
+        if (vol <= 0 or vol > len(volume)):
+            print("Invalid volume!")
+            exit()
+        vol = vol - 1
+        driveLetter = volume[vol]
+        print('driveLetter: ', driveLetter)
+        fileSystem = check_filesystem_type(driveLetter)
     disk = None
+    if (fileSystem == None):
+        print("Unsupported file system!")
+        exit()
     if (fileSystem.strip() == 'FAT32'):
-        disk = FAT32(driveLetter)
+        disk = FAT32(driveLetter, offset, snapshotDir = defaultSnapshotDir())
         print(driveLetter, 'uses FAT32 file system.')
     elif (fileSystem.strip() == 'NTFS'):
-        disk = NTFS(driveLetter)
+        disk = NTFS(driveLetter, offset, snapshotDir = defaultSnapshotDir())
         print(driveLetter, 'uses NTFS file system.')
     else:
         print("Unsupported file system!")
@@ -90,11 +260,14 @@ if __name__ == "__main__":
             print('Invalid command!')
             helpQuery(1, disk, fileSystem)
             continue
-        elif (query <= 0 or query > 8):
+        elif (query <= 0 or query > 13):
             print('Invalid command!')
             helpQuery(1, disk, fileSystem)
             continue
         val = helpQuery(query, disk, fileSystem)
         if (val == False):
+            # keep the directories read in this session for the next launch (NTFS saves right after its scan)
+            if (isinstance(disk, FAT32)):
+                disk.saveSnapshot()
             print('Program exitted! Thanks for using!')
             break
\ No newline at end of file
@@ -0,0 +1,121 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import datetime
+import fnmatch
+import re
+from volume import normName
+
+EPOCH = datetime.datetime(1970, 1, 1)
+GLOB_CHARS = '*?[]'
+
+# seconds since 1970 of a date or datetime (naive, as both file systems hand them out)
+def timeValue(value):
+    if (not isinstance(value, datetime.datetime)):
+        value = datetime.datetime(value.year, value.month, value.day)
+    return (value - EPOCH).total_seconds()
+
+# literal start and end of a glob pattern, used to narrow the candidates before matching
+def globLiterals(pattern):
+    prefix = pattern
+    suffix = pattern
+    for i, c in enumerate(pattern):
+        if (c in GLOB_CHARS):
+            prefix = pattern[:i]
+            break
+    for i in range(len(pattern) - 1, -1, -1):
+        if (pattern[i] in GLOB_CHARS):
+            suffix = pattern[i + 1:]
+            break
+    return prefix, suffix
+
+# index of every entry of a volume, built once from a tree walk:
+# columns of path, normalised name, size, modified time (as seconds for range tests) and kind, plus the entry numbers sorted by
+# name, by reversed name (for suffixes such as *.txt), by size and by time, so that a query starts
+# from the narrowest range it can cut with a binary search and only checks the entries in it
+class SearchIndex:
+    # records are (path, name, size, modified time, isFolder, node) in the order results are reported
+    def __init__(self, records):
+        columns = list(zip(*records)) or [()] * 6
+        self.paths = list(columns[0])
+        self.names = list(map(normName, columns[1]))
+        self.sizes = array('q', columns[2])
+        self.modified = list(columns[3])
+        self.times = array('d', map(timeValue, self.modified))
+        self.folders = bytearray(1 if isFolder else 0 for isFolder in columns[4])
+        self.nodes = list(columns[5])
+        count = len(self.paths)
+        self.nameOrder = array('q', sorted(range(count), key = self.names.__getitem__))
+        self.sortedNames = [self.names[i] for i in self.nameOrder]
+        reversedNames = [name[::-1] for name in self.names]
+        self.suffixOrder = array('q', sorted(range(count), key = reversedNames.__getitem__))
+        self.sortedSuffixes = [reversedNames[i] for i in self.suffixOrder]
+        self.sizeOrder = array('q', sorted(range(count), key = self.sizes.__getitem__))
+        self.sortedSizes = array('q', sorted(self.sizes))
+        self.timeOrder = array('q', sorted(range(count), key = self.times.__getitem__))
+        self.sortedTimes = array('d', sorted(self.times))
+
+    def __len__(self):
+        return len(self.paths)
+
+    # entries matching every given filter, as (path, size, modified time, node) in index order
+    # pattern is a glob (or a regular expression with regex set) matched against the whole name, ignoring case;
+    # sizes are inclusive bounds in bytes, modified times are within [after, before); kind is 'file' or 'dir'
+    def query(self, pattern = None, regex = False, minSize = None, maxSize = None, after = None, before = None, kind = None):
+        ranges = []
+        matcher = None
+        if (pattern != None and pattern != ''):
+            if (regex):
+                matcher = re.compile(pattern, re.IGNORECASE).fullmatch
+            else:
+                pattern = normName(pattern)
+                matcher = re.compile(fnmatch.translate(pattern)).match
+                prefix, suffix = globLiterals(pattern)
+                if (prefix != ''):
+                    lo = bisect_left(self.sortedNames, prefix)
+                    hi = bisect_right(self.sortedNames, prefix + '\U0010ffff', lo)
+                    ranges.append((self.nameOrder, lo, hi))
+                if (suffix != ''):
+                    suffix = suffix[::-1]
+                    lo = bisect_left(self.sortedSuffixes, suffix)
+                    hi = bisect_right(self.sortedSuffixes, suffix + '\U0010ffff', lo)
+                    ranges.append((self.suffixOrder, lo, hi))
+        if (minSize != None or maxSize != None):
+            lo = 0 if minSize == None else bisect_left(self.sortedSizes, minSize)
+            hi = len(self) if maxSize == None else bisect_right(self.sortedSizes, maxSize)
+            ranges.append((self.sizeOrder, lo, hi))
+        afterValue = None if after == None else timeValue(after)
+        beforeValue = None if before == None else timeValue(before)
+        if (afterValue != None or beforeValue != None):
+            lo = 0 if afterValue == None else bisect_left(self.sortedTimes, afterValue)
+            hi = len(self) if beforeValue == None else bisect_left(self.sortedTimes, beforeValue)
+            ranges.append((self.timeOrder, lo, hi))
+
+        if (len(ranges) > 0):
+            order, lo, hi = min(ranges, key = lambda r: r[2] - r[1])
+            candidates = sorted(order[lo:hi]) if hi > lo else []
+        else:
+            candidates = range(len(self))
+        wantFolder = None
+        if (kind == 'file'):
+            wantFolder = 0
+        elif (kind == 'dir'):
+            wantFolder = 1
+
+        # the name test runs first over the whole range in one pass, the column tests only on what is left
+        if (matcher != None):
+            names = self.names
+            candidates = [i for i in candidates if matcher(names[i]) != None]
+        results = []
+        for i in candidates:
+            if (wantFolder != None and self.folders[i] != wantFolder):
+                continue
+            if (minSize != None and self.sizes[i] < minSize):
+                continue
+            if (maxSize != None and self.sizes[i] > maxSize):
+                continue
+            if (afterValue != None and self.times[i] < afterValue):
+                continue
+            if (beforeValue != None and self.times[i] >= beforeValue):
+                continue
+            results.append((self.paths[i], self.sizes[i], self.modified[i], self.nodes[i]))
+        return results
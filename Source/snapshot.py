@@ -0,0 +1,75 @@
+import hashlib
+import os
+import pickle
+import sys
+
+# bump when the layout of the pickled trees, or what the parsers put in them, changes
+SNAPSHOT_VERSION = 6
+
+# where snapshots are kept, CENT_EXPLORER_CACHE overrides it and an empty value turns them off
+def defaultSnapshotDir():
+    directory = os.environ.get('CENT_EXPLORER_CACHE')
+    if (directory != None):
+        return directory or None
+    return os.path.join(os.path.expanduser('~'), '.cache', '11cent-explorer')
+
+# file name identifying a volume, built from its type, the boot sector (which holds the serial number)
+# and the label the tree was built under, since node paths include it
+def snapshotKey(fileSystem, bootSector, label):
+    return fileSystem + '-' + hashlib.sha1(bytes(bootSector) + label.encode('utf-8', errors = 'replace')).hexdigest()
+
+def snapshotPath(directory, key):
+    return os.path.join(directory, key + '.snap')
+
+# header of a snapshot (version, signature and whatever the file system needs to recompute it),
+# None when there is no usable snapshot
+def loadSnapshotHeader(directory, key):
+    try:
+        with open(snapshotPath(directory, key), 'rb') as f:
+            header = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError):
+        return None
+    if (not isinstance(header, dict) or header.get('version') != SNAPSHOT_VERSION):
+        return None
+    return header
+
+# the tree stored after the header, None if the volume changed or the file cannot be read
+def loadSnapshot(directory, key, signature):
+    limit = sys.getrecursionlimit()
+    try:
+        sys.setrecursionlimit(max(limit, 10000))
+        with open(snapshotPath(directory, key), 'rb') as f:
+            header = pickle.load(f)
+            if (header.get('version') != SNAPSHOT_VERSION or header.get('signature') != signature):
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError, RecursionError):
+        return None
+    finally:
+        sys.setrecursionlimit(limit)
+
+# write header and tree to a temporary file and move it in place so readers never see half a snapshot
+def saveSnapshot(directory, key, signature, payload, extra = None):
+    header = {'version': SNAPSHOT_VERSION, 'signature': signature}
+    if (extra != None):
+        header.update(extra)
+    path = snapshotPath(directory, key)
+    tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+    limit = sys.getrecursionlimit()
+    try:
+        os.makedirs(directory, exist_ok = True)
+        # deep trees pickle recursively through Node.children
+        sys.setrecursionlimit(max(limit, 10000))
+        with open(tmpPath, 'wb') as f:
+            pickle.dump(header, f, protocol = pickle.HIGHEST_PROTOCOL)
+            pickle.dump(payload, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, path)
+        return True
+    except (OSError, pickle.PicklingError, RecursionError):
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        return False
+    finally:
+        sys.setrecursionlimit(limit)
@@ -0,0 +1,95 @@
+import io
+import os
+import threading
+import time
+
+# set to a non-empty value to run every timed phase under cProfile
+def profilingEnabled():
+    return os.environ.get('CENT_EXPLORER_PROFILE', '') != ''
+
+# requests made to a volume: read calls, bytes returned, and seeks, counted as requests that do not start
+# where the previous one ended; caches above the volume count their hits and misses here too
+# counts are updated without a lock, so with several reader threads they are close but not exact
+class IOStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.bytesRead = 0
+        self.seeks = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.lastEnd = None
+
+    def record(self, start, size):
+        self.reads += 1
+        self.bytesRead += size
+        if (start != self.lastEnd):
+            self.seeks += 1
+        self.lastEnd = start + size
+
+    def asDict(self):
+        return {'reads': self.reads, 'bytesRead': self.bytesRead, 'seeks': self.seeks, 'cacheHits': self.cacheHits, 'cacheMisses': self.cacheMisses}
+
+# wall-clock time spent in named phases (boot parse, FAT load, MFT scan, ...), added up over every run
+# a phase entered again while it is running (a recursive tree walk) is only timed by the outer call
+class PhaseTimer:
+    def __init__(self, profile = None):
+        self.times = {}
+        self.active = set()
+        self.lock = threading.Lock()
+        self.profiler = None
+        if (profilingEnabled() if profile == None else profile):
+            # imported here, profiling is rare and the modules are slow to load
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def phase(self, name):
+        return TimedPhase(self, name)
+
+    def reset(self):
+        self.times = {}
+        if (self.profiler != None):
+            self.profiler = type(self.profiler)()
+
+    # the functions that took the most time inside the timed phases, None when profiling is off
+    def profileReport(self, limit = 20):
+        if (self.profiler == None):
+            return None
+        import pstats
+        text = io.StringIO()
+        try:
+            pstats.Stats(self.profiler, stream = text).sort_stats('cumulative').print_stats(limit)
+        except TypeError:
+            # nothing was profiled yet
+            return ''
+        return text.getvalue()
+
+class TimedPhase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.outer = False
+
+    def __enter__(self):
+        with self.timer.lock:
+            self.outer = self.name not in self.timer.active
+            if (self.outer):
+                self.timer.active.add(self.name)
+        if (self.outer):
+            self.profiling = self.timer.profiler != None and len(self.timer.active) == 1
+            if (self.profiling):
+                self.timer.profiler.enable()
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if (not self.outer):
+            return
+        elapsed = time.perf_counter() - self.start
+        if (self.profiling):
+            self.timer.profiler.disable()
+        with self.timer.lock:
+            self.timer.active.discard(self.name)
+            self.timer.times[self.name] = self.timer.times.get(self.name, 0.0) + elapsed
@@ -0,0 +1,381 @@
+from bisect import bisect_right
+from collections import OrderedDict
+import mmap
+import os
+import threading
+from stats import IOStats
+
+# default piece size when a file is streamed or iterated
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# map a drive letter to its raw Windows device, pass image files and /dev nodes through
+def devicePath(name):
+    if (len(name) == 1 and name.isalpha()):
+        return f'\\\\.\\{name}:'
+    if (len(name) == 2 and name[0].isalpha() and name[1] == ':'):
+        return f'\\\\.\\{name}'
+    return name
+
+# label printed for the volume (X: for drives, the path itself for images/devices)
+def volumeLabel(name):
+    if (len(name) == 1 and name.isalpha()):
+        return name + ':'
+    return name
+
+# a path typed in the menu as components after the volume: paths are either /-rooted ('/Folder/a.txt')
+# or start with the volume name as the menu shows it ('C:\\Folder', '/tmp/f.img/Folder'), whose components
+# are dropped; the first component of the result stands for the volume and is ignored by the lookups
+def menuPath(path, label):
+    path = path.replace('\\', '/')
+    label = label.replace('\\', '/').rstrip('/')
+    if (label != '' and (path == label or path.startswith(label + '/'))):
+        path = path[len(label):]
+    return path.split('/')
+
+# form of a file name used for lookups: NULs and surrounding blanks removed, case folded
+def normName(name):
+    return ''.join(name.split('\x00')).strip().casefold()
+
+# guess the file system from the boot sector
+def detectFileSystem(bootSector):
+    if (bytes(bootSector[3:11]) == b'NTFS    '):
+        return 'NTFS'
+    if (bytes(bootSector[82:90]) == b'FAT32   '):
+        return 'FAT32'
+    return None
+
+# list (byte offset, byte size, type) of the partitions of a full-disk image (MBR or GPT)
+def partitionOffsets(path, bytes_per_sector = 512):
+    with open(path, 'rb') as f:
+        mbr = f.read(bytes_per_sector)
+        if (len(mbr) < 512 or mbr[510:512] != b'\x55\xAA'):
+            return []
+        if (detectFileSystem(mbr) != None):
+            return []
+        partitions = []
+        for i in range(4):
+            entry = mbr[446 + i * 16:446 + (i + 1) * 16]
+            partType = entry[4]
+            start = int.from_bytes(entry[8:12], byteorder='little')
+            count = int.from_bytes(entry[12:16], byteorder='little')
+            if (partType == 0 or count == 0):
+                continue
+            if (partType == 0xEE):
+                return gptPartitions(f, bytes_per_sector)
+            partitions.append((start * bytes_per_sector, count * bytes_per_sector, partType))
+        return partitions
+
+def gptPartitions(f, bytes_per_sector):
+    f.seek(bytes_per_sector)
+    header = f.read(bytes_per_sector)
+    if (header[0:8] != b'EFI PART'):
+        return []
+    entryLba = int.from_bytes(header[72:80], byteorder='little')
+    entryCount = int.from_bytes(header[80:84], byteorder='little')
+    entrySize = int.from_bytes(header[84:88], byteorder='little')
+    f.seek(entryLba * bytes_per_sector)
+    table = f.read(entryCount * entrySize)
+    partitions = []
+    for i in range(0, len(table), entrySize):
+        entry = table[i:i + entrySize]
+        if (entry[0:16] == bytes(16)):
+            continue
+        first = int.from_bytes(entry[32:40], byteorder='little')
+        last = int.from_bytes(entry[40:48], byteorder='little')
+        partitions.append((first * bytes_per_sector, (last - first + 1) * bytes_per_sector, entry[0:16].hex()))
+    return partitions
+
+# reads that do not go through a memory map are served from a BlockCache of this many bytes
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+CACHE_BLOCK_SIZE = 64 * 1024
+# largest readahead, in bytes, reached after a run of sequential misses
+READAHEAD_MAX = 2 * 1024 * 1024
+
+# aligned blocks of a volume kept in memory, the least recently used dropped once `budget` bytes are held
+# `fetch(start, size)` reads from the device; a miss right after the previous miss reads ahead, doubling
+# the window on every such miss up to READAHEAD_MAX and going back to one block when the pattern jumps,
+# so a run of small sequential reads turns into a few large ones
+class BlockCache:
+    def __init__(self, fetch, budget, blockSize = CACHE_BLOCK_SIZE, stats = None):
+        self.fetch = fetch
+        self.budget = budget
+        self.blockSize = blockSize
+        self.stats = stats
+        self.blocks = OrderedDict()
+        self.used = 0
+        self.lock = threading.Lock()
+        self.nextMiss = None
+        self.window = 1
+
+    def lookup(self, block):
+        with self.lock:
+            data = self.blocks.get(block)
+            if (data != None):
+                self.blocks.move_to_end(block)
+            return data
+
+    def insert(self, block, data):
+        with self.lock:
+            old = self.blocks.pop(block, None)
+            if (old != None):
+                self.used -= len(old)
+            self.blocks[block] = data
+            self.used += len(data)
+            while (self.used > self.budget and len(self.blocks) > 1):
+                oldBlock, oldData = self.blocks.popitem(last = False)
+                self.used -= len(oldData)
+
+    # blocks from `block` on, at least up to `last` and further while reading ahead, in one device read
+    def load(self, block, last):
+        count = 1
+        while (block + count <= last and self.lookup(block + count) == None):
+            count += 1
+        with self.lock:
+            if (block == self.nextMiss):
+                # never read ahead more than half the cache, or the blocks would evict each other
+                self.window = min(self.window * 2, max(1, min(READAHEAD_MAX, self.budget // 2) // self.blockSize))
+            else:
+                self.window = 1
+        ahead = 0
+        if (self.window > count and block + count > last):
+            while (count + ahead < self.window and self.lookup(block + count + ahead) == None):
+                ahead += 1
+        count += ahead
+        data = self.fetch(block * self.blockSize, count * self.blockSize)
+        with self.lock:
+            self.nextMiss = block + count
+        for i in range(count):
+            piece = data[i * self.blockSize:(i + 1) * self.blockSize]
+            if (len(piece) == 0):
+                break
+            self.insert(block + i, piece)
+        return data
+
+    # `size` bytes at byte offset `start`, shorter at the end of the device
+    def read(self, start, size):
+        if (size <= 0):
+            return b''
+        first = start // self.blockSize
+        last = (start + size - 1) // self.blockSize
+        pieces = []
+        block = first
+        while (block <= last):
+            data = self.lookup(block)
+            if (data != None):
+                if (self.stats != None):
+                    self.stats.cacheHits += 1
+                pieces.append(data)
+                block += 1
+                continue
+            if (self.stats != None):
+                self.stats.cacheMisses += 1
+            data = self.load(block, last)
+            count = min(last - block + 1, -(-len(data) // self.blockSize))
+            pieces.append(data[:count * self.blockSize])
+            block += count
+            if (len(data) < count * self.blockSize or count == 0):
+                # end of the device
+                break
+        data = b''.join(pieces)
+        inner = start - first * self.blockSize
+        return data[inner:inner + size]
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.used = 0
+
+# read-only view of a volume: an image file, a block device or a raw Windows drive,
+# optionally starting at a byte offset inside a full-disk image
+# the volume is memory mapped when possible (the OS page cache then does the caching and readahead);
+# otherwise, or with mapped=False, reads go through a BlockCache of cacheSize bytes (0 turns it off)
+class Volume:
+    def __init__(self, path, offset = 0, size = None, cacheSize = DEFAULT_CACHE_SIZE, mapped = True):
+        self.path = path
+        self.offset = offset
+        self.file = open(path, 'rb')
+        self.lock = threading.Lock()
+        self.stats = IOStats()
+        self.map = None
+        self.view = None
+        self.cache = None
+        try:
+            end = os.lseek(self.file.fileno(), 0, os.SEEK_END)
+        except OSError:
+            end = 0
+        self.file.seek(0)
+        if (mapped and end > offset):
+            try:
+                # block devices report st_size 0, so map the length found by seeking to the end
+                self.map = mmap.mmap(self.file.fileno(), end, access = mmap.ACCESS_READ)
+                self.view = memoryview(self.map)
+            except (OSError, ValueError, OverflowError):
+                self.map = None
+        if (size == None and end > offset):
+            size = end - offset
+        self.size = size
+        if (self.view == None and cacheSize > 0):
+            # cache blocks are aligned, which raw Windows drives also require of every read
+            self.cache = BlockCache(self.fetch, cacheSize, stats = self.stats)
+
+    # read straight from the device, `start` relative to the volume
+    def fetch(self, start, size):
+        if (self.size != None):
+            size = max(0, min(size, self.size - start))
+        self.stats.record(start, size)
+        if (hasattr(os, 'pread')):
+            return os.pread(self.file.fileno(), size, self.offset + start)
+        with self.lock:
+            self.file.seek(self.offset + start)
+            return self.file.read(size)
+
+    # return `size` bytes at byte offset `start` of the volume
+    # mapped volumes hand out memoryview slices, the others read through the block cache or the device
+    def read(self, start, size):
+        if (self.size != None):
+            if (start >= self.size):
+                return memoryview(b'')
+            size = min(size, self.size - start)
+        if (self.view != None):
+            self.stats.record(start, size)
+            start += self.offset
+            return self.view[start:start + size]
+        if (self.cache != None):
+            return memoryview(self.cache.read(start, size))
+        return memoryview(self.fetch(start, size))
+
+    # fill `buffer` with the bytes at byte offset `start`, return the number of bytes copied
+    # direct reads skip the map and the cache and go through os.preadv, which releases the GIL while
+    # the device works, so reads issued from several threads are really in flight together
+    def readinto(self, start, buffer, direct = False):
+        size = len(buffer)
+        if (self.size != None):
+            if (start >= self.size):
+                return 0
+            size = min(size, self.size - start)
+        if (direct and hasattr(os, 'preadv')):
+            self.stats.record(start, size)
+            return os.preadv(self.file.fileno(), [memoryview(buffer)[:size]], self.offset + start)
+        if (self.view != None):
+            self.stats.record(start, size)
+            start += self.offset
+            buffer[:size] = self.view[start:start + size]
+            return size
+        if (self.cache != None):
+            data = self.cache.read(start, size)
+        else:
+            data = self.fetch(start, size)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read_sector(self, start, cnt, bytes_per_sector):
+        return self.read(start * bytes_per_sector, cnt * bytes_per_sector)
+
+    def close(self):
+        if (self.cache != None):
+            self.cache.clear()
+        if (self.view != None):
+            self.view.release()
+            self.view = None
+        if (self.map != None):
+            try:
+                self.map.close()
+            except BufferError:
+                # slices handed out to callers are still alive, the map is freed with them
+                pass
+            self.map = None
+        self.file.close()
+
+# read-only, seekable file over an extent map: (file offset, volume offset or None for a hole, length)
+# entries sorted by file offset; small files kept in memory (NTFS resident data) are passed as `data`
+# iterating yields the remaining content in STREAM_CHUNK_SIZE pieces
+# with direct set, reads skip the volume map (see Volume.readinto), for files read from several threads
+class ExtentFile:
+    def __init__(self, volume, extents, size, name = None, data = None, direct = False):
+        self.volume = volume
+        self.direct = direct
+        self.extents = extents
+        self.starts = [extent[0] for extent in extents]
+        self.size = size
+        self.name = name
+        self.data = data
+        self.pos = 0
+        self.closed = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence = os.SEEK_SET):
+        if (whence == os.SEEK_CUR):
+            offset += self.pos
+        elif (whence == os.SEEK_END):
+            offset += self.size
+        if (offset < 0):
+            raise ValueError('negative seek position')
+        self.pos = offset
+        return self.pos
+
+    # fill `buffer` from the current position; only the extents under the requested range are read
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        count = max(0, min(len(view), self.size - self.pos))
+        if (self.data != None):
+            view[:count] = self.data[self.pos:self.pos + count]
+            self.pos += count
+            return count
+        done = 0
+        i = bisect_right(self.starts, self.pos) - 1
+        while (done < count):
+            pos = self.pos + done
+            if (i < 0 or pos >= self.extents[i][0] + self.extents[i][2]):
+                # not covered by any extent: zeros up to the next extent
+                nextStart = self.extents[i + 1][0] if (i + 1 < len(self.extents)) else self.size
+                take = min(nextStart - pos, count - done)
+                view[done:done + take] = bytes(take)
+                done += take
+                i += 1
+                continue
+            fileOffset, volumeOffset, length = self.extents[i]
+            inner = pos - fileOffset
+            take = min(length - inner, count - done)
+            if (volumeOffset == None):
+                view[done:done + take] = bytes(take)
+            else:
+                got = self.volume.readinto(volumeOffset + inner, view[done:done + take], self.direct)
+                if (got < take):
+                    done += got
+                    break
+            done += take
+            i += 1
+        self.pos += done
+        return done
+
+    def read(self, size = -1):
+        if (size == None or size < 0):
+            size = max(0, self.size - self.pos)
+        buffer = bytearray(min(size, max(0, self.size - self.pos)))
+        count = self.readinto(buffer)
+        del buffer[count:]
+        return bytes(buffer)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(STREAM_CHUNK_SIZE)
+            if (len(chunk) == 0):
+                return
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
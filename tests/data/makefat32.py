@@ -0,0 +1,82 @@
+# write fat32.img.gz, a FAT32 image formatted and filled by pyfatfs (pip install pyfatfs) rather than imagegen
+# the tree is in fat32.json with the size and sha256 of every file, test_images.py checks the image against it
+# python makefat32.py
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+from pyfatfs.PyFat import PyFat
+from pyfatfs.PyFatFS import PyFatFS
+
+SIZE = 40 * 1024 * 1024
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# long file name edge cases: 13 characters fill one LFN entry exactly, 14 and 27 spill into the next,
+# lower case 8.3 names, names whose short forms collide (~1, ~2), dots, spaces and non-ASCII characters
+NAMES = [
+    'exactly13.txt', 'fourteen14.txt', 'twenty-six-characters.txt', 'twenty-seven-characters.txt',
+    'readme.txt', 'MixedCase.Txt', 'PLAIN.TXT', 'NOEXT',
+    'Long File Name 1.txt', 'Long File Name 2.txt', 'Long File Name 3.txt',
+    'name~1.txt', 'a.b.c.d', '.hidden', 'trailing dots.tar.gz', 'café ünïcode.txt', '日本語のファイル.txt',
+    'x' * 123 + '.bin',
+]
+
+# every 16 byte line names its file and offset, so a cluster read from the wrong place shows up in the hash
+def content(random, size):
+    tag = random.getrandbits(24)
+    return b''.join(b'%06x %08x\n' % (tag, offset) for offset in range(0, size, 16))[:size]
+
+def main():
+    rng = random.Random(17)
+    tree = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fat32.img')
+        open(path, 'wb').close()
+        fat = PyFat()
+        fat.mkfs(path, PyFat.FAT_TYPE_FAT32, size = SIZE, label = 'FIXTURE', volume_id = 0x20261018)
+        fat.close()
+        fs = PyFatFS(path)
+        for name in NAMES:
+            data = content(rng, rng.randrange(1, 3000))
+            fs.writebytes('/' + name, data)
+            tree[name] = data
+        tree['empty.txt'] = b''
+        fs.writebytes('/empty.txt', b'')
+
+        # a directory of 40 long names spans several 512 byte clusters
+        fs.makedirs('/Many Entries/Nested Directory With A Long Name')
+        tree['Many Entries'] = {'Nested Directory With A Long Name': {}}
+        for i in range(40):
+            name = f'entry number {i:02d} with a long name.dat'
+            data = content(rng, rng.randrange(0, 700))
+            fs.writebytes('/Many Entries/' + name, data)
+            tree['Many Entries'][name] = data
+        data = content(rng, 5000)
+        fs.writebytes('/Many Entries/Nested Directory With A Long Name/deep.bin', data)
+        tree['Many Entries']['Nested Directory With A Long Name']['deep.bin'] = data
+
+        # two files appended to in turn, so their clusters interleave and each is cut into many runs
+        fs.makedir('/fragmented')
+        tree['fragmented'] = {'left.bin': b'', 'right.bin': b''}
+        for i in range(24):
+            for name in ('left.bin', 'right.bin'):
+                piece = content(rng, 512 + (i % 3) * 512)
+                with fs.openbin('/fragmented/' + name, 'ab') as f:
+                    f.write(piece)
+                tree['fragmented'][name] += piece
+        fs.close()
+
+        with open(path, 'rb') as source, gzip.GzipFile(os.path.join(HERE, 'fat32.img.gz'), 'wb', mtime = 0) as target:
+            shutil.copyfileobj(source, target)
+
+    def describe(tree):
+        return {name: describe(value) if isinstance(value, dict) else [len(value), hashlib.sha256(value).hexdigest()] for name, value in tree.items()}
+    with open(os.path.join(HERE, 'fat32.json'), 'w', encoding = 'utf-8') as f:
+        json.dump(describe(tree), f, ensure_ascii = False, indent = 1)
+        f.write('\n')
+
+if __name__ == "__main__":
+    main()
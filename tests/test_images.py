@@ -0,0 +1,199 @@
+# build FAT32 and NTFS images with imagegen and check that the explorer sees exactly the generated tree
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Source'))
+import imagegen
+from FAT32 import FAT32
+from NTFS import NTFS
+
+CLUSTER = 4096
+
+# a generated tree plus a large file with an all-zero second quarter, which buildNtfs(sparse = True)
+# stores as a sparse run when it is cut into pieces
+def manifest(longNames = True):
+    tree = imagegen.generateTree(files = 60, depth = 2, fanout = 2, longNames = longNames, maxFileSize = 20000, seed = 1)
+    quarter = 3 * CLUSTER
+    tree['sparse.bin' if longNames else 'SPARSE.BIN'] = bytes(range(256)) * (quarter // 256) + bytes(quarter) + b'\x7f' * (2 * quarter)
+    tree['empty.txt' if longNames else 'EMPTY.TXT'] = b''
+    return tree
+
+# (path, bytes or None for a directory) of every entry below `tree`
+def entries(tree, base = ''):
+    for name, value in tree.items():
+        path = base + '/' + name
+        if (isinstance(value, dict)):
+            yield path, None
+            yield from entries(value, path)
+        else:
+            yield path, value
+
+# the tree seen through list_node/stat_node/open_node, in the manifest's shape
+def walk(disk, node):
+    tree = {}
+    for child in disk.list_node(node):
+        stat = disk.stat_node(child)
+        if (stat['name'] in ('.', '..') or stat['name'].startswith('$')):
+            continue
+        if (stat['isDir']):
+            tree[stat['name']] = walk(disk, child)
+        else:
+            with disk.open_node(child) as f:
+                tree[stat['name']] = f.read()
+            assert stat['size'] == len(tree[stat['name']])
+    return tree
+
+def build(tmp, fileSystem, fragment, longNames = True):
+    tree = manifest(longNames)
+    path = str(tmp / f'{fileSystem}-{fragment}-{longNames}.img')
+    if (fileSystem == 'fat32'):
+        imagegen.buildFat32(path, tree, sectorsPerCluster = CLUSTER // 512, fragment = fragment, seed = 2)
+    else:
+        imagegen.buildNtfs(path, tree, sectorsPerCluster = CLUSTER // 512, fragment = fragment, seed = 2, sparse = fragment > 2)
+    return path, tree
+
+VOLUMES = [
+    ('fat32', 0, True, {}),
+    ('fat32', 4, True, {}),
+    ('fat32', 4, False, {}),
+    ('ntfs', 0, True, {}),
+    ('ntfs', 4, True, {}),
+    ('ntfs', 4, True, {'scan': False}),
+]
+
+@pytest.fixture(scope = 'module', params = VOLUMES, ids = lambda volume: f'{volume[0]}-frag{volume[1]}' + ('' if volume[2] else '-short') + ('-noscan' if volume[3] else ''))
+def volume(request, tmp_path_factory):
+    fileSystem, fragment, longNames, options = request.param
+    path, tree = build(tmp_path_factory.mktemp('images'), fileSystem, fragment, longNames)
+    disk = FAT32(path, **options) if fileSystem == 'fat32' else NTFS(path, **options)
+    yield disk, tree
+    disk.ptr.close()
+
+def test_walk(volume):
+    disk, tree = volume
+    assert walk(disk, disk.getNode('/')) == tree
+
+def test_lookup_and_read(volume):
+    disk, tree = volume
+    for path, data in entries(tree):
+        node = disk.getNode(path)
+        assert node != None, path
+        stat = disk.stat_node(node)
+        assert stat['isDir'] == (data == None), path
+        if (data != None):
+            assert stat['size'] == len(data), path
+            with disk.open_node(node) as f:
+                assert f.read() == data, path
+    assert disk.getNode('/no such file') == None
+
+def test_lookup_ignores_case(volume):
+    disk, tree = volume
+    for path, data in entries(tree):
+        assert disk.getNode(path.upper()) != None, path
+
+def test_stat_times(volume):
+    disk, tree = volume
+    stat = disk.stat_node(disk.getNode('/readme.txt' if 'readme.txt' in tree else '/README.TXT'))
+    if (isinstance(disk, NTFS)):
+        # NTFS keeps UTC
+        assert stat['modified'] == imagegen.DEFAULT_TIME.replace(tzinfo = datetime.timezone.utc)
+    else:
+        # FAT32 keeps local time with a two-second resolution
+        assert stat['modified'] == imagegen.DEFAULT_TIME.replace(second = imagegen.DEFAULT_TIME.second // 2 * 2)
+
+def test_seek_and_partial_read(volume):
+    disk, tree = volume
+    name = 'sparse.bin' if 'sparse.bin' in tree else 'SPARSE.BIN'
+    data = tree[name]
+    with disk.open_node(disk.getNode('/' + name)) as f:
+        for offset in (0, 1, CLUSTER - 1, 3 * CLUSTER - 5, 6 * CLUSTER + 7, len(data) - 3):
+            f.seek(offset)
+            assert f.read(CLUSTER + 10) == data[offset:offset + CLUSTER + 10], offset
+
+def test_ntfs_sparse_run(tmp_path):
+    path, tree = build(tmp_path, 'ntfs', 4)
+    disk = NTFS(path)
+    try:
+        extents = disk.dataExtents(disk.getNode('/sparse.bin').entry)
+        assert any(volumeOffset == None for fileOffset, volumeOffset, length in extents)
+        assert sum(length for fileOffset, volumeOffset, length in extents) == len(tree['sparse.bin'])
+    finally:
+        disk.ptr.close()
+
+def test_ntfs_named_streams(tmp_path):
+    tree = manifest()
+    path = str(tmp_path / 'streams.img')
+    # a Zone.Identifier stream on every file, resident and non-resident ones alike
+    imagegen.buildNtfs(path, tree, sectorsPerCluster = CLUSTER // 512, fragment = 4, seed = 2, streams = {'Zone.Identifier': b'[ZoneTransfer]\r\nZoneId=3\r\n'})
+    for scan in (True, False):
+        disk = NTFS(path, scan = scan)
+        try:
+            assert walk(disk, disk.getNode('/')) == tree
+        finally:
+            disk.ptr.close()
+
+def test_fat32_extent_counts(tmp_path):
+    for fragment in (0, 4):
+        path, tree = build(tmp_path, 'fat32', fragment)
+        disk = FAT32(path)
+        try:
+            report = disk.analyze(perFile = True)
+            files = {path: data for path, data in entries(tree) if data}
+            assert report['files'] == len(files)
+            extents = {item['path']: item['extents'] for item in report['fileExtents']}
+            assert set(extents) == set(files)
+            assert report['fragmentedFiles'] == sum(1 for count in extents.values() if count > 1)
+            assert (report['fragmentedFiles'] > 0) == (fragment > 0)
+            for path, data in files.items():
+                clusters = -(-len(data) // CLUSTER)
+                assert 1 <= extents[path] <= clusters, path
+                # the same count from walking the chain one cluster at a time
+                chain = disk.fat.get_cluster_extents(disk.getNode(path).info.starting_cluster, clusters)
+                assert extents[path] == len(chain), path
+        finally:
+            disk.ptr.close()
+
+def test_partition_behind_mbr(tmp_path):
+    path, tree = build(tmp_path, 'fat32', 0)
+    disk = str(tmp_path / 'disk.img')
+    imagegen.wrapMbr(disk, path)
+    volume = FAT32(disk, 2048 * 512)
+    try:
+        assert walk(volume, volume.getNode('/')) == tree
+    finally:
+        volume.ptr.close()
+
+# an image formatted and filled by pyfatfs (tests/data/makefat32.py): files without the archive bit, long names
+# across LFN slot boundaries, colliding short names, non-ASCII names, multi-cluster directories and two files
+# written in turn so that each is cut into 24 runs
+def test_fat32_pyfatfs_image(tmp_path):
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    path = str(tmp_path / 'fat32.img')
+    with gzip.open(os.path.join(data, 'fat32.img.gz')) as source, open(path, 'wb') as target:
+        target.write(source.read())
+    with open(os.path.join(data, 'fat32.json'), encoding = 'utf-8') as f:
+        expected = json.load(f)
+
+    def digest(tree):
+        return {name: digest(value) if isinstance(value, dict) else [len(value), hashlib.sha256(value).hexdigest()] for name, value in tree.items()}
+    disk = FAT32(path)
+    try:
+        tree = walk(disk, disk.getNode('/'))
+        assert digest(tree) == expected
+        for path, value in entries(tree):
+            assert disk.getNode(path.upper()) != None, path
+        for name in ('left.bin', 'right.bin'):
+            node = disk.getNode('/fragmented/' + name)
+            assert len(disk.fat.get_cluster_extents(node.info.starting_cluster, node.info.file_size)) == 24
+            value = tree['fragmented'][name]
+            with disk.open_node(node) as f:
+                for offset in (0, 511, 1500, 7000, len(value) - 700):
+                    f.seek(offset)
+                    assert f.read(1100) == value[offset:offset + 1100], offset
+    finally:
+        disk.ptr.close()